@@ -1,10 +1,16 @@
 # Back_End/lambda_handler.py
 # Código que será comprimido y subido a AWS Lambda.
 
+import io
 import json
 import boto3
 import os
+import time
+import uuid
 import logging
+import itertools
+import http.client
+from types import SimpleNamespace
 
 # Configuración de Logging
 logger = logging.getLogger()
@@ -12,36 +18,248 @@ logger.setLevel(logging.INFO)
 
 # El nombre del Endpoint se lee desde las variables de entorno de la Lambda
 ENDPOINT_NAME = os.environ.get('ENDPOINT_NAME') 
-runtime = boto3.client('sagemaker-runtime')
+# Modo directo (solo con MODO_DIRECTO=1): la Lambda carga el índice compacto y el codificador
+# cuantizado empaquetados junto a este archivo, recupera en proceso y llama a Gemini sin pasar
+# por SageMaker. Requiere el paquete generado por deploy_full_stack.
+MODO_DIRECTO = os.environ.get('MODO_DIRECTO', '0') == '1'
+MENSAJE_SIN_ENDPOINT = 'Falta la variable de entorno ENDPOINT_NAME (o MODO_DIRECTO=1 para el modo directo).'
+PAQUETE_DIRECTO = os.environ.get('PAQUETE_DIRECTO', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_bundle'))
+if MODO_DIRECTO:
+    # El Proxy lee su configuración al importarse: artefacto local en lugar de S3 y sin
+    # micro-lotes (una solicitud a la vez por contenedor de Lambda)
+    os.environ.setdefault('ARTEFACTO_LOCAL', PAQUETE_DIRECTO)
+    os.environ.setdefault('MOTOR_BUSQUEDA', 'plano')
+    os.environ.setdefault('BATCH_MAX_TAMANO', '1')
+# STREAM_HABILITADO=1 usa streaming aunque el cliente no envíe "stream": true. Detrás de
+# API Gateway (integración proxy) la respuesta NDJSON se entrega completa al final; para recibir
+# cada línea al llegar, la función se sirve con bucle_runtime_streaming detrás de una Function
+# URL con InvokeMode=RESPONSE_STREAM (ver README).
+STREAM_HABILITADO = os.environ.get('STREAM_HABILITADO', '0') == '1'
+# Presupuesto de tiempo que se envía al Proxy: lo que le queda a la Lambda menos un margen,
+# sin superar el límite de invoke_endpoint (60 s)
+MARGEN_PLAZO_MS = int(os.environ.get('MARGEN_PLAZO_MS', '1500'))
+PLAZO_MAX_MS = int(os.environ.get('PLAZO_MAX_MS', '55000'))
+CODIGO_PLAZO_AGOTADO = 'DEADLINE_EXCEEDED'
+MENSAJE_PLAZO = 'La respuesta tardó demasiado. Intente de nuevo.'
+# Respuesta HTTP en streaming de una Function URL: JSON con código y headers, 8 bytes nulos y el cuerpo
+TIPO_RESPUESTA_STREAMING = 'application/vnd.awslambda.http-integration-response'
+SEPARADOR_STREAMING = b'\x00' * 8
 
-def lambda_handler(event, context):
+
+class RuntimeDirecto:
+    """
+    Sustituye a sagemaker-runtime en modo directo: ejecuta predict_fn/output_fn del Proxy en
+    el mismo proceso. El índice, el codificador y el cliente de Gemini se cargan en la primera
+    invocación y se reutilizan mientras el contenedor de la Lambda siga caliente.
+    """
+
+    def __init__(self, proxy=None, contexto=None):
+        self.proxy = proxy
+        self.contexto = contexto
+
+    def _cargar(self):
+        if self.contexto is None:
+            import gemini_proxy
+            self.proxy = gemini_proxy
+            self.contexto = gemini_proxy.model_fn(PAQUETE_DIRECTO)
+        return self.proxy, self.contexto
+
+    def invoke_endpoint(self, EndpointName, ContentType, Body, **_):
+        proxy, contexto = self._cargar()
+        cuerpo = proxy.output_fn(proxy.predict_fn(json.loads(Body), contexto), 'application/json')
+        return {'Body': io.BytesIO(cuerpo.encode('utf-8'))}
+
+    def invoke_endpoint_with_response_stream(self, EndpointName, ContentType, Accept, Body, **_):
+        proxy, contexto = self._cargar()
+        prediccion = proxy.predict_fn(json.loads(Body), contexto)
+        lineas = (json.dumps(fragmento, ensure_ascii=False) + '\n' for fragmento in
+                  (prediccion if not isinstance(prediccion, list) else iter(prediccion)))
+        return {'Body': ({'PayloadPart': {'Bytes': linea.encode('utf-8')}} for linea in lineas)}
+
+
+runtime = RuntimeDirecto() if MODO_DIRECTO else boto3.client('sagemaker-runtime')
+if not MODO_DIRECTO and not ENDPOINT_NAME:
+    logger.error(MENSAJE_SIN_ENDPOINT)
+
+
+def calcular_plazo_ms(context) -> int:
+    """Milisegundos disponibles para el Proxy según el tiempo restante de la Lambda."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return PLAZO_MAX_MS
+    return max(0, min(PLAZO_MAX_MS, context.get_remaining_time_in_millis() - MARGEN_PLAZO_MS))
+
+
+def iterar_fragmentos(event_stream):
+    """
+    Lee el EventStream de invoke_endpoint_with_response_stream y produce cada
+    fragmento JSON del Proxy. Las líneas pueden llegar partidas entre PayloadParts.
+    """
+    buffer = b''
+    for evento in event_stream:
+        parte = evento.get('PayloadPart')
+        if not parte:
+            continue
+        buffer += parte['Bytes']
+        while b'\n' in buffer:
+            linea, buffer = buffer.split(b'\n', 1)
+            if linea.strip():
+                yield json.loads(linea)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+def obtener_id_correlacion(event, context) -> str:
+    """Usa el X-Correlation-Id del cliente si viene; si no, el request id de la Lambda."""
+    encabezados = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if encabezados.get('x-correlation-id'):
+        return encabezados['x-correlation-id']
+    return getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+
+
+def registrar_solicitud(id_correlacion: str, tramos: dict, inicio: float, **datos):
+    """Línea de log estructurada con los tramos de tiempo (ms) de la Lambda."""
+    logger.info(json.dumps({
+        "evento": "solicitud", "origen": "lambda", "correlation_id": id_correlacion,
+        "total_ms": round((time.perf_counter() - inicio) * 1000, 2), "tramos_ms": tramos, **datos
+    }, ensure_ascii=False))
+
+
+def registrar_al_terminar(lineas, id_correlacion: str, tramos: dict, inicio: float, **datos):
+    """Reemite las líneas del stream y deja la línea de log de la solicitud cuando terminan."""
+    try:
+        yield from lineas
+    except Exception as e:
+        registrar_solicitud(id_correlacion, tramos, inicio, error=type(e).__name__, **datos)
+        raise
+    registrar_solicitud(id_correlacion, tramos, inicio, **datos)
+
+
+def tramo_invocacion() -> str:
+    """Etiqueta del tramo de invocación según el runtime inyectado, no según MODO_DIRECTO (el benchmark los intercambia)."""
+    return 'invoke_directo' if isinstance(runtime, RuntimeDirecto) else 'invoke_sagemaker'
+
+
+def responder_en_stream(pregunta: str, plazo_ms: int = PLAZO_MAX_MS, id_correlacion: str | None = None):
+    """
+    Invoca el Endpoint por la ruta de streaming y produce líneas NDJSON para el cliente:
+    {"token": ...} por fragmento y {"answer": ..., "done": true} al final.
+    """
+    response = runtime.invoke_endpoint_with_response_stream(
+        EndpointName=ENDPOINT_NAME,
+        ContentType='application/json',
+        Accept='application/jsonlines',
+        Body=json.dumps({"inputs": pregunta, "stream": True, "deadline_ms": plazo_ms, "correlation_id": id_correlacion})
+    )
+    for fragmento in iterar_fragmentos(response['Body']):
+        if fragmento.get('error'):
+            mensaje = MENSAJE_PLAZO if fragmento['error'] == CODIGO_PLAZO_AGOTADO else fragmento.get('message', '')
+            yield json.dumps({'error': mensaje, 'code': fragmento['error'], 'done': True}) + '\n'
+            return
+        if fragmento.get('done'):
+            yield json.dumps({'answer': fragmento.get('generated_text', ''), 'done': True}) + '\n'
+        else:
+            yield json.dumps({'token': fragmento.get('token', '')}) + '\n'
+
+def respuesta_en_stream(pregunta: str, headers: dict, plazo_ms: int, id_correlacion: str) -> tuple[int, dict, object]:
     """
-    Función principal de Lambda que invoca el Endpoint de SageMaker.
+    Abre el stream y lee su primera línea antes de fijar el código HTTP: si el Proxy agotó el
+    plazo antes de llamar a Gemini, la respuesta es un 504. Devuelve (código, headers, líneas).
+    """
+    lineas = responder_en_stream(pregunta, plazo_ms, id_correlacion)
+    primera = next(lineas, None)
+    if primera is not None and json.loads(primera).get('code') == CODIGO_PLAZO_AGOTADO:
+        logger.warning("Plazo agotado en el Proxy antes de iniciar el stream.")
+        return 504, headers, iter([json.dumps({'error': MENSAJE_PLAZO, 'code': CODIGO_PLAZO_AGOTADO})])
+    return 200, {**headers, 'Content-Type': 'application/x-ndjson'}, itertools.chain([primera] if primera else [], lineas)
+
+def responder_lote(preguntas: list, headers: dict, plazo_ms: int, id_correlacion: str) -> dict:
+    """Envía todas las preguntas en una sola invocación y devuelve {"answers": [...]} alineado."""
+    if not preguntas:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Falta la pregunta'})}
+
+    response = runtime.invoke_endpoint(
+        EndpointName=ENDPOINT_NAME,
+        ContentType='application/json',
+        Body=json.dumps({"inputs": preguntas, "deadline_ms": plazo_ms, "correlation_id": id_correlacion})
+    )
+    resultados = json.loads(response['Body'].read().decode())
+
+    respuestas = []
+    for r in resultados:
+        if r.get('error'):
+            respuestas.append({'error': r['error'], 'message': r.get('message', '')})
+        else:
+            respuestas.append({'answer': r.get('generated_text', '')})
+
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answers': respuestas})}
+
+def lambda_handler(event, context, streaming: bool = False):
+    """
+    Función principal de Lambda que invoca el Endpoint de SageMaker (o el Proxy en proceso
+    en modo directo). Con `streaming` (bucle_runtime_streaming), el 'body' de una respuesta en
+    streaming es un iterador de líneas NDJSON en lugar de un texto.
     """
     # --- 1. CONFIGURACIÓN CORS ---
     headers = {
         "Access-Control-Allow-Origin": "*", 
-        "Access-Control-Allow-Headers": "Content-Type",
+        "Access-Control-Allow-Headers": "Content-Type,X-Correlation-Id",
+        "Access-Control-Expose-Headers": "X-Correlation-Id",
         "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
     }
     
     # Manejo de la solicitud CORS "preflight" (OPTIONS)
-    if event.get('httpMethod') == 'OPTIONS':
+    metodo = event.get('httpMethod') or ((event.get('requestContext') or {}).get('http') or {}).get('method')
+    if metodo == 'OPTIONS':
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps('CORS OK')}
     
+    inicio = time.perf_counter()
+    tramos = {}
+    id_correlacion = obtener_id_correlacion(event, context)
+    headers["X-Correlation-Id"] = id_correlacion
+
     try:
+        if not ENDPOINT_NAME and not isinstance(runtime, RuntimeDirecto):
+            raise ValueError(MENSAJE_SIN_ENDPOINT)
+
         # 2. Leer la pregunta
+        t = time.perf_counter()
         body_str = event.get('body', '{}')
         body = json.loads(body_str) if isinstance(body_str, str) else body_str
         pregunta = body.get('question', '') or body.get('inputs', '')
+        incluir_tiempos = bool(body.get('timings', False))
+        tramos['parse_json'] = round((time.perf_counter() - t) * 1000, 2)
         
+        # Lote de preguntas: respuestas alineadas, con error por elemento
+        if isinstance(body.get('questions'), list):
+            t = time.perf_counter()
+            respuesta = responder_lote(body['questions'], headers, calcular_plazo_ms(context), id_correlacion)
+            tramos[tramo_invocacion()] = round((time.perf_counter() - t) * 1000, 2)
+            registrar_solicitud(id_correlacion, tramos, inicio, lote=len(body['questions']))
+            return respuesta
+
         if not pregunta:
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Falta la pregunta'})}
 
-        # 3. Preparar payload para SageMaker
-        payload = {"inputs": pregunta}
+        # Modo streaming: se reenvían los fragmentos como NDJSON; solo con `streaming` llegan
+        # al cliente conforme se generan (con API Gateway se concatenan en una sola respuesta)
+        if body.get('stream', STREAM_HABILITADO):
+            t = time.perf_counter()
+            codigo, headers_stream, lineas = respuesta_en_stream(pregunta, headers, calcular_plazo_ms(context), id_correlacion)
+            tramos['primer_fragmento'] = round((time.perf_counter() - t) * 1000, 2)
+            if streaming:
+                # El total se registra cuando el stream termina de enviarse
+                lineas = registrar_al_terminar(lineas, id_correlacion, tramos, inicio, stream=True, codigo=codigo)
+                return {'statusCode': codigo, 'headers': headers_stream, 'body': lineas}
+            cuerpo = ''.join(lineas)
+            registrar_solicitud(id_correlacion, tramos, inicio, stream=True, codigo=codigo)
+            return {'statusCode': codigo, 'headers': headers_stream, 'body': cuerpo}
+
+        # 3. Preparar payload para SageMaker (con el plazo restante de la solicitud)
+        payload = {"inputs": pregunta, "deadline_ms": calcular_plazo_ms(context),
+                   "correlation_id": id_correlacion, "timings": incluir_tiempos}
         
         # 4. Invocar al Endpoint de SageMaker
+        t = time.perf_counter()
         response = runtime.invoke_endpoint(
             EndpointName=ENDPOINT_NAME,
             ContentType='application/json',
@@ -50,19 +268,103 @@ def lambda_handler(event, context):
         
         # 5. Procesar respuesta del Endpoint Proxy
         result = json.loads(response['Body'].read().decode())
+        tramos[tramo_invocacion()] = round((time.perf_counter() - t) * 1000, 2)
+
+        if result[0].get('error') == CODIGO_PLAZO_AGOTADO:
+            logger.warning(f"Plazo agotado en el Proxy: {result[0].get('message')}")
+            registrar_solicitud(id_correlacion, tramos, inicio, error=CODIGO_PLAZO_AGOTADO)
+            return {
+                'statusCode': 504,
+                'headers': headers,
+                'body': json.dumps({'error': 'La respuesta tardó demasiado. Intente de nuevo.', 'code': CODIGO_PLAZO_AGOTADO})
+            }
+
         texto_respuesta = result[0].get('generated_text', 'Respuesta no válida del Endpoint.')
 
+        t = time.perf_counter()
+        respuesta = {'answer': texto_respuesta}
+        if incluir_tiempos:
+            respuesta['timings'] = {'lambda_ms': tramos, 'proxy': result[0].get('timings')}
+        cuerpo = json.dumps(respuesta)
+        tramos['serializacion'] = round((time.perf_counter() - t) * 1000, 2)
+        registrar_solicitud(id_correlacion, tramos, inicio)
+
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps({'answer': texto_respuesta})
+            'body': cuerpo
         }
 
     except Exception as e:
-        logger.error(f"Error al invocar SageMaker: {str(e)}")
+        logger.error(f"Error al invocar SageMaker [{id_correlacion}]: {str(e)}")
+        registrar_solicitud(id_correlacion, tramos, inicio, error=type(e).__name__)
         # Devuelve un 500 con el error para el frontend
         return {
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': f'Error interno del servicio RAG. Revise logs.'})
-        }
\ No newline at end of file
+        }
+
+
+# --- RESPONSE STREAMING (Function URL con InvokeMode=RESPONSE_STREAM) ---
+
+def _enviar_trozo(conexion, datos: bytes):
+    if datos:
+        conexion.send(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+
+
+def atender_invocacion_streaming(conexion, id_solicitud: str, event: dict, context):
+    """
+    Ejecuta lambda_handler en modo streaming y envía la respuesta a la Runtime API por
+    partes (chunked): primero el código y los headers, luego cada línea NDJSON al generarse.
+    """
+    respuesta = lambda_handler(event, context, streaming=True)
+    conexion.putrequest('POST', f'/2018-06-01/runtime/invocation/{id_solicitud}/response')
+    conexion.putheader('Lambda-Runtime-Function-Response-Mode', 'streaming')
+    conexion.putheader('Transfer-Encoding', 'chunked')
+    conexion.putheader('Content-Type', TIPO_RESPUESTA_STREAMING)
+    conexion.endheaders()
+    preludio = {'statusCode': respuesta['statusCode'], 'headers': respuesta.get('headers', {})}
+    _enviar_trozo(conexion, json.dumps(preludio).encode('utf-8') + SEPARADOR_STREAMING)
+    cuerpo = respuesta.get('body', '')
+    try:
+        for linea in ([cuerpo] if isinstance(cuerpo, str) else cuerpo):
+            _enviar_trozo(conexion, linea.encode('utf-8'))
+    except Exception as e:
+        # El código 200 ya se envió: el error se informa como última línea del stream
+        logger.error(f"Error durante el stream: {e}")
+        _enviar_trozo(conexion, json.dumps({'error': 'Error interno del servicio RAG. Revise logs.', 'done': True}).encode() + b'\n')
+    conexion.send(b"0\r\n\r\n")
+    conexion.getresponse().read()
+
+
+def bucle_runtime_streaming(api: str | None = None):
+    """
+    Bucle de runtime propio sobre la Runtime API de Lambda: el runtime administrado de Python
+    no admite response streaming, así que la función se arranca con un exec wrapper que
+    ejecuta `python Lambda_Handler.py` (AWS_LAMBDA_EXEC_WRAPPER, ver README).
+    """
+    api = api or os.environ['AWS_LAMBDA_RUNTIME_API']
+    while True:
+        conexion = http.client.HTTPConnection(api)
+        conexion.request('GET', '/2018-06-01/runtime/invocation/next')
+        siguiente = conexion.getresponse()
+        id_solicitud = siguiente.getheader('Lambda-Runtime-Aws-Request-Id')
+        limite_ms = int(siguiente.getheader('Lambda-Runtime-Deadline-Ms'))
+        event = json.loads(siguiente.read() or b'{}')
+        context = SimpleNamespace(aws_request_id=id_solicitud,
+                                  get_remaining_time_in_millis=lambda: int(limite_ms - time.time() * 1000))
+        try:
+            atender_invocacion_streaming(conexion, id_solicitud, event, context)
+        except Exception as e:
+            logger.error(f"Error en la invocación {id_solicitud}: {e}")
+            conexion = http.client.HTTPConnection(api)
+            conexion.request('POST', f'/2018-06-01/runtime/invocation/{id_solicitud}/error',
+                             body=json.dumps({'errorMessage': str(e), 'errorType': type(e).__name__}))
+            conexion.getresponse().read()
+        finally:
+            conexion.close()
+
+
+if __name__ == '__main__':
+    bucle_runtime_streaming()
@@ -0,0 +1,97 @@
+# Back_End/answer_cache.py
+# Cache semantico de respuestas para el Proxy Gemini (se empaqueta junto a inference.py).
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheSemantico:
+    """
+    Cache en memoria de respuestas indexado por el embedding de la pregunta.
+    Una pregunta "acierta" si su similitud coseno con una pregunta guardada supera
+    el umbral configurado. Expulsión LRU con TTL y tope de memoria.
+    """
+
+    def __init__(self, similitud_min: float = 0.95, ttl_segundos: float = 3600,
+                 max_entradas: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.similitud_min = similitud_min
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.version_artefacto = None
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()  # id -> (vector, respuesta, creado, bytes)
+        self._bytes = 0
+        self._siguiente_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalizar(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norma = np.linalg.norm(v)
+        return v / norma if norma > 0 else v
+
+    def asignar_version(self, version: str | None):
+        """Vacía el cache si el artefacto RAG cargado por model_fn cambió."""
+        with self._lock:
+            if version != self.version_artefacto:
+                self._entradas.clear()
+                self._bytes = 0
+                self.version_artefacto = version
+
+    def _expulsar_caducadas(self, ahora: float):
+        caducadas = [k for k, (_, _, creado, _) in self._entradas.items() if ahora - creado > self.ttl_segundos]
+        for k in caducadas:
+            self._bytes -= self._entradas.pop(k)[3]
+
+    def buscar(self, vector) -> str | None:
+        """Devuelve la respuesta de la pregunta guardada más parecida, o None."""
+        consulta = self._normalizar(vector)
+        with self._lock:
+            self._expulsar_caducadas(time.time())
+            if not self._entradas:
+                self.fallos += 1
+                return None
+
+            ids = list(self._entradas.keys())
+            matriz = np.stack([self._entradas[k][0] for k in ids])
+            similitudes = matriz @ consulta
+            mejor = int(np.argmax(similitudes))
+
+            if similitudes[mejor] < self.similitud_min:
+                self.fallos += 1
+                return None
+
+            self._entradas.move_to_end(ids[mejor])
+            self.aciertos += 1
+            return self._entradas[ids[mejor]][1]
+
+    def guardar(self, vector, respuesta: str):
+        """Guarda una respuesta y aplica los límites de entradas y memoria (LRU)."""
+        v = self._normalizar(vector)
+        tamano = v.nbytes + len(respuesta.encode('utf-8'))
+        if tamano > self.max_bytes:
+            return
+
+        with self._lock:
+            self._entradas[self._siguiente_id] = (v, respuesta, time.time(), tamano)
+            self._siguiente_id += 1
+            self._bytes += tamano
+
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._bytes -= self._entradas.popitem(last=False)[1][3]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / total if total else 0.0,
+            }
@@ -0,0 +1,257 @@
+# Back_End/artifact_fetch.py
+# Descarga del artefacto RAG desde S3: GETs por rangos en paralelo y descompresión del ZIP
+# conforme llegan los bytes (sin copia completa del ZIP en disco), con cache local por
+# ETag/versión del objeto para que un reinicio no vuelva a descargar un artefacto sin cambios.
+
+import io
+import os
+import json
+import time
+import zlib
+import shutil
+import struct
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PARTE_BYTES = int(float(os.environ.get('ARTEFACTO_PARTE_MB', '8')) * 1024 * 1024)
+DESCARGAS_PARALELAS = int(os.environ.get('ARTEFACTO_DESCARGAS_PARALELAS', '8'))
+MAX_INTENTOS_RANGO = 3
+# Registro de la versión extraída (dentro de la carpeta de destino)
+MARCADOR_FILE = '.artefacto.json'
+# Fin de central directory (22 bytes) + comentario máximo del ZIP
+COLA_BYTES = 22 + 65535
+CABECERA_LOCAL = struct.Struct('<4s22xHH')
+FIRMA_CABECERA_LOCAL = b'PK\x03\x04'
+BLOQUE_EXTRACCION = 1 << 20
+
+
+def obtener_rango(cliente, bucket: str, key: str, version: dict, inicio: int, fin: int) -> bytes:
+    """Bytes [inicio, fin) del objeto, fijado a la versión leída en head_object (IfMatch/VersionId)."""
+    for intento in range(MAX_INTENTOS_RANGO):
+        try:
+            respuesta = cliente.get_object(Bucket=bucket, Key=key, Range=f'bytes={inicio}-{fin - 1}', **version)
+            datos = respuesta['Body'].read()
+            if len(datos) == fin - inicio:
+                return datos
+            error = IOError(f"rango {inicio}-{fin - 1} incompleto ({len(datos)} bytes)")
+        except Exception as e:
+            # El objeto cambió durante la descarga: reintentar no sirve
+            if 'PreconditionFailed' in str(e) or '412' in str(e):
+                raise
+            error = e
+        time.sleep(0.5 * 2 ** intento)
+    raise error
+
+
+class LectorRangos:
+    """
+    Lectura secuencial de [inicio, fin) del objeto: mantiene `paralelas` partes de `parte`
+    bytes descargándose por adelantado, así la memoria queda acotada a paralelas x parte.
+    """
+
+    def __init__(self, cliente, bucket: str, key: str, version: dict, inicio: int, fin: int,
+                 parte: int = PARTE_BYTES, paralelas: int = DESCARGAS_PARALELAS):
+        self._pedir_rango = lambda a, b: obtener_rango(cliente, bucket, key, version, a, b)
+        self.parte = parte
+        self.fin = fin
+        self.partes = 0
+        self._siguiente = inicio
+        self._buffer = memoryview(b'')
+        self._pendientes = deque()
+        self._pool = ThreadPoolExecutor(max_workers=paralelas)
+        for _ in range(paralelas):
+            self._pedir()
+
+    def _pedir(self):
+        if self._siguiente < self.fin:
+            fin = min(self._siguiente + self.parte, self.fin)
+            self._pendientes.append(self._pool.submit(self._pedir_rango, self._siguiente, fin))
+            self._siguiente = fin
+            self.partes += 1
+
+    def read(self, n: int) -> bytes:
+        trozos = []
+        while n > 0:
+            if not self._buffer:
+                if not self._pendientes:
+                    break
+                self._buffer = memoryview(self._pendientes.popleft().result())
+                self._pedir()
+            trozo, self._buffer = self._buffer[:n], self._buffer[n:]
+            trozos.append(trozo)
+            n -= len(trozo)
+        return b''.join(trozos)
+
+    def cerrar(self):
+        for futuro in self._pendientes:
+            futuro.cancel()
+        self._pool.shutdown(wait=True)
+
+
+class _FueraDeCola(Exception):
+    def __init__(self, posicion: int):
+        self.posicion = posicion
+
+
+class _Cola(io.RawIOBase):
+    """Archivo de `tamano` bytes del que solo se tienen los últimos, a partir de `inicio`."""
+
+    def __init__(self, datos: bytes, inicio: int, tamano: int):
+        self.datos = datos
+        self.inicio = inicio
+        self.tamano = tamano
+        self.posicion = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, desplazamiento: int, desde: int = 0) -> int:
+        base = {0: 0, 1: self.posicion, 2: self.tamano}[desde]
+        self.posicion = base + desplazamiento
+        return self.posicion
+
+    def tell(self) -> int:
+        return self.posicion
+
+    def read(self, n: int = -1) -> bytes:
+        if self.posicion < self.inicio:
+            raise _FueraDeCola(self.posicion)
+        desde = self.posicion - self.inicio
+        datos = self.datos[desde:] if n is None or n < 0 else self.datos[desde:desde + n]
+        self.posicion += len(datos)
+        return datos
+
+
+def indice_zip(cliente, bucket: str, key: str, version: dict, tamano: int) -> tuple[list[zipfile.ZipInfo], int]:
+    """
+    Lee solo la cola del objeto (fin de central directory y central directory) y devuelve las
+    entradas del ZIP y el desplazamiento donde empieza el central directory.
+    """
+    inicio = max(0, tamano - COLA_BYTES)
+    while True:
+        cola = _Cola(obtener_rango(cliente, bucket, key, version, inicio, tamano), inicio, tamano)
+        try:
+            with zipfile.ZipFile(cola) as zip_ref:
+                return zip_ref.infolist(), zip_ref.start_dir
+        except _FueraDeCola as e:
+            # El central directory empieza antes de la cola descargada
+            inicio = e.posicion
+
+
+def _ruta_segura(destino: str, nombre: str) -> str:
+    ruta = os.path.normpath(os.path.join(destino, nombre))
+    if os.path.commonpath([os.path.abspath(destino), os.path.abspath(ruta)]) != os.path.abspath(destino):
+        raise zipfile.BadZipFile(f"Entrada fuera de la carpeta de destino: {nombre}")
+    return ruta
+
+
+def extraer_en_stream(lector: LectorRangos, miembros: list[zipfile.ZipInfo], destino: str, inicio: int):
+    """
+    Extrae las entradas en el orden en que aparecen en el ZIP a partir de un lector secuencial:
+    cada entrada se descomprime bloque a bloque y se verifica su CRC.
+    """
+    posicion = inicio
+    for info in sorted(miembros, key=lambda i: i.header_offset):
+        # Huecos entre entradas (p. ej. data descriptors)
+        lector.read(info.header_offset - posicion)
+        firma, largo_nombre, largo_extra = CABECERA_LOCAL.unpack(lector.read(CABECERA_LOCAL.size))
+        if firma != FIRMA_CABECERA_LOCAL:
+            raise zipfile.BadZipFile(f"Cabecera local inválida en {info.filename}")
+        lector.read(largo_nombre + largo_extra)
+        posicion = info.header_offset + CABECERA_LOCAL.size + largo_nombre + largo_extra + info.compress_size
+
+        ruta = _ruta_segura(destino, info.filename)
+        if info.is_dir():
+            os.makedirs(ruta, exist_ok=True)
+            continue
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            descompresor = zlib.decompressobj(-15)
+        elif info.compress_type == zipfile.ZIP_STORED:
+            descompresor = None
+        else:
+            raise zipfile.BadZipFile(f"Compresión no soportada en {info.filename}: {info.compress_type}")
+
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        crc = 0
+        restante = info.compress_size
+        with open(ruta, 'wb') as salida:
+            while restante:
+                bloque = lector.read(min(restante, BLOQUE_EXTRACCION))
+                if not bloque:
+                    raise zipfile.BadZipFile(f"ZIP truncado en {info.filename}")
+                restante -= len(bloque)
+                datos = descompresor.decompress(bloque) if descompresor else bloque
+                crc = zlib.crc32(datos, crc)
+                salida.write(datos)
+            if descompresor:
+                datos = descompresor.flush()
+                crc = zlib.crc32(datos, crc)
+                salida.write(datos)
+        if crc != info.CRC:
+            raise zipfile.BadZipFile(f"CRC incorrecto en {info.filename}")
+
+
+def leer_marcador(destino: str) -> dict | None:
+    try:
+        with open(os.path.join(destino, MARCADOR_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def descargar_artefacto(cliente, bucket: str, key: str, destino: str,
+                        parte: int = PARTE_BYTES, paralelas: int = DESCARGAS_PARALELAS) -> str | None:
+    """
+    Deja en `destino` el contenido del ZIP s3://bucket/key y devuelve su ETag. Si `destino` ya
+    tiene extraída la misma versión (ETag y VersionId), no descarga nada. Si no, extrae en una
+    carpeta temporal que reemplaza a `destino` solo al terminar, con el marcador ya escrito: si la
+    descarga falla, `destino` conserva la versión anterior.
+    """
+    cabecera = cliente.head_object(Bucket=bucket, Key=key)
+    firma = {"bucket": bucket, "key": key, "etag": cabecera.get('ETag'), "version": cabecera.get('VersionId')}
+    if leer_marcador(destino) == firma:
+        print(f"Artefacto sin cambios en S3 ({firma['etag']}): se reutiliza {destino}")
+        return firma['etag']
+
+    inicio_descarga = time.perf_counter()
+    version = {"VersionId": firma['version']} if firma['version'] else {"IfMatch": firma['etag']}
+    tamano = cabecera['ContentLength']
+    miembros, fin_datos = indice_zip(cliente, bucket, key, version, tamano)
+
+    # La versión anterior sigue en `destino` mientras se extrae la nueva (si no caben las dos en
+    # memoria compartida, la extracción falla con ENOSPC y el Proxy extrae en disco)
+    temporal = destino.rstrip(os.sep) + '.parcial'
+    if os.path.exists(temporal):
+        shutil.rmtree(temporal)
+    os.makedirs(temporal)
+
+    inicio_datos = min((i.header_offset for i in miembros), default=fin_datos)
+    lector = LectorRangos(cliente, bucket, key, version, inicio_datos, fin_datos, parte, paralelas)
+    try:
+        extraer_en_stream(lector, miembros, temporal, inicio_datos)
+    except BaseException:
+        # Una extracción a medias (p. ej. sin espacio en tmpfs) no debe ocupar la carpeta
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    finally:
+        lector.cerrar()
+
+    with open(os.path.join(temporal, MARCADOR_FILE), 'w', encoding='utf-8') as f:
+        json.dump(firma, f)
+    # Intercambio: solo entre los dos rename no existe `destino`; los mmap abiertos sobre la
+    # versión anterior siguen siendo válidos aunque se borren sus archivos
+    anterior = destino.rstrip(os.sep) + '.anterior'
+    if os.path.exists(anterior):
+        shutil.rmtree(anterior)
+    if os.path.exists(destino):
+        os.rename(destino, anterior)
+    os.rename(temporal, destino)
+    shutil.rmtree(anterior, ignore_errors=True)
+    segundos = time.perf_counter() - inicio_descarga
+    print(f"Artefacto descargado y extraído en {segundos:.2f}s: {tamano / 1e6:.1f} MB, "
+          f"{len(miembros)} archivos, {lector.partes} partes ({paralelas} en paralelo)")
+    return firma['etag']
@@ -0,0 +1,82 @@
+# Back_End/batch_answer.py
+# Modo offline por lotes: lee preguntas de un JSONL, las responde con el mismo camino del Proxy
+# (predict_fn por lotes) y escribe las respuestas en otro JSONL, sin pasar por el Endpoint.
+#
+# Ejemplo:
+#   python batch_answer.py --entrada preguntas.jsonl --salida respuestas.jsonl --artefacto chroma_db.zip
+#
+# Cada línea de entrada es {"question": "..."} (o {"inputs": "..."}); los demás campos se copian
+# a la salida junto con "answer" o "error".
+
+import os
+import json
+import time
+import argparse
+from itertools import islice
+from types import SimpleNamespace
+
+
+def leer_lotes(path: str, tamano: int):
+    """Genera lotes de registros del JSONL sin cargar el archivo completo."""
+    with open(path, 'r', encoding='utf-8') as f:
+        registros = (json.loads(linea) for linea in f if linea.strip())
+        while True:
+            lote = list(islice(registros, tamano))
+            if not lote:
+                return
+            yield lote
+
+
+def cargar_proxy(artefacto: str | None):
+    """Importa el Proxy; con `artefacto` local, S3 se sustituye por la carpeta que lo contiene."""
+    if artefacto:
+        from benchmark import S3Local
+
+        artefacto = os.path.abspath(artefacto)
+        os.environ['DB_ZIP_KEY'] = os.path.basename(artefacto)
+        os.environ.setdefault('S3_BUCKET', 'local')
+
+    import gemini_proxy
+
+    if artefacto:
+        gemini_proxy.boto3 = SimpleNamespace(client=lambda *a, **kw: S3Local(os.path.dirname(artefacto)))
+    return gemini_proxy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Responde preguntas de un JSONL con el camino RAG del Proxy.")
+    parser.add_argument('--entrada', required=True)
+    parser.add_argument('--salida', required=True)
+    parser.add_argument('--artefacto', default=None, help="ZIP local del artefacto RAG (si no, se usa S3)")
+    parser.add_argument('--model-dir', default=None, help="Carpeta con embedding_model/ empaquetado")
+    parser.add_argument('--tamano-lote', type=int, default=32)
+    args = parser.parse_args()
+
+    proxy = cargar_proxy(args.artefacto)
+    contexto = proxy.model_fn(args.model_dir)
+
+    total, errores, inicio = 0, 0, time.perf_counter()
+    with open(args.salida, 'w', encoding='utf-8') as salida:
+        for lote in leer_lotes(args.entrada, args.tamano_lote):
+            preguntas = [r.get('question') or r.get('inputs') or '' for r in lote]
+            resultados = proxy.predict_fn({"inputs": preguntas}, contexto)
+
+            for registro, resultado in zip(lote, resultados):
+                fila = {k: v for k, v in registro.items() if k not in ('answer', 'error')}
+                if resultado.get('error'):
+                    fila.update(error=resultado['error'], message=resultado.get('message', ''))
+                    errores += 1
+                else:
+                    fila['answer'] = resultado['generated_text']
+                salida.write(json.dumps(fila, ensure_ascii=False) + '\n')
+            salida.flush()
+
+            total += len(lote)
+            print(f"{total} preguntas respondidas ({errores} con error)...")
+
+    duracion = time.perf_counter() - inicio
+    print(f"Listo: {total} preguntas en {duracion:.1f}s ({total / duracion:.2f}/s). Resultados en '{args.salida}'.")
+
+
+if __name__ == "__main__":
+    main()
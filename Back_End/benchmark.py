@@ -0,0 +1,428 @@
+# Back_End/benchmark.py
+# Banco de pruebas de carga offline para el camino de servicio RAG (Proxy y Lambda en proceso).
+# S3 se sustituye por una carpeta local y Gemini por un stub con latencia configurable.
+#
+# Ejemplo:
+#   python benchmark.py --artefacto chroma_db.zip --concurrencia 4 --solicitudes 200 --salida bench.json
+#   python benchmark.py --artefacto chroma_db.zip --sin-cache --comparar-modos --ms-por-1k-tokens 20
+#   python benchmark.py --artefacto chroma_db.zip --sin-cache --comparar-directo --latencia-endpoint-ms 20
+
+import os
+import io
+import json
+import time
+import random
+import hashlib
+import argparse
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+PREGUNTAS_DEFECTO = [
+    "¿Cuáles son los requisitos de admisión?",
+    "¿Cómo me titulo?",
+    "¿Cuántas horas de servicio social debo cumplir?",
+    "¿Qué nivel de inglés se requiere para egresar?",
+    "¿Qué es el CENEVAL?",
+    "¿Qué es Culturest?",
+    "¿Qué materias tiene el plan de estudios 2025-2?",
+    "¿Cómo funcionan las tutorías?",
+    "¿Cuál es la misión de la licenciatura?",
+    "¿Quiénes son los docentes del programa?",
+]
+
+
+# --- SUSTITUTOS LOCALES ---
+
+class S3Local:
+    """
+    Imita head_object/get_object de boto3 (con Range e IfMatch) leyendo de una carpeta local
+    (bucket ignorado). Cuenta las solicitudes GET para comprobar la cache del artefacto.
+    """
+
+    def __init__(self, carpeta: str):
+        self.carpeta = carpeta
+        self.gets = 0
+        self._etags = {}
+
+    def _ruta(self, key: str) -> str:
+        return os.path.join(self.carpeta, os.path.basename(key))
+
+    def _etag(self, key: str) -> str:
+        estado = os.stat(self._ruta(key))
+        clave = (key, estado.st_mtime_ns, estado.st_size)
+        if clave not in self._etags:
+            with open(self._ruta(key), 'rb') as f:
+                self._etags[clave] = f'"{hashlib.md5(f.read()).hexdigest()}"'
+        return self._etags[clave]
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": self._etag(Key), "ContentLength": os.path.getsize(self._ruta(Key))}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **_):
+        self.gets += 1
+        if IfMatch is not None and IfMatch != self._etag(Key):
+            raise RuntimeError("PreconditionFailed (412): el objeto cambió")
+        with open(self._ruta(Key), 'rb') as f:
+            if Range:
+                inicio, fin = (int(x) for x in Range.removeprefix('bytes=').split('-'))
+                f.seek(inicio)
+                return {"Body": io.BytesIO(f.read(fin - inicio + 1))}
+            return {"Body": io.BytesIO(f.read())}
+
+
+class CachesStub:
+    """Imita client.caches (context caching): guarda el texto de cada contexto en memoria."""
+
+    def __init__(self):
+        self.contextos = {}
+        self.creados = 0
+
+    def create(self, model, config):
+        self.creados += 1
+        nombre = f"cachedContents/{self.creados}"
+        texto = (getattr(config, 'system_instruction', '') or '') + "".join(getattr(config, 'contents', None) or [])
+        self.contextos[nombre] = SimpleNamespace(name=nombre, display_name=config.display_name, texto=texto,
+                                                 create_time=datetime.now(timezone.utc))
+        return self.contextos[nombre]
+
+    def list(self):
+        return list(self.contextos.values())
+
+    def update(self, name, config):
+        return self.contextos[name]
+
+    def delete(self, name):
+        self.contextos.pop(name, None)
+
+
+class GeminiStub:
+    """
+    Cliente falso de Gemini: responde tras una latencia (ms) con jitter, contando tokens aproximados.
+    Cada 1000 tokens de entrada suman `ms_por_1k_tokens`; los tokens en cache cuentan un cuarto.
+    """
+
+    def __init__(self, latencia_ms: float = 800, jitter_ms: float = 200, fragmentos: int = 8,
+                 ms_por_1k_tokens: float = 0.0, **_):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.fragmentos = fragmentos
+        self.ms_por_1k_tokens = ms_por_1k_tokens
+        self.models = self
+        self.caches = CachesStub()
+
+    def _dormir(self, fraccion: float = 1.0, tokens_entrada: float = 0.0):
+        ms = max(0.0, random.gauss(self.latencia_ms, self.jitter_ms)) * fraccion
+        time.sleep((ms + tokens_entrada / 1000 * self.ms_por_1k_tokens) / 1000)
+
+    def _uso(self, contents, config, texto: str):
+        """usage_metadata como Gemini: prompt_token_count incluye los tokens en cache."""
+        entrada = "".join(contents) + (getattr(config, 'system_instruction', None) or '')
+        cache = self.caches.contextos.get(getattr(config, 'cached_content', None))
+        cacheados = len(cache.texto) // 4 if cache else 0
+        return SimpleNamespace(prompt_token_count=len(entrada) // 4 + cacheados,
+                               cached_content_token_count=cacheados,
+                               candidates_token_count=len(texto) // 4)
+
+    def generate_content(self, model, contents, config=None):
+        texto = "Respuesta simulada del benchmark."
+        uso = self._uso(contents, config, texto)
+        self._dormir(tokens_entrada=uso.prompt_token_count - 0.75 * uso.cached_content_token_count)
+        return SimpleNamespace(text=texto, usage_metadata=uso)
+
+    def generate_content_stream(self, model, contents, config=None):
+        for i in range(self.fragmentos):
+            self._dormir(1 / self.fragmentos)
+            yield SimpleNamespace(text=f"frag{i} ", usage_metadata=None)
+
+
+class RuntimeLocal:
+    """
+    Imita sagemaker-runtime.invoke_endpoint llamando a predict_fn/output_fn en proceso.
+    `latencia_ms` simula el salto de red Lambda -> Endpoint (ida y vuelta).
+    """
+
+    def __init__(self, proxy, contexto, latencia_ms: float = 0.0):
+        self.proxy = proxy
+        self.contexto = contexto
+        self.latencia_ms = latencia_ms
+
+    def invoke_endpoint(self, EndpointName, ContentType, Body, **_):
+        time.sleep(self.latencia_ms / 1000)
+        prediccion = self.proxy.predict_fn(json.loads(Body), self.contexto)
+        cuerpo = self.proxy.output_fn(prediccion, 'application/json')
+        return {"Body": io.BytesIO(cuerpo.encode('utf-8') if isinstance(cuerpo, str) else cuerpo)}
+
+
+# --- PREPARACIÓN ---
+
+def cargar_proxy(carpeta_artefacto: str, nombre_artefacto: str, latencia_ms: float, jitter_ms: float,
+                 ms_por_1k_tokens: float = 0.0):
+    """Importa gemini_proxy con S3 y Gemini sustituidos."""
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ.setdefault('S3_BUCKET', 'local')
+    os.environ['DB_ZIP_KEY'] = nombre_artefacto
+
+    import gemini_proxy
+    gemini_proxy.boto3 = SimpleNamespace(client=lambda *a, **kw: S3Local(carpeta_artefacto))
+    gemini_proxy.genai = SimpleNamespace(Client=lambda **kw: GeminiStub(latencia_ms, jitter_ms,
+                                                                        ms_por_1k_tokens=ms_por_1k_tokens))
+    return gemini_proxy
+
+
+def leer_preguntas(path: str | None) -> list[str]:
+    if not path:
+        return PREGUNTAS_DEFECTO
+    with open(path, 'r', encoding='utf-8') as f:
+        lineas = [l.strip() for l in f if l.strip()]
+    if path.endswith('.jsonl'):
+        return [json.loads(l).get('question') or json.loads(l).get('inputs') for l in lineas]
+    return lineas
+
+
+def percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(round(p / 100 * (len(ordenados) - 1))), len(ordenados) - 1)]
+
+
+def commit_actual() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- EJECUCIÓN ---
+
+def crear_llamada(modo: str, proxy, contexto, latencia_endpoint_ms: float = 0.0):
+    """
+    Devuelve una función pregunta -> (ms, tramos_ms, tokens) para el camino elegido:
+    'proxy' (predict_fn directo), 'lambda' (Lambda -> Endpoint simulado) o 'directo'
+    (Lambda en modo directo, con el Proxy en su mismo proceso).
+    """
+    if modo in ('lambda', 'directo'):
+        # La Lambda exige ENDPOINT_NAME fuera del modo directo; RuntimeLocal no lo usa
+        os.environ.setdefault('ENDPOINT_NAME', 'benchmark-local')
+        import Lambda_Handler
+        if modo == 'lambda':
+            Lambda_Handler.runtime = RuntimeLocal(proxy, contexto, latencia_endpoint_ms)
+        else:
+            Lambda_Handler.runtime = Lambda_Handler.RuntimeDirecto(proxy, contexto)
+
+        def llamar(pregunta):
+            inicio = time.perf_counter()
+            r = Lambda_Handler.lambda_handler({"body": json.dumps({"question": pregunta, "timings": True})}, None)
+            ms = (time.perf_counter() - inicio) * 1000
+            if r['statusCode'] != 200:
+                raise RuntimeError(r['body'])
+            tiempos = json.loads(r['body']).get('timings') or {}
+            tramos = dict((tiempos.get('proxy') or {}).get('tramos_ms', {}))
+            tramos.update({f"lambda_{k}": v for k, v in tiempos.get('lambda_ms', {}).items()})
+            return ms, tramos, tokens_de(tiempos.get('proxy') or {})
+    else:
+        def llamar(pregunta):
+            inicio = time.perf_counter()
+            r = proxy.predict_fn({"inputs": pregunta, "timings": True}, contexto)
+            proxy.output_fn(r, 'application/json')
+            ms = (time.perf_counter() - inicio) * 1000
+            if r[0].get('error'):
+                raise RuntimeError(r[0]['error'])
+            tiempos = r[0].get('timings') or {}
+            return ms, tiempos.get('tramos_ms', {}), tokens_de(tiempos)
+    return llamar
+
+
+def tokens_de(resumen: dict) -> dict:
+    """Tokens de la solicitud según la traza del Proxy (0 si no hubo llamada a Gemini, p. ej. cache)."""
+    return {k: resumen.get(k) or 0 for k in ("tokens_prompt", "tokens_cacheados", "tokens_respuesta")}
+
+
+def costo_por_solicitud(tokens: dict, precios: dict) -> float:
+    """Costo en USD de una solicitud: entrada sin cache, entrada en cache y salida (precios por millón)."""
+    sin_cache = tokens["tokens_prompt"] - tokens["tokens_cacheados"]
+    return (sin_cache * precios["entrada"] + tokens["tokens_cacheados"] * precios["cache"]
+            + tokens["tokens_respuesta"] * precios["salida"]) / 1_000_000
+
+
+def resumen_micro_lotes(agrupador) -> dict | None:
+    """Tamaño de los lotes que armó el agrupador de consultas del Proxy (incluye el calentamiento)."""
+    if agrupador is None or not agrupador.lotes_procesados:
+        return None
+    return {"lotes": agrupador.lotes_procesados, "preguntas": agrupador.preguntas_procesadas,
+            "tamano_medio": round(agrupador.preguntas_procesadas / agrupador.lotes_procesados, 2),
+            "tamano_maximo": agrupador.lote_maximo}
+
+
+def ejecutar(llamar, preguntas: list[str], solicitudes: int, concurrencia: int, tasa: float | None,
+             precios: dict | None = None) -> dict:
+    """
+    Reproduce las preguntas con concurrencia fija (lazo cerrado) o, si `tasa` está definida,
+    con llegadas a tasa fija por segundo (lazo abierto).
+    """
+    latencias, errores, tramos, tokens = [], [], {}, []
+    lock = threading.Lock()
+
+    def una(i):
+        try:
+            ms, t, tk = llamar(preguntas[i % len(preguntas)])
+            with lock:
+                latencias.append(ms)
+                tokens.append(tk)
+                for k, v in t.items():
+                    tramos.setdefault(k, []).append(v)
+        except Exception as e:
+            with lock:
+                errores.append(str(e))
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        if tasa:
+            futuros = []
+            for i in range(solicitudes):
+                espera = inicio + i / tasa - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                futuros.append(pool.submit(una, i))
+            for f in futuros:
+                f.result()
+        else:
+            list(pool.map(una, range(solicitudes)))
+    duracion = time.perf_counter() - inicio
+
+    return {
+        "solicitudes": solicitudes,
+        "errores": len(errores),
+        "duracion_s": round(duracion, 3),
+        "rps": round(len(latencias) / duracion, 2) if duracion else 0.0,
+        "latencia_ms": {
+            "p50": round(percentil(latencias, 50), 2),
+            "p95": round(percentil(latencias, 95), 2),
+            "p99": round(percentil(latencias, 99), 2),
+            "media": round(statistics.fmean(latencias), 2) if latencias else 0.0,
+        },
+        "tramos_ms_p50": {k: round(percentil(v, 50), 2) for k, v in sorted(tramos.items())},
+        "tokens_por_solicitud": {k: round(statistics.fmean(t[k] for t in tokens), 1) if tokens else 0.0
+                                 for k in ("tokens_prompt", "tokens_cacheados", "tokens_respuesta")},
+        "costo_usd_por_1000": round(1000 * statistics.fmean(costo_por_solicitud(t, precios) for t in tokens), 4)
+                              if tokens and precios else None,
+        "ejemplos_error": errores[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del camino de servicio RAG.")
+    parser.add_argument('--artefacto', default='chroma_db.zip', help="ZIP generado por rag_creator")
+    parser.add_argument('--model-dir', default=None, help="Carpeta con embedding_model/ empaquetado")
+    parser.add_argument('--modo', choices=['proxy', 'lambda', 'directo'], default='proxy')
+    parser.add_argument('--latencia-endpoint-ms', type=float, default=20,
+                        help="Salto de red simulado Lambda -> Endpoint en modo lambda")
+    parser.add_argument('--comparar-directo', action='store_true',
+                        help="Compara la Lambda vía Endpoint (modo lambda) con la Lambda en modo directo")
+    parser.add_argument('--preguntas', default=None, help="Archivo .txt (una por línea) o .jsonl")
+    parser.add_argument('--solicitudes', type=int, default=100)
+    parser.add_argument('--concurrencia', type=int, default=1)
+    parser.add_argument('--tasa', type=float, default=None, help="Llegadas por segundo (lazo abierto)")
+    parser.add_argument('--latencia-gemini-ms', type=float, default=800)
+    parser.add_argument('--jitter-gemini-ms', type=float, default=200)
+    parser.add_argument('--ms-por-1k-tokens', type=float, default=0.0,
+                        help="Latencia extra del stub por cada 1000 tokens de entrada (los de cache cuentan 1/4)")
+    parser.add_argument('--modo-respuesta', choices=['rag', 'completo'], default=None,
+                        help="MODO_RESPUESTA del Proxy (por defecto, el de la variable de entorno)")
+    parser.add_argument('--comparar-modos', action='store_true',
+                        help="Ejecuta el benchmark en modo rag y en modo completo y compara latencia y costo")
+    parser.add_argument('--precio-entrada', type=float, default=0.30, help="USD por millón de tokens de entrada")
+    parser.add_argument('--precio-cache', type=float, default=0.075, help="USD por millón de tokens en cache")
+    parser.add_argument('--precio-salida', type=float, default=2.50, help="USD por millón de tokens de salida")
+    parser.add_argument('--sin-cache', action='store_true', help="Desactiva el cache semántico de respuestas")
+    parser.add_argument('--calentamiento', type=int, default=5, help="Solicitudes previas no medidas")
+    parser.add_argument('--salida', default=None, help="Archivo JSON con el resultado")
+    args = parser.parse_args()
+
+    if args.comparar_modos:
+        return comparar(args, '--comparar-modos', {modo: ['--modo-respuesta', modo] for modo in ('rag', 'completo')})
+    if args.comparar_directo:
+        return comparar(args, '--comparar-directo', {modo: ['--modo', modo] for modo in ('lambda', 'directo')})
+
+    if args.modo_respuesta:
+        os.environ['MODO_RESPUESTA'] = args.modo_respuesta
+    if args.sin_cache:
+        os.environ['CACHE_HABILITADO'] = '0'
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    artefacto = os.path.abspath(args.artefacto)
+    proxy = cargar_proxy(os.path.dirname(artefacto), os.path.basename(artefacto),
+                         args.latencia_gemini_ms, args.jitter_gemini_ms, args.ms_por_1k_tokens)
+
+    inicio = time.perf_counter()
+    contexto = proxy.model_fn(args.model_dir)
+    arranque_s = time.perf_counter() - inicio
+
+    llamar = crear_llamada(args.modo, proxy, contexto, args.latencia_endpoint_ms)
+    preguntas = leer_preguntas(args.preguntas)
+    if args.calentamiento:
+        ejecutar(llamar, preguntas, args.calentamiento, 1, None)
+
+    precios = {"entrada": args.precio_entrada, "cache": args.precio_cache, "salida": args.precio_salida}
+    resultado = {
+        "commit": commit_actual(),
+        "modo": args.modo,
+        "modo_respuesta": proxy.MODO_RESPUESTA,
+        "config": {k: v for k, v in vars(args).items() if k != 'salida'},
+        "arranque_s": round(arranque_s, 3),
+        "arranque_fases_s": contexto.get("tiempos_inicio"),
+        **ejecutar(llamar, preguntas, args.solicitudes, args.concurrencia, args.tasa, precios),
+        "micro_lotes": resumen_micro_lotes(contexto.get("agrupador")),
+        "memoria_pico_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+def comparar(args, bandera: str, variantes: dict):
+    """
+    Corre el benchmark una vez por variante (argumentos extra), cada una en su propio proceso
+    (la configuración del Proxy se lee al importarlo), y resume latencia y costo por solicitud.
+    """
+    argumentos = [a for a in sys.argv[1:] if a != bandera]
+    for opcion in {'--salida', *(extra[0] for extra in variantes.values())}:
+        if opcion in argumentos:
+            i = argumentos.index(opcion)
+            del argumentos[i:i + 2]
+
+    resultados = {}
+    for modo, extra in variantes.items():
+        with tempfile.NamedTemporaryFile(suffix='.json') as tmp:
+            subprocess.run([sys.executable, os.path.abspath(__file__), *argumentos,
+                            *extra, '--salida', tmp.name], check=True, stdout=subprocess.DEVNULL)
+            with open(tmp.name, 'r', encoding='utf-8') as f:
+                resultados[modo] = json.load(f)
+
+    comparacion = {
+        "commit": commit_actual(),
+        "resumen": {
+            modo: {"arranque_s": r["arranque_s"], "latencia_ms": r["latencia_ms"],
+                   "tokens_por_solicitud": r["tokens_por_solicitud"],
+                   "costo_usd_por_1000": r["costo_usd_por_1000"], "errores": r["errores"]}
+            for modo, r in resultados.items()
+        },
+        "resultados": resultados,
+    }
+    print(json.dumps(comparacion["resumen"], indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(comparacion, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Back_End/bm25_index.py
+# Indice invertido BM25 sobre los mismos fragmentos del índice vectorial, y fusión híbrida (RRF).
+
+import json
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+BM25_FILE = 'bm25.json'
+RRF_K = 60
+
+STOPWORDS = {
+    "de", "la", "que", "el", "en", "y", "a", "los", "se", "del", "las", "un", "por", "con",
+    "no", "una", "su", "para", "es", "al", "lo", "como", "mas", "o", "pero", "sus", "le",
+    "ha", "me", "si", "sin", "sobre", "este", "ya", "entre", "cuando", "todo", "esta", "ser",
+    "son", "dos", "tambien", "fue", "hay", "donde", "quien", "desde", "cual", "cuales", "cuanto",
+    "cuantas", "cuantos", "debo", "puedo", "mi", "tengo",
+}
+
+
+def tokenizar(texto: str) -> list[str]:
+    """Minúsculas, sin acentos, alfanumérico y sin stopwords (conserva códigos como 'lcc-hub' → 'lcc', 'hub')."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r'[a-z0-9]+', texto) if len(t) > 1 and t not in STOPWORDS]
+
+
+class IndiceBM25:
+    """Índice invertido compacto: postings término -> [[id_fragmento, tf], ...] y longitudes."""
+
+    def __init__(self, postings: dict, longitudes: list[int], k1: float = 1.5, b: float = 0.75):
+        self.postings = postings
+        self.longitudes = longitudes
+        self.k1 = k1
+        self.b = b
+        self.n = len(longitudes)
+        self.promedio = (sum(longitudes) / self.n) if self.n else 0.0
+
+    @classmethod
+    def construir(cls, textos: list[str], k1: float = 1.5, b: float = 0.75) -> "IndiceBM25":
+        postings = defaultdict(list)
+        longitudes = []
+        for id_frag, texto in enumerate(textos):
+            tokens = tokenizar(texto)
+            longitudes.append(len(tokens))
+            for termino, tf in Counter(tokens).items():
+                postings[termino].append([id_frag, tf])
+        return cls(dict(postings), longitudes, k1, b)
+
+    def guardar(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"k1": self.k1, "b": self.b, "longitudes": self.longitudes, "postings": self.postings}, f,
+                      separators=(',', ':'))
+
+    @classmethod
+    def cargar(cls, path: str) -> "IndiceBM25":
+        with open(path, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        return cls(datos["postings"], datos["longitudes"], datos["k1"], datos["b"])
+
+    def idf(self, termino: str) -> float:
+        df = len(self.postings.get(termino, ()))
+        return math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+
+    def buscar(self, consulta: str, k: int) -> list[tuple[int, float]]:
+        """Devuelve [(id_fragmento, puntaje)] ordenado de mayor a menor."""
+        puntajes = defaultdict(float)
+        for termino in set(tokenizar(consulta)):
+            idf = self.idf(termino)
+            for id_frag, tf in self.postings.get(termino, ()):
+                norma = self.k1 * (1 - self.b + self.b * self.longitudes[id_frag] / self.promedio)
+                puntajes[id_frag] += idf * tf * (self.k1 + 1) / (tf + norma)
+        return sorted(puntajes.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def es_confiable(self, consulta: str, resultados: list[tuple[int, float]],
+                     cobertura_min: float = 0.6, margen_min: float = 1.5) -> bool:
+        """
+        El resultado léxico es confiable si el primer fragmento alcanza buena parte del puntaje
+        de referencia de la consulta (todos sus términos presentes una vez en un fragmento de
+        longitud promedio) y se separa claramente del segundo.
+        """
+        if not resultados:
+            return False
+        maximo = sum(self.idf(t) for t in set(tokenizar(consulta)))
+        primero = resultados[0][1]
+        segundo = resultados[1][1] if len(resultados) > 1 else 0.0
+        return maximo > 0 and primero / maximo >= cobertura_min and primero >= margen_min * segundo
+
+
+def fusion_rrf(rankings: list[list], k: int, rrf_k: int = RRF_K) -> list:
+    """Reciprocal Rank Fusion sobre listas de claves ordenadas; devuelve las k mejores claves."""
+    puntajes = defaultdict(float)
+    for ranking in rankings:
+        for posicion, clave in enumerate(ranking):
+            puntajes[clave] += 1.0 / (rrf_k + posicion + 1)
+    return sorted(puntajes, key=puntajes.get, reverse=True)[:k]
@@ -0,0 +1,75 @@
+# Back_End/build_manifest.py
+# Manifiesto de construcción direccionado por contenido: cada etapa del pipeline (limpieza →
+# índice → paquete) guarda los hashes de sus entradas y salidas, y se omite si no cambiaron.
+
+import os
+import json
+import hashlib
+
+BUILD_MANIFEST_FILE = os.path.join('Back_End', 'Data', 'build_manifest.json')
+BLOQUE_HASH = 1 << 20
+
+
+def hash_archivo(ruta: str) -> str:
+    """sha256 del contenido del archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        while bloque := f.read(BLOQUE_HASH):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def hash_archivos(rutas: list[str], base: str | None = None) -> dict[str, str]:
+    """Hash por archivo, con el nombre relativo a `base` (o el nombre de archivo) como clave."""
+    return {(os.path.relpath(r, base) if base else os.path.basename(r)): hash_archivo(r) for r in rutas}
+
+
+def hash_carpeta(carpeta: str, extension: str = '') -> dict[str, str]:
+    """Hash por archivo de toda la carpeta (recursivo), ordenado por ruta relativa."""
+    rutas = sorted(os.path.join(raiz, f) for raiz, _, archivos in os.walk(carpeta)
+                   for f in archivos if f.endswith(extension))
+    return hash_archivos(rutas, carpeta)
+
+
+def huella(*partes) -> str:
+    """Hash estable de valores serializables a JSON (configuración, mapas de hashes, etc.)."""
+    return hashlib.sha256(json.dumps(partes, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ManifiestoBuild:
+    """
+    Registro JSON por etapa: {"entradas": huella de las entradas, "salidas": {ruta: sha256}, ...}.
+    Una etapa está vigente si sus entradas no cambiaron y sus salidas siguen en disco con el
+    mismo contenido.
+    """
+
+    def __init__(self, ruta: str = BUILD_MANIFEST_FILE):
+        self.ruta = ruta
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                self.etapas = json.load(f)
+        except (OSError, ValueError):
+            self.etapas = {}
+
+    def etapa(self, nombre: str) -> dict:
+        return self.etapas.setdefault(nombre, {})
+
+    def vigente(self, nombre: str, entradas: str) -> bool:
+        registro = self.etapas.get(nombre)
+        if not registro or registro.get("entradas") != entradas:
+            return False
+        return all(os.path.exists(ruta) and hash_archivo(ruta) == h for ruta, h in registro.get("salidas", {}).items())
+
+    def registrar(self, nombre: str, entradas: str, salidas: list[str], **datos) -> dict:
+        """Guarda la etapa con los hashes actuales de sus salidas y persiste el manifiesto."""
+        registro = {"entradas": entradas, "salidas": {ruta: hash_archivo(ruta) for ruta in salidas}, **datos}
+        self.etapas[nombre] = registro
+        self.guardar()
+        return registro
+
+    def guardar(self):
+        os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.etapas, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self.ruta)
@@ -0,0 +1,172 @@
+# Back_End/chunker.py
+# Fragmentación por estructura: respeta encabezados, listas y filas de tabla (una línea del texto
+# limpio nunca se corta salvo que por sí sola exceda el límite) y mide los fragmentos en tokens
+# del modelo de embeddings, para que cada fragmento quepa entero en su ventana de entrada.
+
+import os
+import re
+import statistics
+from dataclasses import dataclass
+
+# Tokens por fragmento (sin los especiales del modelo); 0 = toda la ventana del modelo
+FRAGMENTO_MAX_TOKENS = int(os.environ.get('FRAGMENTO_MAX_TOKENS', '0'))
+# Una sección más corta que esto se junta con la siguiente en lugar de cerrar el fragmento
+FRAGMENTO_MIN_TOKENS = int(os.environ.get('FRAGMENTO_MIN_TOKENS', '32'))
+# Líneas finales que se repiten al partir una sección larga en varios fragmentos
+FRAGMENTO_SOLAPE_TOKENS = int(os.environ.get('FRAGMENTO_SOLAPE_TOKENS', '16'))
+
+ENCABEZADO_MAX_CARACTERES = 70
+# Largo a partir del cual una línea es un párrafo (y la línea corta anterior, su encabezado)
+PARRAFO_MIN_CARACTERES = 100
+
+_PATRON_MARKDOWN = re.compile(r'#{1,6}\s+')
+_PATRON_LISTA = re.compile(r'(?:[-•*·▪–]|\d{1,2}[.)]|[a-zA-Z][.)])\s+')
+_PATRON_ORACION = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def es_item_lista(linea: str) -> bool:
+    return bool(_PATRON_LISTA.match(linea))
+
+
+def es_encabezado(linea: str, siguiente: str | None) -> bool:
+    """
+    Encabezado de sección: título markdown, o línea corta sin puntuación final (o pregunta de
+    FAQ) seguida de un párrafo o de una lista. Las celdas de tabla (líneas cortas seguidas de
+    otras líneas cortas) no cuentan.
+    """
+    if _PATRON_MARKDOWN.match(linea):
+        return True
+    if len(linea) > ENCABEZADO_MAX_CARACTERES or linea[-1] in '.,;:' or es_item_lista(linea):
+        return False
+    if not (linea[0].isupper() or linea[0] in '¿¡') or not any(c.isalpha() for c in linea):
+        return False
+    return siguiente is not None and (len(siguiente) >= PARRAFO_MIN_CARACTERES or es_item_lista(siguiente))
+
+
+@dataclass
+class Pieza:
+    texto: str
+    tokens: int
+    encabezado: bool = False
+    seccion: str = ''
+
+
+def _tokens(piezas: list[Pieza]) -> int:
+    return sum(p.tokens for p in piezas)
+
+
+class FragmentadorEstructural:
+    """
+    Agrupa las líneas de cada documento en fragmentos de hasta `max_tokens` tokens:
+    - cada encabezado abre un fragmento nuevo (si el actual ya tiene `min_tokens`);
+    - un fragmento no termina en un encabezado ni en la línea que introduce una lista (':');
+    - si una sección se parte, el fragmento siguiente repite el encabezado y las últimas
+      líneas del anterior (hasta `solape_tokens`), si caben.
+    `contar_tokens` debe usar el tokenizer del modelo de embeddings, sin tokens especiales.
+    """
+
+    def __init__(self, contar_tokens, max_tokens: int, min_tokens: int = FRAGMENTO_MIN_TOKENS,
+                 solape_tokens: int = FRAGMENTO_SOLAPE_TOKENS):
+        self.contar_tokens = contar_tokens
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.solape_tokens = solape_tokens
+
+    def _partir_linea(self, linea: str, limite: int) -> list[str]:
+        """Parte una línea que excede `limite` por oraciones y, si aún no cabe, por palabras."""
+        if self.contar_tokens(linea) <= limite:
+            return [linea]
+        partes, actual = [], ''
+        for unidad in _PATRON_ORACION.split(linea):
+            palabras = [unidad] if self.contar_tokens(unidad) <= limite else unidad.split()
+            for palabra in palabras:
+                candidato = f"{actual} {palabra}".strip()
+                if actual and self.contar_tokens(candidato) > limite:
+                    partes.append(actual)
+                    candidato = palabra
+                actual = candidato
+        return partes + ([actual] if actual else [])
+
+    def _piezas(self, texto: str) -> list[Pieza]:
+        """Líneas del texto (partidas si exceden el límite) con su tipo y la sección vigente."""
+        lineas = [l.strip() for l in texto.split('\n') if l.strip()]
+        piezas = []
+        seccion, tokens_seccion = '', 0
+        for i, linea in enumerate(lineas):
+            encabezado = es_encabezado(linea, lineas[i + 1] if i + 1 < len(lineas) else None)
+            if encabezado:
+                seccion = linea.lstrip('#').strip()
+                tokens_seccion = self.contar_tokens(seccion)
+            # Las partes de una línea larga dejan lugar para repetir el encabezado de su sección
+            limite = self.max_tokens if encabezado else max(self.max_tokens - tokens_seccion, self.max_tokens // 2)
+            piezas += [Pieza(parte, self.contar_tokens(parte), encabezado, seccion) for parte in self._partir_linea(linea, limite)]
+        return piezas
+
+    def _continuacion(self, anterior: list[Pieza], arrastre: list[Pieza], siguiente: Pieza) -> list[Pieza]:
+        """Inicio del fragmento que continúa una sección: encabezado + solape + arrastre, lo que quepa."""
+        contexto, solape = [], []
+        if not (arrastre and arrastre[0].encabezado):
+            if siguiente.seccion:
+                contexto = [Pieza(siguiente.seccion, self.contar_tokens(siguiente.seccion), True, siguiente.seccion)]
+            for previa in reversed(anterior):
+                if previa.encabezado or _tokens(solape) + previa.tokens > self.solape_tokens:
+                    break
+                solape.insert(0, previa)
+        for candidato in (contexto + solape + arrastre, contexto + arrastre, arrastre):
+            if _tokens(candidato) + siguiente.tokens <= self.max_tokens:
+                return candidato
+        return []
+
+    def fragmentar(self, texto: str) -> list[tuple[str, str, int]]:
+        """Devuelve (texto, sección, tokens) por fragmento, en orden."""
+        fragmentos = []
+
+        def emitir(piezas: list[Pieza]):
+            if piezas:
+                texto_fragmento = '\n'.join(p.texto for p in piezas)
+                fragmentos.append((texto_fragmento, piezas[0].seccion, self.contar_tokens(texto_fragmento)))
+
+        actual: list[Pieza] = []
+        for pieza in self._piezas(texto):
+            if pieza.encabezado and _tokens(actual) >= self.min_tokens:
+                emitir(actual)
+                actual = []
+            elif actual and _tokens(actual) + pieza.tokens > self.max_tokens:
+                # El encabezado o la introducción de una lista pasan al fragmento siguiente
+                arrastre = []
+                while len(actual) > 1 and (actual[-1].encabezado or actual[-1].texto.endswith(':')):
+                    arrastre.insert(0, actual.pop())
+                emitir(actual)
+                continuacion = self._continuacion(actual, arrastre, pieza)
+                if arrastre and not continuacion:
+                    emitir(arrastre)
+                actual = continuacion
+            actual.append(pieza)
+        emitir(actual)
+        return fragmentos
+
+    def fragmentar_documentos(self, documentos: list) -> list:
+        """Fragmenta documentos de langchain; cada fragmento conserva los metadatos y agrega sección y tokens."""
+        fragmentos = []
+        for documento in documentos:
+            for texto, seccion, tokens in self.fragmentar(documento.page_content):
+                metadata = {**documento.metadata, "seccion": seccion, "tokens": tokens}
+                fragmentos.append(type(documento)(page_content=texto, metadata=metadata))
+        return fragmentos
+
+
+def informe_longitudes(tokens: list[int], ventana: int) -> str:
+    """Distribución del largo de los fragmentos en tokens, contando los que el modelo truncaría."""
+    if not tokens:
+        return "Fragmentos: ninguno."
+    deciles = statistics.quantiles(tokens, n=10) if len(tokens) > 1 else [tokens[0]] * 9
+    lineas = [f"Fragmentos: {len(tokens)}; tokens min {min(tokens)}, p10 {deciles[0]:.0f}, "
+              f"p50 {statistics.median(tokens):.0f}, p90 {deciles[-1]:.0f}, max {max(tokens)}, "
+              f"media {statistics.mean(tokens):.1f} (ventana del modelo: {ventana})."]
+    paso = max(1, ventana // 4)
+    for inicio in range(0, ventana, paso):
+        n = sum(inicio < t <= inicio + paso for t in tokens)
+        lineas.append(f"  {inicio + 1:>4}-{min(inicio + paso, ventana):<4} {n:>6} {'#' * round(40 * n / len(tokens))}")
+    truncados = sum(t > ventana for t in tokens)
+    lineas.append(f"  >{ventana:<8} {truncados:>6} (se truncarían al generar el embedding)")
+    return "\n".join(lineas)
@@ -2,6 +2,13 @@ import os
 import re
 import html
 import sys
+import time
+import random
+import argparse
+import tempfile
+from itertools import islice
+
+from build_manifest import ManifiestoBuild, hash_archivo
 
 # --- 1. CONFIGURACIÓN DE CARPETAS Y CONSTANTES ---
 
@@ -44,28 +51,141 @@ INDICADORES_RUIDO_ESTRUCTURAL = [
 
 LISTA_NEGRA_LOWER = {item.lower() for item in LISTA_NEGRA_COMBINADA}
 
+# Limpieza en flujo: tamaño de bloque leído (caracteres) y clasificaciones de líneas memorizadas
+TAMANO_BLOQUE = 1 << 20
+MAX_LINEAS_MEMORIZADAS = 200_000
+
+# Reglas compiladas una sola vez: cada familia de indicadores se evalúa con una única búsqueda por línea
+_PATRON_COMENTARIO = re.compile(r'/\*.*?\*/', flags=re.DOTALL)
+_PATRON_CODIGO = re.compile('|'.join(re.escape(ind) for ind in INDICADORES_CODIGO))
+# El ruido estructural solo cuenta en líneas cortas (largo < largo del indicador + 30). La búsqueda
+# con lookahead prueba cada posición y, con los indicadores ordenados de mayor a menor, devuelve
+# el más largo que coincide ahí, que es el que admite la línea más larga.
+_RUIDO_LOWER = {ruido.lower(): len(ruido) for ruido in INDICADORES_RUIDO_ESTRUCTURAL}
+_PATRON_RUIDO = re.compile('(?=(' + '|'.join(re.escape(r) for r in sorted(_RUIDO_LOWER, key=len, reverse=True)) + '))')
+_LARGO_MAX_RUIDO = max(_RUIDO_LOWER.values()) + 30
+_PATRON_PAGINACION = re.compile(r'^\d+\s*\|\s*Proyecto curricular')
+_PATRON_FILA_TABLA = re.compile(r'\| [| +\-.]*')
+_LINEAS_CODIGO = {"});", "}", "-->"}
+_LINEAS_CLASIFICADAS: dict[str, bool] = {}
+
 # --- FUNCIONES DE SOPORTE ---
 
 def juntar_lineas_cortas(lineas_limpias: list[str]) -> list[str]:
     """Combina líneas cortas (menos de 60 caracteres) con la siguiente, si termina en coma o no alfanumérico."""
-    texto_combinado = []
-    i = 0
-    while i < len(lineas_limpias):
-        linea_actual = lineas_limpias[i]
-        
-        if len(linea_actual) < 60 and i + 1 < len(lineas_limpias):
-            siguiente_linea = lineas_limpias[i+1]
-            
+    return list(juntar_lineas_cortas_stream(lineas_limpias))
+
+
+def juntar_lineas_cortas_stream(lineas):
+    """Versión en flujo de juntar_lineas_cortas: solo retiene la línea anterior."""
+    anterior = None
+    for linea in lineas:
+        if anterior is None:
+            anterior = linea
+            continue
+        if len(anterior) < 60 and (anterior.endswith(('.', ',', ':', ';')) or len(anterior) < 30) and linea and linea[0].islower():
+            yield anterior + ' ' + linea
+            anterior = None
+        else:
+            yield anterior
+            anterior = linea
+    if anterior is not None:
+        yield anterior
+
+
+def es_linea_descartable(linea_strip: str) -> bool:
+    """
+    Clasifica una línea (ya sin espacios, no vacía) como código, lista negra o ruido estructural.
+    Cualquier regla basta para descartarla, así que las más baratas se evalúan primero.
+    """
+    # 3. REGLA DE LISTA NEGRA ESTRICTA (Coincidencia de línea COMPLETA)
+    linea_lower = linea_strip.lower()
+    if linea_lower in LISTA_NEGRA_LOWER or linea_strip in _LINEAS_CODIGO:
+        return True
+
+    # 5. Regla de longitud mínima
+    if len(linea_strip) < 3 and not linea_strip[0].isalnum():
+        return True
+
+    # 4. Regla de Ruido Estructural/OCR y Footers
+    if len(linea_strip) < _LARGO_MAX_RUIDO:
+        for m in _PATRON_RUIDO.finditer(linea_lower):
+            if len(linea_strip) < _RUIDO_LOWER[m.group(1)] + 30:
+                return True
+
+    # Regla específica para el footer de la Unison
+    if "|" in linea_strip and "universidad de sonora" in linea_lower:
+        return True
 
-            if (linea_actual.endswith(('.', ',', ':', ';')) or len(linea_actual) < 30) and siguiente_linea and siguiente_linea[0].islower():
-                texto_combinado.append(linea_actual + ' ' + siguiente_linea)
-                i += 2
+    # Paginación y filas de tabla
+    if linea_strip.startswith('+---') or _PATRON_PAGINACION.match(linea_strip) or _PATRON_FILA_TABLA.fullmatch(linea_strip):
+        return True
+
+    # 2. Regla Anti-Código
+    if "{" in linea_strip and "}" not in linea_strip and len(linea_strip) < 60:
+        return True
+    return _PATRON_CODIGO.search(linea_strip) is not None
+
+
+def lineas_sin_comentarios(bloques):
+    """
+    Decodifica entidades HTML y elimina los comentarios /* ... */ de un flujo de bloques de texto
+    (cada bloque termina en fin de línea); genera, por bloque, la lista de sus líneas completas.
+    Un comentario abierto se retiene hasta que se cierra; si nunca se cierra se emite tal cual,
+    igual que la sustitución sobre el texto completo.
+    """
+    pendiente = ""
+    parcial = ""
+    for bloque in bloques:
+        bloque = html.unescape(bloque)
+        if pendiente and '*/' not in bloque:
+            pendiente += bloque
+            continue
+        texto = pendiente + bloque
+        partes, fin = [parcial], 0
+        for m in _PATRON_COMENTARIO.finditer(texto):
+            partes.append(texto[fin:m.start()])
+            fin = m.end()
+        # Ningún '/*' posterior al último comentario tiene cierre en lo leído hasta ahora
+        abierto = texto.find('/*', fin)
+        if abierto == -1:
+            abierto = len(texto)
+        partes.append(texto[fin:abierto])
+        pendiente = texto[abierto:]
+        lineas = ''.join(partes).split('\n')
+        parcial = lineas.pop()
+        yield lineas
+    yield (parcial + pendiente).split('\n')
+
+
+def lineas_utiles(bloques):
+    """
+    Genera las líneas (sin espacios) que sobreviven a las reglas de limpieza. La clasificación de
+    cada línea distinta se memoriza entre archivos: menús, footers y banners se repiten en todas
+    las páginas de un sitio.
+    """
+    clasificadas = _LINEAS_CLASIFICADAS
+    for lineas in lineas_sin_comentarios(bloques):
+        for linea in lineas:
+            linea_strip = linea.strip()
+            if not linea_strip:
                 continue
-                
-        texto_combinado.append(linea_actual)
-        i += 1
-        
-    return texto_combinado
+            descartable = clasificadas.get(linea_strip)
+            if descartable is None:
+                if len(clasificadas) >= MAX_LINEAS_MEMORIZADAS:
+                    clasificadas.clear()
+                descartable = clasificadas[linea_strip] = es_linea_descartable(linea_strip)
+            if not descartable:
+                yield linea_strip
+
+
+def leer_bloques(archivo, tamano: int = TAMANO_BLOQUE):
+    """Lee un archivo de texto en bloques de líneas completas de ~`tamano` caracteres."""
+    while True:
+        lineas = archivo.readlines(tamano)
+        if not lineas:
+            return
+        yield ''.join(lineas)
 
 # --- 3. FUNCIÓN DE LIMPIEZA---
 
@@ -73,98 +193,84 @@ def limpieza(texto: str) -> str:
     """Aplica las reglas de limpieza al texto dado."""
     if not texto: return ""
 
-    texto = html.unescape(texto)
-    # 1. Limpieza de comentarios y caracteres no deseados
-    texto = re.sub(r'/\*.*?\*/', '', texto, flags=re.DOTALL) 
-    
-    lineas = texto.split('\n')
-    lineas_limpias = []
-    
-    for linea in lineas:
-        linea_strip = linea.strip()
-        
-        if not linea_strip:
-            continue
-            
-        linea_lower = linea_strip.lower()
-            
-        # 2. Regla Anti-Código
-        es_codigo = False
-        for ind in INDICADORES_CODIGO:
-            if ind in linea_strip:
-                es_codigo = True
-                break
-        if "{" in linea_strip and "}" not in linea_strip and len(linea_strip) < 60: 
-            es_codigo = True
-        if linea_strip in ["});", "}", "-->"]:
-            es_codigo = True
-
-        if es_codigo:
-            continue
-
-        # 3. REGLA DE LISTA NEGRA ESTRICTA (Coincidencia de línea COMPLETA)
-        if linea_lower in LISTA_NEGRA_LOWER:
-            continue 
-
-        # 4. Regla de Ruido Estructural/OCR y Footers
-        es_ruido_estructural = False
-        for ruido in INDICADORES_RUIDO_ESTRUCTURAL:
-            if ruido.lower() in linea_lower and len(linea_strip) < len(ruido) + 30: 
-                es_ruido_estructural = True
-                break
-        
-        # Regla específica para el footer de la Unison
-        if "universidad de sonora" in linea_lower and "|" in linea_strip:
-            es_ruido_estructural = True
-            
-        # Paginación y filas de tabla
-        if re.search(r'^\d+\s*\|\s*Proyecto curricular', linea_strip) or linea_strip.startswith('+---') or (linea_strip.startswith('| ') and all(c in '| +-.' for c in linea_strip)):
-             es_ruido_estructural = True
-            
-        if es_ruido_estructural:
-            continue
-            
-        # 5. Regla de longitud mínima
-        if len(linea_strip) < 3 and not linea_strip[0].isalnum():
-            continue
+    # 6. POST-PROCESAMIENTO: Juntar líneas fragmentadas. Las líneas limpias nunca están vacías,
+    # así que no quedan saltos de línea repetidos que normalizar.
+    return "\n".join(juntar_lineas_cortas_stream(lineas_utiles([texto])))
 
-        lineas_limpias.append(linea_strip)
 
-    # 6. POST-PROCESAMIENTO: Juntar líneas fragmentadas (opcional)
-    lineas_fluidez = juntar_lineas_cortas(lineas_limpias)
-    
-    texto_final = "\n".join(lineas_fluidez)
-    texto_final = re.sub(r'\n{3,}', '\n\n', texto_final) # Normalizar saltos de línea
-    
-    return texto_final
+def limpiar_archivo(path_origen: str, path_destino: str) -> bool:
+    """
+    Limpia un archivo en flujo, por bloques (memoria acotada). El destino solo se escribe si el
+    texto limpio supera los 30 caracteres; devuelve si se escribió.
+    """
+    temporal = path_destino + '.tmp'
+    largo = 0
+    with open(path_origen, 'r', encoding='utf-8', errors='ignore') as origen, \
+            open(temporal, 'w', encoding='utf-8') as destino:
+        lineas = juntar_lineas_cortas_stream(lineas_utiles(leer_bloques(origen)))
+        while lote := list(islice(lineas, 4096)):
+            texto = ('\n' if largo else '') + '\n'.join(lote)
+            destino.write(texto)
+            largo += len(texto)
+    if largo > 30:
+        os.replace(temporal, path_destino)
+        return True
+    os.remove(temporal)
+    return False
 
 # --- 4. FUNCIÓN DE EJECUCIÓN  ---
 
-def main(input_folder: str = INPUT_FOLDER, output_folder: str = OUTPUT_FOLDER):
-    """Orquesta la limpieza de archivos desde la carpeta de entrada a la de salida."""
+def main(input_folder: str = INPUT_FOLDER, output_folder: str = OUTPUT_FOLDER, manifiesto: ManifiestoBuild | None = None):
+    """
+    Orquesta la limpieza de archivos desde la carpeta de entrada a la de salida. Con un
+    `manifiesto` de construcción la limpieza es incremental: solo se limpian los archivos cuyo
+    contenido (o las reglas de este módulo) cambió, y se borran las salidas de entradas eliminadas.
+    """
     try:
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
             
         archivos = [f for f in os.listdir(input_folder) if f.endswith('.txt')]
         print(f"EJECUTANDO LIMPIEZA en {len(archivos)} archivos...")
-        
-        count = 0
+
+        version = hash_archivo(__file__)
+        etapa = manifiesto.etapa('limpieza') if manifiesto else {}
+        previos = etapa.get('archivos', {}) if etapa.get('version') == version else {}
+        registro = {}
+
+        count = omitidos = 0
         for filename in archivos:
             path_origen = os.path.join(input_folder, filename)
             path_destino = os.path.join(output_folder, filename)
-            
-            with open(path_origen, 'r', encoding='utf-8', errors='ignore') as f:
-                contenido = f.read()
-            
-            limpio = limpieza(contenido)
-            
-            if len(limpio.strip()) > 30:
-                with open(path_destino, 'w', encoding='utf-8') as f:
-                    f.write(limpio)
+
+            entrada = hash_archivo(path_origen)
+            previo = previos.get(filename)
+            if previo and previo['entrada'] == entrada and (
+                    previo['salida'] is None or (os.path.exists(path_destino) and hash_archivo(path_destino) == previo['salida'])):
+                registro[filename] = previo
+                omitidos += 1
+                count += previo['salida'] is not None
+                continue
+
+            if limpiar_archivo(path_origen, path_destino):
+                registro[filename] = {"entrada": entrada, "salida": hash_archivo(path_destino)}
                 count += 1
+            else:
+                registro[filename] = {"entrada": entrada, "salida": None}
+                # Una salida de una versión anterior del archivo ya no corresponde
+                if previo and previo['salida'] and os.path.exists(path_destino):
+                    os.remove(path_destino)
+
+        # Entradas eliminadas (p. ej. páginas que el scraper ya no encontró)
+        for filename, previo in previos.items():
+            if filename not in registro and previo['salida'] and os.path.exists(os.path.join(output_folder, filename)):
+                os.remove(os.path.join(output_folder, filename))
+
+        if manifiesto:
+            manifiesto.etapas['limpieza'] = {"version": version, "archivos": registro}
+            manifiesto.guardar()
                 
-        print(f"Limpieza terminada. {count} archivos procesados. Resultados en '{output_folder}'.")
+        print(f"Limpieza terminada. {count} archivos procesados ({omitidos} sin cambios). Resultados en '{output_folder}'.")
         return output_folder
 
     except FileNotFoundError:
@@ -174,5 +280,76 @@ def main(input_folder: str = INPUT_FOLDER, output_folder: str = OUTPUT_FOLDER):
         print(f"Error al ejecutar la limpieza: {e}")
         sys.exit(1)
 
+# --- 5. MICRO-BENCHMARK ---
+
+def corpus_sintetico(lineas: int, input_folder: str = INPUT_FOLDER, semilla: int = 0) -> str:
+    """
+    Texto sintético de ~`lineas` líneas con forma de sitio rastreado: páginas con el mismo menú y
+    footer, bloques de CSS/JS (con comentarios de varias líneas), ruido de OCR/tablas, entidades
+    HTML y párrafos únicos armados con el vocabulario de `input_folder` (si existe).
+    """
+    rng = random.Random(semilla)
+    palabras = []
+    if os.path.isdir(input_folder):
+        for filename in sorted(os.listdir(input_folder)):
+            if filename.endswith('.txt'):
+                with open(os.path.join(input_folder, filename), 'r', encoding='utf-8', errors='ignore') as f:
+                    palabras.extend(f.read().split())
+    palabras = palabras or "el servicio social se realiza a partir del séptimo semestre con una duración mínima".split()
+    menu = LISTA_NEGRA_COMBINADA[:25]
+    codigo = ["/* estilos del tema", "   generados */", "body{margin:0}", "img.emoji {", "  display: inline !important;",
+              "}", "$(document).ready(function() {", "  $(\"#banner\").owlCarousel({ autoPlay: 3000, items : 4 });", "});"]
+    ruido = INDICADORES_RUIDO_ESTRUCTURAL + ["| 12 | Proyecto curricular", "+------+------+", "| --- | --- |",
+                                              "Universidad de Sonora | Hermosillo, Sonora", "a", "."]
+    salida = []
+    while len(salida) < lineas:
+        salida.extend(menu)
+        if rng.random() < 0.3:
+            salida.extend(codigo)
+        for _ in range(rng.randint(20, 60)):
+            if rng.random() < 0.1:
+                salida.append(rng.choice(ruido))
+            else:
+                frase = ' '.join(rng.choice(palabras) for _ in range(rng.randint(2, 18)))
+                salida.append(frase.replace(' y ', ' &amp; ', 1) + rng.choice(['.', ',', ':', '']))
+        salida.extend(["Universidad de Sonora | Departamento de Matemáticas", "Next", "Previous"])
+    return "\n".join(salida[:lineas])
+
+
+def benchmark(lineas: int = 200_000, input_folder: str = INPUT_FOLDER):
+    """Líneas por segundo de la limpieza en memoria y la de flujo sobre archivo."""
+    texto = corpus_sintetico(lineas, input_folder)
+    with tempfile.TemporaryDirectory() as carpeta:
+        path_origen = os.path.join(carpeta, 'sintetico.txt')
+        path_destino = os.path.join(carpeta, 'limpio.txt')
+        with open(path_origen, 'w', encoding='utf-8') as f:
+            f.write(texto)
+
+        resultados = {}
+        for nombre, funcion in (("compilada", lambda: limpieza(texto)),
+                                ("flujo_archivo", lambda: limpiar_archivo(path_origen, path_destino))):
+            _LINEAS_CLASIFICADAS.clear()
+            inicio = time.perf_counter()
+            funcion()
+            duracion = time.perf_counter() - inicio
+            resultados[nombre] = lineas / duracion
+            print(f"{nombre:>14}: {duracion:.2f}s  {lineas / duracion:,.0f} líneas/s")
+
+        with open(path_destino, 'rb') as f:
+            identico = f.read() == limpieza(texto).encode('utf-8')
+    print(f"Flujo frente a compilada: x{resultados['flujo_archivo'] / resultados['compilada']:.2f}. "
+          f"Salida idéntica: {identico}")
+    return resultados
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Limpieza de los textos extraídos por el scraper.")
+    parser.add_argument('--entrada', default=INPUT_FOLDER)
+    parser.add_argument('--salida', default=OUTPUT_FOLDER)
+    parser.add_argument('--benchmark', action='store_true', help="Mide líneas/s sobre un corpus sintético")
+    parser.add_argument('--lineas', type=int, default=200_000, help="Tamaño del corpus sintético del benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.lineas, args.entrada)
+    else:
+        main(args.entrada, args.salida)
@@ -0,0 +1,138 @@
+# Back_End/context_builder.py
+# Arma el contexto del prompt: quita solapamientos entre fragmentos, diversifica con MMR
+# y empaqueta el resultado dentro de un presupuesto de tokens.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+CHARS_POR_TOKEN = 4      # Aproximación para texto en español con el tokenizador de Gemini
+SOLAPE_MIN_CHARS = 40    # Solapes más cortos se consideran coincidencias casuales
+
+
+def estimar_tokens(texto: str) -> int:
+    return (len(texto) + CHARS_POR_TOKEN - 1) // CHARS_POR_TOKEN
+
+
+@dataclass
+class ContextoArmado:
+    texto: str
+    fragmentos_usados: int
+    tokens_originales: int
+    tokens_finales: int
+
+    @property
+    def tokens_ahorrados(self) -> int:
+        return max(self.tokens_originales - self.tokens_finales, 0)
+
+    def resumen(self) -> dict:
+        return {
+            "fragmentos": self.fragmentos_usados,
+            "tokens_originales": self.tokens_originales,
+            "tokens_finales": self.tokens_finales,
+            "tokens_ahorrados": self.tokens_ahorrados,
+        }
+
+
+def seleccionar_mmr(vector_consulta, vectores_docs, k: int, lambda_mult: float = 0.7) -> list[int]:
+    """
+    Maximal Marginal Relevance: elige k índices equilibrando la similitud con la consulta
+    y la diferencia con los ya elegidos.
+    """
+    if not vectores_docs:
+        return []
+    docs = np.asarray(vectores_docs, dtype=np.float32)
+    docs = docs / np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+    consulta = np.asarray(vector_consulta, dtype=np.float32)
+    consulta = consulta / max(float(np.linalg.norm(consulta)), 1e-12)
+
+    relevancia = docs @ consulta
+    similitud_docs = docs @ docs.T
+    elegidos = [int(np.argmax(relevancia))]
+
+    while len(elegidos) < min(k, len(docs)):
+        redundancia = similitud_docs[:, elegidos].max(axis=1)
+        puntaje = lambda_mult * relevancia - (1 - lambda_mult) * redundancia
+        puntaje[elegidos] = -np.inf
+        elegidos.append(int(np.argmax(puntaje)))
+
+    return elegidos
+
+
+def _longitud_solape(anterior: str, siguiente: str) -> int:
+    """Longitud del sufijo más largo de `anterior` que es prefijo de `siguiente`."""
+    if len(anterior) < SOLAPE_MIN_CHARS or len(siguiente) < SOLAPE_MIN_CHARS:
+        return 0
+    semilla = siguiente[:SOLAPE_MIN_CHARS]
+    inicio = max(0, len(anterior) - len(siguiente))
+    pos = anterior.find(semilla, inicio)
+    while pos != -1:
+        if siguiente.startswith(anterior[pos:]):
+            return len(anterior) - pos
+        pos = anterior.find(semilla, pos + 1)
+    return 0
+
+
+def quitar_solapamientos(textos: list[str]) -> list[str]:
+    """
+    Elimina el texto repetido entre fragmentos vecinos (el chunk_overlap del splitter)
+    y las líneas que ya aparecieron en un fragmento anterior.
+    """
+    resultado = []
+    lineas_vistas = set()
+    for texto in textos:
+        for previo in resultado:
+            texto = texto[_longitud_solape(previo, texto):]
+            corte = _longitud_solape(texto, previo)
+            if corte:
+                texto = texto[:len(texto) - corte]
+
+        lineas = []
+        for linea in texto.split('\n'):
+            clave = linea.strip()
+            if not clave or clave in lineas_vistas:
+                continue
+            lineas_vistas.add(clave)
+            lineas.append(clave)
+        if lineas:
+            resultado.append('\n'.join(lineas))
+    return resultado
+
+
+def armar_contexto(docs: list, vector_consulta=None, k: int = 7, max_tokens: int = 2000,
+                   lambda_mult: float = 0.7) -> ContextoArmado:
+    """
+    Construye el contexto del prompt a partir de los candidatos recuperados.
+    Si los fragmentos traen su vector se diversifican con MMR; si no, se respeta el orden.
+    """
+    tokens_originales = estimar_tokens("\n".join(doc.page_content.replace('\n', ' ').strip() for doc in docs[:k]))
+
+    vectores = [getattr(doc, 'vector', None) for doc in docs]
+    if vector_consulta is not None and docs and all(v is not None for v in vectores):
+        orden = seleccionar_mmr(vector_consulta, vectores, k, lambda_mult)
+    else:
+        orden = list(range(min(k, len(docs))))
+
+    textos = quitar_solapamientos([docs[i].page_content for i in orden])
+
+    partes = []
+    restantes = max_tokens
+    for texto in textos:
+        plano = texto.replace('\n', ' ').strip()
+        tokens = estimar_tokens(plano)
+        if tokens > restantes:
+            # Recortar el último fragmento en un límite de palabra
+            plano = plano[:restantes * CHARS_POR_TOKEN].rsplit(' ', 1)[0]
+            if plano:
+                partes.append(plano)
+            break
+        partes.append(plano)
+        restantes -= tokens
+
+    texto_final = "\n".join(partes)
+    return ContextoArmado(
+        texto=texto_final,
+        fragmentos_usados=len(partes),
+        tokens_originales=tokens_originales,
+        tokens_finales=estimar_tokens(texto_final),
+    )
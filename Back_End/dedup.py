@@ -0,0 +1,192 @@
+# Back_End/dedup.py
+# Deduplicación a nivel de corpus antes de generar embeddings: líneas de plantilla del sitio
+# (menús, footers) repetidas entre páginas, documentos casi duplicados y fragmentos casi
+# duplicados (shingles de palabras + MinHash/LSH, con verificación exacta de Jaccard).
+
+import os
+import re
+import zlib
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Una línea es plantilla si aparece en al menos LINEA_MIN_DOCS documentos y en LINEA_FRACCION del corpus
+LINEA_MIN_DOCS = int(os.environ.get('DEDUP_LINEA_MIN_DOCS', '3'))
+LINEA_FRACCION = float(os.environ.get('DEDUP_LINEA_FRACCION', '0.3'))
+# Similitud de Jaccard (shingles) a partir de la cual dos documentos / fragmentos se consideran duplicados
+UMBRAL_DOCUMENTOS = float(os.environ.get('DEDUP_UMBRAL_DOCUMENTOS', '0.8'))
+UMBRAL_FRAGMENTOS = float(os.environ.get('DEDUP_UMBRAL_FRAGMENTOS', '0.85'))
+# Documentos que quedan por debajo de este largo tras quitar la plantilla se descartan
+MIN_CARACTERES_DOCUMENTO = 30
+
+SHINGLE_PALABRAS = 5
+PERMUTACIONES = 128
+BANDAS = 32
+# Hash multiply-add-shift sobre claves de 32 bits: ((a·x + b) mod 2^64) >> 32, con a impar
+_rng = np.random.default_rng(0)
+_A = _rng.integers(0, np.iinfo(np.uint64).max, size=PERMUTACIONES, dtype=np.uint64, endpoint=True) | np.uint64(1)
+_B = _rng.integers(0, np.iinfo(np.uint64).max, size=PERMUTACIONES, dtype=np.uint64, endpoint=True)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin acentos y con los espacios colapsados."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+def clave_linea(linea: str) -> str | None:
+    """
+    Clave para comparar líneas entre documentos; los números se igualan (años del footer, etc.).
+    Las líneas sin letras o muy cortas (celdas de tablas) nunca se consideran plantilla.
+    """
+    clave = normalizar(linea)
+    if len(clave) < 4 or not re.search(r'[a-z]', clave):
+        return None
+    return re.sub(r'\d+', '0', clave)
+
+
+def shingles(texto: str, k: int = SHINGLE_PALABRAS) -> set[int]:
+    """Conjunto de hashes (crc32) de las secuencias de k palabras del texto normalizado."""
+    palabras = re.findall(r'\w+', normalizar(texto))
+    if len(palabras) <= k:
+        return {zlib.crc32(' '.join(palabras).encode('utf-8'))} if palabras else set()
+    return {zlib.crc32(' '.join(palabras[i:i + k]).encode('utf-8')) for i in range(len(palabras) - k + 1)}
+
+
+def firma_minhash(conjunto: set[int]) -> np.ndarray:
+    """Firma MinHash: el mínimo de cada una de las PERMUTACIONES funciones de hash sobre el conjunto."""
+    if not conjunto:
+        return np.full(PERMUTACIONES, 1 << 32, dtype=np.uint64)
+    x = np.fromiter(conjunto, dtype=np.uint64, count=len(conjunto))
+    return ((_A[:, None] * x[None, :] + _B[:, None]) >> np.uint64(32)).min(axis=1)
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def grupos_casi_duplicados(textos: list[str], umbral: float) -> dict[int, int]:
+    """
+    Agrupa textos casi duplicados: LSH por bandas sobre las firmas MinHash propone candidatos y
+    se confirman con el Jaccard exacto de los shingles. Devuelve {índice: representante} solo
+    para los textos a descartar; el representante de cada grupo es el texto más largo.
+    """
+    conjuntos = [shingles(t) for t in textos]
+    firmas = [firma_minhash(c) for c in conjuntos]
+    filas = PERMUTACIONES // BANDAS
+
+    padre = list(range(len(textos)))
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    for banda in range(BANDAS):
+        cubetas = defaultdict(list)
+        for i, firma in enumerate(firmas):
+            if conjuntos[i]:
+                cubetas[firma[banda * filas:(banda + 1) * filas].tobytes()].append(i)
+        for indices in cubetas.values():
+            # Cada candidato se compara con un miembro de cada grupo ya visto en la cubeta
+            vistos = []
+            for j in indices:
+                for i in vistos:
+                    if raiz(i) == raiz(j) or jaccard(conjuntos[i], conjuntos[j]) >= umbral:
+                        padre[raiz(j)] = raiz(i)
+                        break
+                else:
+                    vistos.append(j)
+
+    grupos = defaultdict(list)
+    for i in range(len(textos)):
+        grupos[raiz(i)].append(i)
+    descartes = {}
+    for miembros in grupos.values():
+        if len(miembros) > 1:
+            representante = max(miembros, key=lambda i: (len(textos[i]), -i))
+            descartes.update({i: representante for i in miembros if i != representante})
+    return descartes
+
+
+def lineas_plantilla(textos: list[str], min_docs: int = LINEA_MIN_DOCS, fraccion: float = LINEA_FRACCION) -> set[str]:
+    """Claves de las líneas que se repiten en muchos documentos (menús, footers, banners)."""
+    frecuencia = defaultdict(int)
+    for texto in textos:
+        for clave in {clave_linea(l) for l in texto.split('\n')} - {None}:
+            frecuencia[clave] += 1
+    minimo = max(min_docs, fraccion * len(textos))
+    return {clave for clave, n in frecuencia.items() if n >= minimo}
+
+
+@dataclass
+class InformeDedup:
+    documentos: int = 0
+    documentos_final: int = 0
+    caracteres: int = 0
+    caracteres_final: int = 0
+    lineas_plantilla: int = 0
+    lineas_eliminadas: int = 0
+    fragmentos: int = 0
+    fragmentos_final: int = 0
+    documentos_eliminados: list = field(default_factory=list)
+
+    def texto(self) -> str:
+        ahorro = 1 - self.caracteres_final / self.caracteres if self.caracteres else 0.0
+        lineas = [
+            f"Deduplicación: {self.documentos} → {self.documentos_final} documentos, "
+            f"{self.fragmentos} → {self.fragmentos_final} fragmentos, "
+            f"{self.caracteres:,} → {self.caracteres_final:,} caracteres (-{ahorro:.0%}, ~{(self.caracteres - self.caracteres_final) // 4:,} tokens).",
+            f"  {self.lineas_plantilla} líneas de plantilla distintas; {self.lineas_eliminadas} apariciones eliminadas.",
+        ]
+        lineas += [f"  Documento descartado: {fuente} ({motivo})" for fuente, motivo in self.documentos_eliminados]
+        return "\n".join(lineas)
+
+
+def _fuente(documento) -> str:
+    return os.path.basename(documento.metadata.get('source', ''))
+
+
+def deduplicar_documentos(documentos: list, informe: InformeDedup) -> list:
+    """
+    Quita de cada documento (langchain Document) las líneas de plantilla y descarta los que
+    quedan casi vacíos o casi duplicados de otro. Modifica page_content en su lugar.
+    """
+    informe.documentos = len(documentos)
+    informe.caracteres = sum(len(d.page_content) for d in documentos)
+
+    plantilla = lineas_plantilla([d.page_content for d in documentos])
+    informe.lineas_plantilla = len(plantilla)
+    conservados = []
+    for documento in documentos:
+        lineas = documento.page_content.split('\n')
+        utiles = [l for l in lineas if clave_linea(l) not in plantilla]
+        informe.lineas_eliminadas += len(lineas) - len(utiles)
+        documento.page_content = '\n'.join(utiles)
+        if len(documento.page_content.strip()) < MIN_CARACTERES_DOCUMENTO:
+            informe.documentos_eliminados.append((_fuente(documento), "solo plantilla"))
+        else:
+            conservados.append(documento)
+
+    duplicados = grupos_casi_duplicados([d.page_content for d in conservados], UMBRAL_DOCUMENTOS)
+    for i, representante in sorted(duplicados.items()):
+        informe.documentos_eliminados.append((_fuente(conservados[i]), f"casi duplicado de {_fuente(conservados[representante])}"))
+    conservados = [d for i, d in enumerate(conservados) if i not in duplicados]
+
+    informe.documentos_final = len(conservados)
+    informe.caracteres_final = sum(len(d.page_content) for d in conservados)
+    return conservados
+
+
+def deduplicar_fragmentos(fragmentos: list, informe: InformeDedup) -> list:
+    """Descarta fragmentos casi duplicados (p. ej. tablas compartidas por dos planes de estudio)."""
+    informe.fragmentos = len(fragmentos)
+    duplicados = grupos_casi_duplicados([f.page_content for f in fragmentos], UMBRAL_FRAGMENTOS)
+    conservados = [f for i, f in enumerate(fragmentos) if i not in duplicados]
+    informe.fragmentos_final = len(conservados)
+    informe.caracteres_final -= sum(len(fragmentos[i].page_content) for i in duplicados)
+    return conservados
@@ -5,12 +5,20 @@
 import os
 import sys
 import time
+import shutil
+import zipfile
 import subprocess
 import logging
 import boto3
 from dotenv import load_dotenv
 from cleaner import main as clean_data_main
-from rag_creator import create_chroma_db_artifact
+from rag_creator import (create_chroma_db_artifact, ARTIFACT_NAME, EMBEDDING_MODEL, CONSULTAS_PARIDAD,
+                         PRECISION_VECTORES, VECTORES_REESCORE, FRAGMENTADOR)
+from chunker import FRAGMENTO_MAX_TOKENS, FRAGMENTO_MIN_TOKENS, FRAGMENTO_SOLAPE_TOKENS
+from flat_index import FLAT_INDEX_DIR, CodificadorONNX, CodificadorST, IndicePlano, coincidencia_top_k, exportar_codificador_onnx
+from bm25_index import BM25_FILE
+from full_context import CORPUS_FILE
+from build_manifest import ManifiestoBuild, hash_archivo, hash_archivos, hash_carpeta, huella
 # --- IMPORTS DE DESPLIEGUE ---
 import sagemaker
 from sagemaker.huggingface import HuggingFaceModel
@@ -31,6 +39,20 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 ENDPOINT_NAME = f'gemini-proxy-{time.strftime("%Y%m%d-%H%M%S")}'
 DB_ZIP_S3_KEY = 'rag-artifacts/chroma_db.zip'
 CODE_ZIP_DIR = os.path.join('model_deploy_proxy', 'code')
+# Modulos auxiliares que inference.py importa y deben viajar en el paquete de codigo
+PROXY_MODULES = ['answer_cache.py', 'micro_batching.py', 'flat_index.py', 'context_builder.py', 'bm25_index.py', 'gemini_client.py', 'telemetry.py', 'shared_serving.py', 'full_context.py', 'artifact_fetch.py']
+# Modelo de embeddings empaquetado junto al codigo (model_dir/embedding_model) para no usar el Hub al arrancar
+EMBEDDING_MODEL_DIR = os.path.join('model_deploy_proxy', 'embedding_model')
+# Lambda en modo directo (sin Endpoint): handler + Proxy + índice compacto + codificador int8
+LAMBDA_DIRECTA = os.environ.get('LAMBDA_DIRECTA', '0') == '1'
+LAMBDA_DIRECTA_DIR = 'lambda_directo'
+LAMBDA_DIRECTA_ZIP = 'lambda_directo.zip'
+LAMBDA_DIRECTA_REQUISITOS = ['numpy<2.0', 'onnxruntime', 'tokenizers', 'google-genai']
+# Construcción incremental: módulos que determinan el contenido del artefacto RAG. Con
+# RECONSTRUIR=1 se ignora el manifiesto de construcción y se rehace todo.
+MODULOS_ARTEFACTO = ['rag_creator.py', 'flat_index.py', 'bm25_index.py', 'full_context.py', 'dedup.py',
+                     'embedding_cache.py', 'chunker.py']
+RECONSTRUIR = os.environ.get('RECONSTRUIR', '0') == '1'
 
 # Obtener la región de la sesión de SageMaker
 SESS = sagemaker.Session()
@@ -61,33 +83,166 @@ def create_s3_bucket(bucket_name: str, region: str):
             sys.exit(1)
 
 
-def upload_rag_artifacts_to_s3(db_zip_name: str, bucket: str) -> str:
-    """Sube el archivo ZIP de ChromaDB y el código del Proxy a S3."""
+def subir_si_cambio(ruta: str, bucket: str, key_prefix: str) -> tuple[str, bool]:
+    """
+    Sube `ruta` a s3://bucket/key_prefix/ con su sha256 como metadato, salvo que el objeto
+    remoto ya tenga el mismo sha256. Devuelve (uri, si se subió).
+    """
+    key = f"{key_prefix}/{os.path.basename(ruta)}"
+    sha256 = hash_archivo(ruta)
+    try:
+        remoto = boto3.client('s3').head_object(Bucket=bucket, Key=key).get('Metadata', {}).get('sha256')
+    except Exception:
+        remoto = None
+
+    if remoto == sha256:
+        logger.info(f"s3://{bucket}/{key} ya está actualizado (sha256 {sha256[:12]}). No se sube.")
+        return f"s3://{bucket}/{key}", False
+    uri = SESS.upload_data(path=ruta, bucket=bucket, key_prefix=key_prefix, extra_args={'Metadata': {'sha256': sha256}})
+    return uri, True
+
+
+def endpoint_activo(nombre: str) -> bool:
+    """Si el Endpoint existe y está en servicio (o creándose/actualizándose)."""
+    try:
+        estado = boto3.client('sagemaker').describe_endpoint(EndpointName=nombre)['EndpointStatus']
+    except Exception:
+        return False
+    return estado in ('InService', 'Creating', 'Updating')
+
+
+def construir_artefacto(manifiesto: ManifiestoBuild, clean_folder: str) -> str:
+    """
+    Etapa de índice: reconstruye el artefacto RAG solo si cambiaron los textos limpios, el
+    modelo de embeddings o los módulos que lo generan; si no, reutiliza el ZIP existente.
+    """
+    entradas = huella(hash_carpeta(clean_folder, '.txt'), EMBEDDING_MODEL, hash_archivos(MODULOS_ARTEFACTO),
+                      PRECISION_VECTORES, VECTORES_REESCORE,
+                      FRAGMENTADOR, FRAGMENTO_MAX_TOKENS, FRAGMENTO_MIN_TOKENS, FRAGMENTO_SOLAPE_TOKENS)
+    if manifiesto.vigente('indice', entradas):
+        logger.info(f"Textos limpios sin cambios: se reutiliza el artefacto {ARTIFACT_NAME}.")
+        return ARTIFACT_NAME
+
+    db_zip_name = create_chroma_db_artifact(clean_folder=clean_folder)
+    if db_zip_name:
+        manifiesto.registrar('indice', entradas, [db_zip_name])
+    return db_zip_name
+
+
+def empaquetar_modelo_embeddings(destino: str):
+    """Guarda una copia local del modelo de embeddings para incluirla en el model.tar.gz."""
+    if os.path.exists(os.path.join(destino, 'config.json')):
+        logger.info(f"Modelo de embeddings ya empaquetado en '{destino}'.")
+        return
+
+    from sentence_transformers import SentenceTransformer
+
+    logger.info(f"Descargando {EMBEDDING_MODEL} para empaquetarlo con el Proxy...")
+    SentenceTransformer(EMBEDDING_MODEL).save(destino)
+
+
+def empaquetar_lambda_directa(db_zip_name: str, manifiesto: ManifiestoBuild) -> str:
+    """
+    Arma el ZIP de la Lambda en modo directo: Lambda_Handler, el Proxy y sus módulos, el
+    índice plano, BM25 y el corpus (sin los archivos de Chroma) en rag_bundle/, el codificador
+    de consultas exportado a ONNX int8 y las dependencias sin torch. Se omite si el artefacto
+    y el código no cambiaron desde el último paquete.
+    """
+    modulos = ['Lambda_Handler.py', 'lambda_streaming.sh', 'gemini_proxy.py'] + PROXY_MODULES
+    entradas = huella(hash_archivo(db_zip_name), hash_archivos(modulos), EMBEDDING_MODEL, LAMBDA_DIRECTA_REQUISITOS)
+    if manifiesto.vigente('lambda_directa', entradas):
+        logger.info(f"Artefacto y código sin cambios: se reutiliza {LAMBDA_DIRECTA_ZIP}.")
+        return LAMBDA_DIRECTA_ZIP
+
+    logger.info("Empaquetando la Lambda en modo directo...")
+    if os.path.exists(LAMBDA_DIRECTA_DIR):
+        shutil.rmtree(LAMBDA_DIRECTA_DIR)
+    bundle = os.path.join(LAMBDA_DIRECTA_DIR, 'rag_bundle')
+
+    with zipfile.ZipFile(db_zip_name, 'r') as zip_ref:
+        for nombre in zip_ref.namelist():
+            if nombre.startswith(FLAT_INDEX_DIR + '/') or nombre in (BM25_FILE, CORPUS_FILE):
+                zip_ref.extract(nombre, bundle)
+
+    carpeta_codificador = exportar_codificador_onnx(EMBEDDING_MODEL, os.path.join(bundle, 'embedding_model'))
+    coincidencia = coincidencia_top_k(IndicePlano(os.path.join(bundle, FLAT_INDEX_DIR)), CodificadorST(EMBEDDING_MODEL),
+                                      CodificadorONNX(carpeta_codificador), CONSULTAS_PARIDAD)
+    logger.info(f"Coincidencia top-7 del codificador int8 contra el original: {coincidencia:.0%}")
+
+    for modulo in modulos:
+        subprocess.run(['cp', modulo, LAMBDA_DIRECTA_DIR], check=True)
+
+    subprocess.run([sys.executable, '-m', 'pip', 'install', '--target', LAMBDA_DIRECTA_DIR,
+                    '--platform', 'manylinux2014_x86_64', '--python-version', '3.12', '--only-binary=:all:',
+                    *LAMBDA_DIRECTA_REQUISITOS], check=True)
+
+    shutil.make_archive(LAMBDA_DIRECTA_ZIP[:-4], 'zip', LAMBDA_DIRECTA_DIR)
+    manifiesto.registrar('lambda_directa', entradas, [LAMBDA_DIRECTA_ZIP])
+    logger.info(f"Paquete de Lambda directa creado: {LAMBDA_DIRECTA_ZIP} (handler: Lambda_Handler.lambda_handler)")
+    return LAMBDA_DIRECTA_ZIP
+
+
+def upload_rag_artifacts_to_s3(db_zip_name: str, bucket: str, manifiesto: ManifiestoBuild) -> tuple[str, bool]:
+    """
+    Sube el archivo ZIP de ChromaDB y el código del Proxy a S3, omitiendo lo que ya está en S3
+    con el mismo contenido. Devuelve la URI del paquete de código y si algo cambió.
+    """
     logger.info("Iniciando carga de artefactos a S3...")
-    s3_client = boto3.client('s3')
     
     # 1. Subir ChromaDB ZIP
-    SESS.upload_data(path=db_zip_name, bucket=bucket, key_prefix='rag-artifacts')
-    logger.info(f"ChromaDB ZIP subido a s3://{bucket}/{DB_ZIP_S3_KEY}")
-    
-    # 2. Empaquetar el código del Proxy
-    logger.info("Empaquetando código del Proxy (inference/requirements)...")
-    
-    if not os.path.exists(CODE_ZIP_DIR):
-        os.makedirs(CODE_ZIP_DIR)
-        
+    _, db_subido = subir_si_cambio(db_zip_name, bucket, 'rag-artifacts')
+    logger.info(f"ChromaDB ZIP en s3://{bucket}/{DB_ZIP_S3_KEY}")
     
-    subprocess.run(['cp', 'gemini_proxy.py', os.path.join(CODE_ZIP_DIR, 'inference.py')], check=True)
-    
-    subprocess.run(['cp', 'requirements.txt', CODE_ZIP_DIR], check=True)
+    # 2. Empaquetar el código del Proxy (solo si cambió el código o el modelo empaquetado)
+    empaquetar_modelo_embeddings(EMBEDDING_MODEL_DIR)
+    entradas = huella(hash_archivos(['gemini_proxy.py', 'requirements.txt'] + PROXY_MODULES),
+                      hash_carpeta(EMBEDDING_MODEL_DIR))
+
+    if manifiesto.vigente('paquete_proxy', entradas):
+        logger.info("Código del Proxy sin cambios: se reutiliza model_proxy.tar.gz.")
+    else:
+        logger.info("Empaquetando código del Proxy (inference/requirements)...")
+
+        if not os.path.exists(CODE_ZIP_DIR):
+            os.makedirs(CODE_ZIP_DIR)
+
+        subprocess.run(['cp', 'gemini_proxy.py', os.path.join(CODE_ZIP_DIR, 'inference.py')], check=True)
 
-    subprocess.run(['tar', '-czvf', 'model_proxy.tar.gz', '-C', 'model_deploy_proxy', 'code'], check=True)
+        for modulo in PROXY_MODULES:
+            subprocess.run(['cp', modulo, CODE_ZIP_DIR], check=True)
+
+        subprocess.run(['cp', 'requirements.txt', CODE_ZIP_DIR], check=True)
+
+        subprocess.run(['tar', '-czvf', 'model_proxy.tar.gz', '-C', 'model_deploy_proxy', 'code', 'embedding_model'], check=True)
+        manifiesto.registrar('paquete_proxy', entradas, ['model_proxy.tar.gz'])
 
     # 3. Subir el paquete de código
-    model_uri = SESS.upload_data(path='model_proxy.tar.gz', bucket=bucket, key_prefix='rag-code-proxy')
-    logger.info(f"Paquete de código subido a: {model_uri}")
+    model_uri, codigo_subido = subir_si_cambio('model_proxy.tar.gz', bucket, 'rag-code-proxy')
+    logger.info(f"Paquete de código en: {model_uri}")
     
-    return model_uri
+    return model_uri, db_subido or codigo_subido
+
+
+def entorno_proxy(bucket: str, api_key: str) -> dict:
+    """Variables de entorno del contenedor del Proxy."""
+    return {
+        'GEMINI_API_KEY': api_key,
+        'S3_BUCKET': bucket,
+        'DB_ZIP_KEY': DB_ZIP_S3_KEY,
+        'HF_TASK': 'text-generation',
+        # Un worker por vCPU de ml.m5.xlarge; índice y pesos compartidos entre ellos
+        'SAGEMAKER_MODEL_SERVER_WORKERS': os.environ.get('PROXY_WORKERS', '4'),
+        'BATCH_MAX_TAMANO': '16',
+        'BATCH_MAX_ESPERA_MS': '10',
+        'MOTOR_BUSQUEDA': 'plano',
+        # MMS no puede devolver un generador: el stream del Proxy se concatena en una respuesta
+        'STREAM_NATIVO': '0',
+        # 'rag' (por defecto) o 'completo' (corpus entero en cache de contexto de Gemini)
+        'MODO_RESPUESTA': os.environ.get('PROXY_MODO_RESPUESTA', 'rag'),
+        'CITAR_FUENTES': os.environ.get('PROXY_CITAR_FUENTES', '0'),
+    }
+
+
 def deploy_sagemaker_proxy(model_uri: str, bucket: str, api_key: str) -> str:
     """Despliega el Endpoint de SageMaker con las variables de entorno de Gemini."""
     logger.info(f"Lanzando Endpoint Proxy SageMaker: {ENDPOINT_NAME}")
@@ -100,13 +255,7 @@ def deploy_sagemaker_proxy(model_uri: str, bucket: str, api_key: str) -> str:
         transformers_version="4.37.0",
         pytorch_version="2.1.0",
         py_version="py310",
-        env={ 
-            'GEMINI_API_KEY': api_key, 
-            'S3_BUCKET': bucket,
-            'DB_ZIP_KEY': DB_ZIP_S3_KEY,
-            'HF_TASK': 'text-generation',
-            'SAGEMAKER_MODEL_SERVER_WORKERS': '1',
-        }
+        env=entorno_proxy(bucket, api_key)
     )
 
     predictor = huggingface_model.deploy(
@@ -131,16 +280,38 @@ def main():
 
     # 1. Crear S3 Bucket
     create_s3_bucket(S3_BUCKET, AWS_REGION)
+
+    # Manifiesto de construcción: cada etapa se omite si sus entradas no cambiaron
+    manifiesto = ManifiestoBuild()
+    if RECONSTRUIR:
+        manifiesto.etapas = {}
     
     # 2. Limpieza y Creación de Artefactos RAG
-    clean_data_main(input_folder=os.path.join('Back_End','Data', 'texts'), output_folder=os.path.join('Back_End', 'Data', 'Clean_Text'))
-    db_zip_name = create_chroma_db_artifact(clean_folder=os.path.join('Back_End', 'Data', 'Clean_Text'))
+    clean_folder = os.path.join('Back_End', 'Data', 'Clean_Text')
+    clean_data_main(input_folder=os.path.join('Back_End','Data', 'texts'), output_folder=clean_folder, manifiesto=manifiesto)
+    db_zip_name = construir_artefacto(manifiesto, clean_folder)
+
+    # Modo directo: la Lambda sirve sola (sin Endpoint ni instancia siempre encendida)
+    if LAMBDA_DIRECTA:
+        paquete = empaquetar_lambda_directa(db_zip_name, manifiesto)
+        uri, subido = subir_si_cambio(paquete, S3_BUCKET, 'rag-lambda')
+        if subido:
+            logger.info(f"Paquete subido a {uri}. Configure la Lambda con GEMINI_API_KEY y MODO_DIRECTO=1.")
+        return
 
     # 3. Subir a S3 y Empaquetar el Código del Proxy
-    code_uri = upload_rag_artifacts_to_s3(db_zip_name, S3_BUCKET)
+    code_uri, cambio = upload_rag_artifacts_to_s3(db_zip_name, S3_BUCKET, manifiesto)
+
+    # 4. Desplegar SageMaker Endpoint (Proxy Gemini), salvo que el último siga sirviendo lo mismo
+    configuracion = huella(code_uri, entorno_proxy(S3_BUCKET, GEMINI_API_KEY))
+    anterior = manifiesto.etapa('despliegue')
+    if not cambio and anterior.get('configuracion') == configuracion and endpoint_activo(anterior.get('endpoint', '')):
+        logger.info(f"Artefacto, código y configuración sin cambios: el Endpoint {anterior['endpoint']} sigue vigente. No se redespliega.")
+        return
 
-    # 4. Desplegar SageMaker Endpoint (Proxy Gemini)
     endpoint_name = deploy_sagemaker_proxy(code_uri, S3_BUCKET, GEMINI_API_KEY)
+    manifiesto.etapas['despliegue'] = {"endpoint": endpoint_name, "configuracion": configuracion}
+    manifiesto.guardar()
     
     logger.info("\n--- PROCESO DE BACKEND FINALIZADO ---")
     logger.info(f"Endpoint de SageMaker listo: {endpoint_name}")
@@ -0,0 +1,106 @@
+# Back_End/embedding_cache.py
+# Cache persistente de embeddings para la construcción del índice: clave (modelo, hash del
+# fragmento), así solo se calculan los fragmentos nuevos o modificados entre construcciones.
+
+import os
+import time
+import sqlite3
+import hashlib
+
+import numpy as np
+
+EMBEDDING_CACHE_FILE = os.path.join('Back_End', 'Data', 'embedding_cache.sqlite')
+EMBEDDING_LOTE = int(os.environ.get('EMBEDDING_LOTE', '64'))
+EMBEDDING_HILOS = int(os.environ.get('EMBEDDING_HILOS', str(os.cpu_count() or 1)))
+
+
+def hash_fragmento(texto: str) -> str:
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def id_fragmento(fuente: str, texto: str) -> str:
+    """Id estable derivado del contenido: el mismo fragmento de la misma fuente conserva su id."""
+    return hashlib.sha256(f"{os.path.basename(fuente)}\0{texto}".encode('utf-8')).hexdigest()[:32]
+
+
+def cambios_indice(fragmentos: dict[str, dict], existentes: dict[str, dict]) -> tuple[list, list, list]:
+    """Compara los fragmentos actuales (id -> metadatos) con los del índice: ids nuevos, ids obsoletos
+    e ids existentes cuyos metadatos cambiaron (mismo texto, otra sección o fuente renombrada)."""
+    nuevos = [i for i in fragmentos if i not in existentes]
+    obsoletos = sorted(existentes.keys() - fragmentos.keys())
+    actualizar = [i for i in fragmentos if i in existentes and (existentes[i] or {}) != fragmentos[i]]
+    return nuevos, obsoletos, actualizar
+
+
+class CacheEmbeddings:
+    """Vectores float32 en SQLite con clave (modelo, hash del texto)."""
+
+    def __init__(self, ruta: str = EMBEDDING_CACHE_FILE):
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self.conexion = sqlite3.connect(ruta)
+        self.conexion.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+            modelo TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (modelo, hash))""")
+        self.conexion.commit()
+
+    def obtener(self, modelo: str, hashes: list[str]) -> dict[str, list[float]]:
+        encontrados = {}
+        for inicio in range(0, len(hashes), 500):
+            lote = hashes[inicio:inicio + 500]
+            filas = self.conexion.execute(
+                f"SELECT hash, vector FROM embeddings WHERE modelo = ? AND hash IN ({','.join('?' * len(lote))})",
+                [modelo, *lote])
+            encontrados.update({h: np.frombuffer(v, dtype=np.float32).tolist() for h, v in filas})
+        return encontrados
+
+    def guardar(self, modelo: str, vectores: dict[str, list[float]]):
+        self.conexion.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                  [(modelo, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in vectores.items()])
+        self.conexion.commit()
+
+    def cerrar(self):
+        self.conexion.close()
+
+
+class EmbeddingsCacheados:
+    """
+    Envuelve un modelo de embeddings (embed_documents/embed_query) con la cache: los textos ya
+    vistos con el mismo modelo se leen de disco y el resto se calcula por lotes de `lote`.
+    Las consultas no se guardan en la cache.
+    """
+
+    def __init__(self, base, modelo: str, cache: CacheEmbeddings, lote: int = EMBEDDING_LOTE):
+        self.base = base
+        self.modelo = modelo
+        self.cache = cache
+        self.lote = lote
+        self.aciertos = 0
+        self.calculados = 0
+        self.segundos = 0.0
+
+    def embed_documents(self, textos: list[str]) -> list[list[float]]:
+        hashes = [hash_fragmento(t) for t in textos]
+        vectores = self.cache.obtener(self.modelo, list(dict.fromkeys(hashes)))
+        pendientes = {h: t for h, t in zip(hashes, textos) if h not in vectores}
+        self.aciertos += len(hashes) - len(pendientes)
+        claves = list(pendientes)
+        for inicio in range(0, len(claves), self.lote):
+            lote = claves[inicio:inicio + self.lote]
+            t0 = time.perf_counter()
+            calculados = dict(zip(lote, self.base.embed_documents([pendientes[h] for h in lote])))
+            self.segundos += time.perf_counter() - t0
+            self.calculados += len(lote)
+            self.cache.guardar(self.modelo, calculados)
+            vectores.update(calculados)
+        if claves:
+            print(f"  Embeddings: {len(claves)} calculados, {len(hashes) - len(claves)} desde la cache.")
+        return [vectores[h] for h in hashes]
+
+    def embed_query(self, texto: str) -> list[float]:
+        return self.base.embed_query(texto)
+
+    def resumen(self) -> str:
+        total = self.aciertos + self.calculados
+        tasa = self.aciertos / total if total else 0.0
+        velocidad = self.calculados / self.segundos if self.segundos else 0.0
+        return (f"Cache de embeddings: {self.aciertos}/{total} aciertos ({tasa:.0%}); "
+                f"{self.calculados} fragmentos calculados a {velocidad:.1f} fragmentos/s.")
@@ -0,0 +1,278 @@
+# Back_End/flat_index.py
+# Indice vectorial plano (matriz normalizada + tabla de fragmentos) servido con mmap, sin Chroma.
+
+import os
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+FLAT_INDEX_DIR = 'flat_index'
+VECTORES_FILE = 'vectores.npy'
+FRAGMENTOS_FILE = 'fragmentos.json'
+META_FILE = 'meta.json'
+# Vectores cuantizados: escala por fila (int8) y copia float32 opcional para reordenar candidatos
+ESCALAS_FILE = 'escalas.npy'
+VECTORES_COMPLETOS_FILE = 'vectores_f32.npy'
+PRECISIONES = ('float32', 'float16', 'int8')
+# Filas por bloque al puntuar vectores cuantizados (acota la memoria temporal al convertirlos)
+BLOQUE_PUNTUACION = 65536
+# Codificador de consultas exportado a ONNX y cuantizado (int8), para servir sin torch
+ONNX_FILE = 'model_quantized.onnx'
+ONNX_CONFIG_FILE = 'codificador.json'
+
+
+@dataclass
+class Fragmento:
+    """Fragmento recuperado; expone la misma interfaz que un Document de langchain."""
+    page_content: str
+    metadata: dict = field(default_factory=dict)
+    vector: object = field(default=None, repr=False)  # embedding del fragmento (para MMR)
+
+
+def normalizar_filas(matriz) -> np.ndarray:
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def cuantizar(matriz: np.ndarray, precision: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Convierte la matriz normalizada a `precision`. En int8 cada fila lleva su escala
+    (máximo absoluto / 127), de modo que fila ≈ q * escala. Devuelve (matriz, escalas o None).
+    """
+    if precision == 'float32':
+        return matriz, None
+    if precision == 'float16':
+        return matriz.astype(np.float16), None
+    if precision == 'int8':
+        escalas = np.abs(matriz).max(axis=1) / 127.0
+        escalas[escalas == 0] = 1.0
+        return np.rint(matriz / escalas[:, None]).astype(np.int8), escalas.astype(np.float32)
+    raise ValueError(f"Precisión no soportada: {precision} (opciones: {', '.join(PRECISIONES)})")
+
+
+def exportar_indice_plano(textos: list[str], metadatas: list[dict], vectores, carpeta: str, model_name: str = '',
+                          precision: str = 'float32', guardar_completos: bool = False) -> str:
+    """
+    Escribe el índice plano en `carpeta`: los vectores normalizados en `precision` (.npy, apto
+    para mmap) y la tabla de textos/metadatos alineada por fila. Con una precisión reducida y
+    `guardar_completos`, también se guarda la matriz float32 para reordenar candidatos.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    matriz = normalizar_filas(vectores)
+    cuantizada, escalas = cuantizar(matriz, precision)
+
+    np.save(os.path.join(carpeta, VECTORES_FILE), cuantizada)
+    extras = {ESCALAS_FILE: escalas, VECTORES_COMPLETOS_FILE: matriz if precision != 'float32' and guardar_completos else None}
+    for nombre, datos in extras.items():
+        ruta = os.path.join(carpeta, nombre)
+        if datos is not None:
+            np.save(ruta, datos)
+        elif os.path.exists(ruta):
+            # Resto de una exportación anterior con otra configuración
+            os.remove(ruta)
+    with open(os.path.join(carpeta, FRAGMENTOS_FILE), 'w', encoding='utf-8') as f:
+        json.dump([{"texto": t, "metadata": m or {}} for t, m in zip(textos, metadatas)], f, ensure_ascii=False)
+    with open(os.path.join(carpeta, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"n": int(matriz.shape[0]), "dim": int(matriz.shape[1]), "modelo": model_name,
+                   "precision": precision}, f)
+
+    return carpeta
+
+
+class IndicePlano:
+    """
+    Búsqueda exacta por producto punto sobre la matriz de vectores mapeada en memoria.
+    Si la matriz está cuantizada (float16/int8), se puntúa sobre ella y, con `reescore` > 0
+    y la copia float32 disponible, los `reescore` mejores candidatos se reordenan a precisión
+    completa (solo se leen esas filas del mmap).
+    """
+
+    def __init__(self, carpeta: str, reescore: int = 0):
+        self.carpeta = carpeta
+        self.vectores = np.load(os.path.join(carpeta, VECTORES_FILE), mmap_mode='r')
+        with open(os.path.join(carpeta, FRAGMENTOS_FILE), 'r', encoding='utf-8') as f:
+            self.fragmentos = [Fragmento(page_content=d["texto"], metadata=d["metadata"]) for d in json.load(f)]
+        with open(os.path.join(carpeta, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.precision = self.meta.get("precision", "float32")
+        ruta_escalas = os.path.join(carpeta, ESCALAS_FILE)
+        self.escalas = np.load(ruta_escalas) if os.path.exists(ruta_escalas) else None
+        ruta_completos = os.path.join(carpeta, VECTORES_COMPLETOS_FILE)
+        self.completos = np.load(ruta_completos, mmap_mode='r') if reescore and os.path.exists(ruta_completos) else None
+        self.reescore = reescore if self.completos is not None else 0
+
+    def __len__(self):
+        return len(self.fragmentos)
+
+    def vector(self, i: int) -> np.ndarray:
+        """Vector float32 de la fila i (la copia completa si existe; si no, el decuantizado)."""
+        if self.completos is not None:
+            return self.completos[i]
+        fila = np.asarray(self.vectores[i], dtype=np.float32)
+        return fila * self.escalas[i] if self.escalas is not None else fila
+
+    def puntuar(self, vectores) -> np.ndarray:
+        """Similitud coseno de cada consulta contra todas las filas (consultas x fragmentos)."""
+        consultas = normalizar_filas(vectores)
+        if self.precision == 'float32':
+            return consultas @ self.vectores.T
+        puntajes = np.empty((consultas.shape[0], len(self.vectores)), dtype=np.float32)
+        for inicio in range(0, len(self.vectores), BLOQUE_PUNTUACION):
+            bloque = np.asarray(self.vectores[inicio:inicio + BLOQUE_PUNTUACION], dtype=np.float32)
+            puntajes[:, inicio:inicio + len(bloque)] = consultas @ bloque.T
+        if self.escalas is not None:
+            puntajes *= self.escalas[None, :]
+        return puntajes
+
+    def buscar_ids(self, vectores, k: int) -> list[list[int]]:
+        puntajes = self.puntuar(vectores)
+        if self.reescore > k:
+            # Filas ordenadas: lectura secuencial del mmap
+            candidatos = np.sort(_top_k(puntajes, self.reescore), axis=1)
+            exactos = np.einsum('qd,qcd->qc', normalizar_filas(vectores), self.completos[candidatos])
+            return np.take_along_axis(candidatos, _top_k(exactos, k), axis=1).tolist()
+        return _top_k(puntajes, k).tolist()
+
+    def buscar_por_vectores(self, vectores, k: int) -> list[list[Fragmento]]:
+        return [
+            [Fragmento(self.fragmentos[i].page_content, self.fragmentos[i].metadata, self.vector(i)) for i in fila]
+            for fila in self.buscar_ids(vectores, k)
+        ]
+
+
+def _top_k(puntajes: np.ndarray, k: int) -> np.ndarray:
+    """Índices de las k columnas con mayor puntaje por fila, en orden descendente."""
+    k = min(k, puntajes.shape[1])
+    top = np.argpartition(-puntajes, k - 1, axis=1)[:, :k]
+    orden = np.take_along_axis(puntajes, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, orden, axis=1)
+
+
+class CodificadorST:
+    """
+    Codificador de consultas con sentence-transformers sin pasar por langchain.
+    Reproduce el preprocesamiento de HuggingFaceEmbeddings para obtener los mismos vectores.
+    """
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.modelo = SentenceTransformer(model_name)
+
+    def embed_documents(self, textos: list[str]) -> list[list[float]]:
+        textos = [t.replace("\n", " ") for t in textos]
+        return self.modelo.encode(textos).tolist()
+
+    def embed_query(self, texto: str) -> list[float]:
+        return self.embed_documents([texto])[0]
+
+
+class CodificadorONNX:
+    """
+    Codificador de consultas con el modelo exportado a ONNX y cuantizado a int8: solo
+    necesita onnxruntime y tokenizers. Aplica el mismo mean pooling que sentence-transformers.
+    """
+
+    def __init__(self, carpeta: str, hilos: int | None = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(carpeta, ONNX_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(carpeta, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(self.config["max_tokens"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        opciones = ort.SessionOptions()
+        if hilos:
+            opciones.intra_op_num_threads = hilos
+        self.sesion = ort.InferenceSession(os.path.join(carpeta, ONNX_FILE), opciones,
+                                           providers=["CPUExecutionProvider"])
+        self.entradas = {e.name for e in self.sesion.get_inputs()}
+
+    def embed_documents(self, textos: list[str]) -> list[list[float]]:
+        codificados = self.tokenizer.encode_batch([t.replace("\n", " ") for t in textos])
+        ids = np.array([c.ids for c in codificados], dtype=np.int64)
+        mascara = np.array([c.attention_mask for c in codificados], dtype=np.int64)
+        alimentacion = {"input_ids": ids, "attention_mask": mascara}
+        if "token_type_ids" in self.entradas:
+            alimentacion["token_type_ids"] = np.zeros_like(ids)
+
+        ocultos = self.sesion.run(None, alimentacion)[0]
+        pesos = mascara[:, :, None].astype(np.float32)
+        return ((ocultos * pesos).sum(axis=1) / np.clip(pesos.sum(axis=1), 1e-9, None)).tolist()
+
+    def embed_query(self, texto: str) -> list[float]:
+        return self.embed_documents([texto])[0]
+
+
+def exportar_codificador_onnx(model_name: str, carpeta: str) -> str:
+    """
+    Exporta el transformer del modelo de sentence-transformers a ONNX y lo cuantiza a int8
+    (cuantización dinámica de pesos). Guarda tokenizer.json y la configuración de padding.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    modelo = SentenceTransformer(model_name)
+    transformer, tokenizer = modelo[0].auto_model, modelo.tokenizer
+    os.makedirs(carpeta, exist_ok=True)
+    tokenizer.save_pretrained(carpeta)
+
+    muestra = tokenizer(["¿Cuáles son los requisitos de admisión?"], return_tensors='pt')
+    ruta_fp32 = os.path.join(carpeta, 'model.onnx')
+    nombres = ['input_ids', 'attention_mask', 'last_hidden_state']
+    torch.onnx.export(
+        transformer, (muestra['input_ids'], muestra['attention_mask']), ruta_fp32,
+        input_names=nombres[:2], output_names=nombres[2:],
+        dynamic_axes={n: {0: 'lote', 1: 'tokens'} for n in nombres}, opset_version=14,
+    )
+    quantize_dynamic(ruta_fp32, os.path.join(carpeta, ONNX_FILE), weight_type=QuantType.QInt8)
+    os.remove(ruta_fp32)
+
+    with open(os.path.join(carpeta, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"modelo": model_name, "max_tokens": modelo.max_seq_length,
+                   "pad_token": tokenizer.pad_token, "pad_id": tokenizer.pad_token_id}, f)
+    return carpeta
+
+
+def coincidencia_top_k(indice: IndicePlano, referencia, candidato, consultas: list[str], k: int = 7) -> float:
+    """Fracción promedio del top-k de `referencia` que también recupera `candidato` (mismo índice)."""
+    if not consultas:
+        return 1.0
+    esperados = indice.buscar_ids(referencia.embed_documents(consultas), k)
+    obtenidos = indice.buscar_ids(candidato.embed_documents(consultas), k)
+    return float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(esperados, obtenidos)]))
+
+
+def recall_cuantizado(referencia: IndicePlano, cuantizado: IndicePlano, vectores, k: int = 7) -> float:
+    """Recall@k promedio del índice cuantizado frente al float32 de referencia (mismas filas)."""
+    if len(vectores) == 0:
+        return 1.0
+    esperados = referencia.buscar_ids(vectores, k)
+    obtenidos = cuantizado.buscar_ids(vectores, k)
+    return float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(esperados, obtenidos)]))
+
+
+def paridad_por_consulta(db, indice: IndicePlano, embeddings, consultas: list[str], k: int = 7) -> list[float]:
+    """
+    Fracción del top-k de Chroma que también devuelve el índice plano, por consulta. Se compara
+    como conjunto: HNSW es aproximado y puede intercambiar fragmentos casi empatados.
+    """
+    vectores = embeddings.embed_documents(consultas)
+    planos = indice.buscar_por_vectores(vectores, k)
+    coincidencias = []
+    for vector, docs_plano in zip(vectores, planos):
+        chroma = [d.page_content for d in db.similarity_search_by_vector(vector, k=k)]
+        coincidencias.append(len(set(chroma) & {d.page_content for d in docs_plano}) / max(1, len(chroma)))
+    return coincidencias
+
+
+def verificar_paridad(db, indice: IndicePlano, embeddings, consultas: list[str], k: int = 7) -> float:
+    """Coincidencia promedio del top-k del índice plano con el de Chroma (ver paridad_por_consulta)."""
+    if not consultas:
+        return 1.0
+    return float(np.mean(paridad_por_consulta(db, indice, embeddings, consultas, k)))
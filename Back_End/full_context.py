@@ -0,0 +1,157 @@
+# Back_End/full_context.py
+# Modo de contexto completo: el corpus limpio entero y las instrucciones de sistema se suben
+# una vez a Gemini como contexto en cache (context caching) y cada solicitud envía solo la pregunta.
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from google.genai import types
+
+CORPUS_FILE = 'corpus.json'
+PREFIJO_CACHE = 'rag-corpus-'
+
+INSTRUCCION_SISTEMA = """Eres un asistente administrativo útil. Responde de forma muy concisa usando SOLO los documentos proporcionados.
+Reglas:
+1. Responde usando SOLO los documentos.
+2. Si la respuesta no está, di "No tengo información."
+"""
+
+
+def exportar_corpus(documentos, ruta: str):
+    """Guarda los documentos limpios completos (uno por archivo fuente) para el modo de contexto completo."""
+    corpus = [{"fuente": os.path.basename(d.metadata.get('source', '')), "texto": d.page_content} for d in documentos]
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False)
+    return ruta
+
+
+def cargar_corpus(ruta: str) -> list[dict]:
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def texto_corpus(corpus: list[dict]) -> str:
+    """Concatena los documentos con su fuente como encabezado."""
+    return "\n\n".join(f"### Documento: {d['fuente']}\n{d['texto'].strip()}" for d in corpus)
+
+
+def caches_antiguos(caches: list) -> list:
+    """
+    Caches de otras versiones del corpus que se pueden borrar: todos salvo los de la versión
+    creada más recientemente (la que puede seguir en servicio durante un despliegue blue/green).
+    Un cache sin fecha de creación cuenta como el más antiguo.
+    """
+    def creado(cache):
+        fecha = getattr(cache, 'create_time', None)
+        return fecha.timestamp() if fecha is not None else float('-inf')
+
+    if not caches:
+        return []
+    vigente = max(caches, key=creado).display_name
+    return [cache for cache in caches if cache.display_name != vigente]
+
+
+class ContextoCompleto:
+    """
+    Mantiene un contexto en cache de Gemini con el corpus completo. La etiqueta del cache es
+    un hash de modelo, instrucciones y corpus: si el artefacto cambia, se crea un cache nuevo;
+    si no, se reutiliza el existente (entre workers y reinicios). El TTL se renueva antes de
+    expirar. De las otras versiones se conserva la más reciente (durante un despliegue
+    blue/green la versión anterior sigue sirviendo y renovando su cache) y se borran las más
+    antiguas; un cache abandonado expira solo al terminar su TTL.
+    Si el cache no se puede crear (corpus bajo el mínimo de tokens, cuota, etc.), el corpus
+    se envía en cada solicitud como instrucción de sistema.
+    """
+
+    def __init__(self, gemini, modelo: str, corpus: list[dict], ttl_segundos: float = 3600,
+                 margen_segundos: float = 300, usar_cache: bool = True):
+        self.gemini = gemini
+        self.modelo = modelo
+        self.texto = texto_corpus(corpus)
+        self.fuentes = [d['fuente'] for d in corpus]
+        self.ttl_segundos = ttl_segundos
+        self.margen_segundos = margen_segundos
+        huella = hashlib.sha256(f"{modelo}\n{INSTRUCCION_SISTEMA}\n{self.texto}".encode('utf-8')).hexdigest()
+        self.etiqueta = PREFIJO_CACHE + huella[:16]
+        self.nombre = None
+        self._expira = 0.0
+        self._lock = threading.Lock()
+        if usar_cache:
+            self.preparar()
+
+    def _ttl(self) -> str:
+        return f"{int(self.ttl_segundos)}s"
+
+    def preparar(self) -> str | None:
+        """Reutiliza o crea el cache de esta versión del corpus. Devuelve su nombre (o None)."""
+        try:
+            existente = None
+            otras = []
+            for cache in self.gemini.caches.list():
+                nombre_visible = getattr(cache, 'display_name', '') or ''
+                if nombre_visible == self.etiqueta:
+                    existente = existente or cache
+                elif nombre_visible.startswith(PREFIJO_CACHE):
+                    otras.append(cache)
+            for cache in caches_antiguos(otras):
+                self.gemini.caches.delete(name=cache.name)
+            if existente is not None:
+                self.nombre = existente.name
+                self._renovar()
+                print(f"Contexto completo: reutilizando cache {self.nombre}")
+            else:
+                cache = self.gemini.caches.create(
+                    model=self.modelo,
+                    config=types.CreateCachedContentConfig(
+                        display_name=self.etiqueta,
+                        system_instruction=INSTRUCCION_SISTEMA,
+                        contents=[self.texto],
+                        ttl=self._ttl(),
+                    ),
+                )
+                self.nombre = cache.name
+                self._expira = time.monotonic() + self.ttl_segundos
+                print(f"Contexto completo: cache creado {self.nombre} ({len(self.fuentes)} documentos)")
+        except Exception as e:
+            print(f"Contexto completo: no se pudo usar context caching ({e}); el corpus se enviará en cada solicitud.")
+            self.nombre = None
+        return self.nombre
+
+    def _renovar(self):
+        self.gemini.caches.update(name=self.nombre, config=types.UpdateCachedContentConfig(ttl=self._ttl()))
+        self._expira = time.monotonic() + self.ttl_segundos
+
+    def _nombre_vigente(self) -> str | None:
+        """Nombre del cache, renovando su TTL si está por expirar (o recreándolo si ya no existe)."""
+        if self.nombre is None:
+            return None
+        with self._lock:
+            if time.monotonic() >= self._expira - self.margen_segundos:
+                try:
+                    self._renovar()
+                except Exception:
+                    self.preparar()
+            return self.nombre
+
+    def solicitud(self, pregunta: str, timeout_s: float | None = None) -> dict:
+        """
+        Argumentos de generate_content: solo la pregunta sobre el cache, o el corpus en línea.
+        `timeout_s` es el timeout HTTP del intento.
+        """
+        nombre = self._nombre_vigente()
+        http = types.HttpOptions(timeout=max(1, int(timeout_s * 1000))) if timeout_s is not None else None
+        if nombre:
+            config = types.GenerateContentConfig(temperature=0.01, cached_content=nombre, http_options=http)
+        else:
+            config = types.GenerateContentConfig(temperature=0.01, http_options=http,
+                                                 system_instruction=f"{INSTRUCCION_SISTEMA}\n{self.texto}")
+        return {"model": self.modelo, "contents": [pregunta], "config": config}
+
+    def generar(self, pregunta: str, timeout_s: float | None = None):
+        return self.gemini.models.generate_content(**self.solicitud(pregunta, timeout_s))
+
+    def generar_stream(self, pregunta: str, timeout_s: float | None = None):
+        return self.gemini.models.generate_content_stream(**self.solicitud(pregunta, timeout_s))
@@ -0,0 +1,191 @@
+# Back_End/gemini_client.py
+# Cliente de Gemini con plazo por solicitud, reintentos con backoff y solicitudes de respaldo (hedging).
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+CODIGO_PLAZO_AGOTADO = 'DEADLINE_EXCEEDED'
+CODIGOS_HTTP_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
+
+class PlazoAgotado(Exception):
+    """El presupuesto de tiempo de la solicitud se agotó antes de obtener respuesta."""
+    codigo = CODIGO_PLAZO_AGOTADO
+
+
+def es_reintentable(error: Exception) -> bool:
+    """Errores transitorios: códigos HTTP de sobrecarga/servidor, timeouts y fallos de conexión."""
+    codigo = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if isinstance(codigo, int):
+        return codigo in CODIGOS_HTTP_REINTENTABLES
+    return isinstance(error, (TimeoutError, ConnectionError)) or 'Timeout' in type(error).__name__
+
+
+class ClienteGeminiConPlazo:
+    """
+    Envuelve una función de generación (prompt, timeout_s -> respuesta) y la ejecuta dentro de
+    un plazo absoluto (time.monotonic). Reintenta errores transitorios con backoff exponencial
+    con jitter y, si está habilitado, lanza una segunda solicitud cuando la primera supera el
+    percentil de latencia observado. Lleva contadores de reintentos y hedges.
+
+    Cada intento recibe como timeout HTTP el tiempo que le queda al plazo cuando empieza, así
+    un intento abandonado (plazo agotado o hedge perdedor) libera su hilo a más tardar al vencer
+    el plazo. Un intento que sale de la cola del pool con el plazo ya vencido no llama a Gemini,
+    y el hedge solo se lanza si hay hilos libres. `generar_stream` (prompt, timeout_s -> iterador
+    de fragmentos) habilita `generar_en_stream` con el mismo plazo y los mismos reintentos.
+    """
+
+    def __init__(self, generar, max_reintentos: int = 2, backoff_base: float = 0.25,
+                 backoff_max: float = 2.0, hedge_habilitado: bool = False,
+                 hedge_percentil: float = 0.95, hedge_min_muestras: int = 20, max_hilos: int = 8,
+                 generar_stream=None):
+        self._generar = generar
+        self._generar_stream = generar_stream
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_habilitado = hedge_habilitado
+        self.hedge_percentil = hedge_percentil
+        self.hedge_min_muestras = hedge_min_muestras
+        self.max_hilos = max_hilos
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="gemini")
+        self._ocupados = 0
+        self._latencias = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.contadores = {"solicitudes": 0, "reintentos": 0, "hedges": 0, "hedges_ganadores": 0, "plazos_agotados": 0}
+
+    def _contar(self, clave: str, n: int = 1):
+        with self._lock:
+            self.contadores[clave] += n
+
+    def metricas(self) -> dict:
+        umbral = self.umbral_hedge()
+        with self._lock:
+            return dict(self.contadores, umbral_hedge_s=umbral, intentos_en_curso=self._ocupados)
+
+    def umbral_hedge(self) -> float | None:
+        """Latencia (s) a partir de la cual se lanza la solicitud de respaldo."""
+        with self._lock:
+            if len(self._latencias) < self.hedge_min_muestras:
+                return None
+            ordenadas = sorted(self._latencias)
+        return ordenadas[min(int(len(ordenadas) * self.hedge_percentil), len(ordenadas) - 1)]
+
+    def _enviar(self, prompt: str, plazo: float):
+        with self._lock:
+            self._ocupados += 1
+        return self._pool.submit(self._ejecutar, prompt, plazo)
+
+    def _ejecutar(self, prompt: str, plazo: float):
+        """Corre en el pool: llama a Gemini con el tiempo restante del plazo como timeout."""
+        try:
+            restante = plazo - time.monotonic()
+            if restante <= 0:
+                raise PlazoAgotado("Plazo agotado esperando un hilo libre.")
+            return self._generar(prompt, restante)
+        finally:
+            with self._lock:
+                self._ocupados -= 1
+
+    def _hilos_libres(self) -> int:
+        with self._lock:
+            return self.max_hilos - self._ocupados
+
+    def _intento(self, prompt: str, plazo: float) -> tuple:
+        """Un intento, con hedge opcional. Devuelve (respuesta, detalle)."""
+        inicio = time.monotonic()
+        futuros = {self._enviar(prompt, plazo): "principal"}
+        umbral = self.umbral_hedge() if self.hedge_habilitado else None
+
+        if umbral is not None:
+            hechos, _ = wait(futuros, timeout=max(0.0, min(umbral, plazo - time.monotonic())))
+            if not hechos and time.monotonic() < plazo and self._hilos_libres() > 0:
+                futuros[self._enviar(prompt, plazo)] = "hedge"
+                self._contar("hedges")
+
+        pendientes = set(futuros)
+        ultimo_error = None
+        while pendientes:
+            restante = plazo - time.monotonic()
+            if restante <= 0:
+                raise PlazoAgotado("Se agotó el plazo esperando a Gemini.")
+            hechos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                if futuro.exception() is None:
+                    with self._lock:
+                        self._latencias.append(time.monotonic() - inicio)
+                    if futuros[futuro] == "hedge":
+                        self._contar("hedges_ganadores")
+                    return futuro.result(), {"hedge": len(futuros) > 1, "ganador": futuros[futuro]}
+                ultimo_error = futuro.exception()
+        raise ultimo_error
+
+    def generar(self, prompt: str, plazo: float) -> tuple:
+        """
+        Genera la respuesta antes de `plazo` (time.monotonic). Lanza PlazoAgotado si no alcanza.
+        Devuelve (respuesta, detalle) con los reintentos usados y si hubo hedge.
+        """
+        self._contar("solicitudes")
+        reintentos = 0
+        while True:
+            if time.monotonic() >= plazo:
+                self._contar("plazos_agotados")
+                raise PlazoAgotado("Plazo agotado antes de llamar a Gemini.")
+            try:
+                respuesta, detalle = self._intento(prompt, plazo)
+                return respuesta, dict(detalle, reintentos=reintentos)
+            except PlazoAgotado:
+                self._contar("plazos_agotados")
+                raise
+            except Exception as e:
+                self._esperar_reintento(e, reintentos, plazo)
+                reintentos += 1
+
+    def generar_en_stream(self, prompt: str, plazo: float):
+        """
+        Produce los fragmentos de Gemini conforme llegan, antes de `plazo` (time.monotonic). El
+        stream recibe el tiempo restante como timeout HTTP; los errores transitorios se reintentan
+        solo mientras no se haya emitido ningún fragmento. Si el plazo vence antes o durante el
+        stream (también entre fragmentos), lanza PlazoAgotado.
+        """
+        self._contar("solicitudes")
+        reintentos = 0
+        emitidos = 0
+        while True:
+            if time.monotonic() >= plazo:
+                self._contar("plazos_agotados")
+                raise PlazoAgotado("Plazo agotado antes de llamar a Gemini.")
+            try:
+                for fragmento in self._generar_stream(prompt, plazo - time.monotonic()):
+                    if time.monotonic() >= plazo:
+                        raise PlazoAgotado("Se agotó el plazo durante el stream de Gemini.")
+                    emitidos += 1
+                    yield fragmento
+                return
+            except PlazoAgotado:
+                self._contar("plazos_agotados")
+                raise
+            except Exception as e:
+                if emitidos and not (time.monotonic() >= plazo and es_reintentable(e)):
+                    # Ya se enviaron fragmentos al cliente: no se puede repetir la respuesta
+                    raise
+                self._esperar_reintento(e, reintentos, plazo)
+                reintentos += 1
+
+    def _esperar_reintento(self, error: Exception, reintentos: int, plazo: float):
+        """Espera el backoff antes de reintentar; relanza el error (o PlazoAgotado) si no se reintenta."""
+        # El timeout HTTP del intento coincide con el fin del plazo
+        if time.monotonic() >= plazo and es_reintentable(error):
+            self._contar("plazos_agotados")
+            raise PlazoAgotado(f"Plazo agotado tras {reintentos + 1} intentos: {error}") from error
+        if not es_reintentable(error) or reintentos >= self.max_reintentos:
+            raise error
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** reintentos))
+        if time.monotonic() + espera >= plazo:
+            self._contar("plazos_agotados")
+            raise PlazoAgotado(f"Plazo agotado tras {reintentos + 1} intentos: {error}") from error
+        self._contar("reintentos")
+        time.sleep(espera)
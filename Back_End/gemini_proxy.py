@@ -5,19 +5,26 @@ import os
 import sys
 import json
 import boto3
-import zipfile
-import shutil
 import time 
-
-# Necesario para que ChromaDB funcione en el entorno de Linux de SageMaker.
-__import__('pysqlite3')
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 # --- IMPORTS Y CONFIGURACIÓN ---
+# Chroma y langchain se importan solo si MOTOR_BUSQUEDA='chroma' (ver _cargar_chroma).
 from google import genai
 from google.genai import types
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+
+from answer_cache import CacheSemantico
+from micro_batching import AgrupadorConsultas, ResultadoConsulta
+from flat_index import FLAT_INDEX_DIR, ONNX_FILE, CodificadorONNX, CodificadorST, Fragmento, IndicePlano
+from context_builder import armar_contexto
+from bm25_index import BM25_FILE, IndiceBM25, fusion_rrf
+from gemini_client import ClienteGeminiConPlazo, PlazoAgotado
+from telemetry import Trazador, memoria_worker, perfilar
+from shared_serving import (CARPETA_COMPARTIDA, CARPETA_COMPARTIDA_DISCO, candado, compartir_pesos, ejecutar_una_vez,
+                            hilos_por_worker, sin_espacio)
+from full_context import CORPUS_FILE, ContextoCompleto, cargar_corpus
+from artifact_fetch import descargar_artefacto
 
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY') 
@@ -26,91 +33,647 @@ DB_ZIP_KEY = os.environ.get('DB_ZIP_KEY')
 
 # MODELO CORREGIDO 
 MODEL_NAME = 'gemini-2.5-flash' 
-EXTRACT_PATH = '/tmp/chroma_db'
+
+# Multi-worker: con varios workers, el artefacto y los pesos de embeddings se preparan una
+# sola vez en memoria compartida y cada worker los mapea en solo lectura (ver shared_serving)
+WORKERS = int(os.environ.get('SAGEMAKER_MODEL_SERVER_WORKERS', '1'))
+MULTI_WORKER = WORKERS > 1
+EXTRACT_PATH = os.path.join(CARPETA_COMPARTIDA, 'chroma_db') if MULTI_WORKER else '/tmp/chroma_db'
+# Artefacto ya extraído junto al código (p. ej. el paquete de la Lambda en modo directo): sin S3
+ARTEFACTO_LOCAL = os.environ.get('ARTEFACTO_LOCAL')
+if ARTEFACTO_LOCAL:
+    EXTRACT_PATH = ARTEFACTO_LOCAL
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Carpeta dentro de model_dir con el modelo de embeddings empaquetado por deploy_full_stack
+EMBEDDING_MODEL_DIR = 'embedding_model'
+WARMUP_PREGUNTA = os.environ.get('WARMUP_PREGUNTA', '¿Cuáles son los requisitos de admisión?')
+
+# Motor de búsqueda: 'chroma' (DB completa) o 'plano' (índice mmap exportado en el mismo ZIP)
+MOTOR_BUSQUEDA = os.environ.get('MOTOR_BUSQUEDA', 'chroma')
+# Índice plano cuantizado (float16/int8): candidatos que se reordenan con los vectores float32
+# del artefacto (0 = solo la puntuación cuantizada)
+REESCORE_CANDIDATOS = int(os.environ.get('REESCORE_CANDIDATOS', '0'))
+
+# Cache semántico de respuestas (los aciertos omiten la búsqueda y la llamada a Gemini)
+CACHE_HABILITADO = os.environ.get('CACHE_HABILITADO', '1') == '1'
+CACHE_SIMILITUD_MIN = float(os.environ.get('CACHE_SIMILITUD_MIN', '0.95'))
+CACHE_TTL_SEGUNDOS = float(os.environ.get('CACHE_TTL_SEGUNDOS', '3600'))
+CACHE_MAX_ENTRADAS = int(os.environ.get('CACHE_MAX_ENTRADAS', '1024'))
+CACHE_MAX_MB = float(os.environ.get('CACHE_MAX_MB', '16'))
+
+# Streaming: '1' entrega las líneas JSON al servidor conforme llegan (solo servidores que aceptan
+# un generador como respuesta); '0' (por defecto) las concatena en una sola respuesta, como
+# necesita el contenedor HF de SageMaker (MMS). El modo directo de la Lambda no pasa por output_fn.
+STREAM_NATIVO = os.environ.get('STREAM_NATIVO', '0') == '1'
+
+# Micro-lotes: preguntas concurrentes se embeben y buscan juntas (BATCH_MAX_TAMANO=1 lo desactiva).
+# Solo se espera la ventana si hay otras solicitudes en curso en el proceso; bajo MMS (una
+# solicitud a la vez por worker) el lote real es el payload por lotes de _responder_lote.
+TOP_K = int(os.environ.get('TOP_K', '7'))
+BATCH_MAX_TAMANO = int(os.environ.get('BATCH_MAX_TAMANO', '16'))
+BATCH_MAX_ESPERA_MS = float(os.environ.get('BATCH_MAX_ESPERA_MS', '10'))
+
+# Armado de contexto: se recuperan K_CANDIDATOS, se eligen TOP_K con MMR y se empaquetan
+# sin solapamientos dentro de CONTEXTO_MAX_TOKENS
+K_CANDIDATOS = int(os.environ.get('K_CANDIDATOS', str(TOP_K * 2)))
+CONTEXTO_MAX_TOKENS = int(os.environ.get('CONTEXTO_MAX_TOKENS', '2000'))
+MMR_LAMBDA = float(os.environ.get('MMR_LAMBDA', '0.7'))
+
+# Búsqueda híbrida BM25 + vectorial (RRF) y atajo solo-léxico cuando BM25 es confiable
+BUSQUEDA_HIBRIDA = os.environ.get('BUSQUEDA_HIBRIDA', '1') == '1'
+BM25_ATAJO = os.environ.get('BM25_ATAJO', '1') == '1'
+
+# Plazo por solicitud (la Lambda envía deadline_ms), reintentos y hedging de Gemini
+PLAZO_DEFECTO_MS = int(os.environ.get('PLAZO_DEFECTO_MS', '25000'))
+GEMINI_MAX_REINTENTOS = int(os.environ.get('GEMINI_MAX_REINTENTOS', '2'))
+GEMINI_HEDGE = os.environ.get('GEMINI_HEDGE', '0') == '1'
+GEMINI_HEDGE_PERCENTIL = float(os.environ.get('GEMINI_HEDGE_PERCENTIL', '0.95'))
+
+# Instrumentación: fracción de solicitudes perfiladas con cProfile (0 = desactivado)
+PERFIL_FRACCION = float(os.environ.get('PERFIL_FRACCION', '0'))
+
+# Lotes de preguntas: llamadas concurrentes a Gemini por lote
+LOTE_MAX_CONCURRENCIA = int(os.environ.get('LOTE_MAX_CONCURRENCIA', '8'))
+
+# Modo de respuesta: 'rag' (fragmentos recuperados en cada prompt) o 'completo' (corpus entero
+# en un contexto en cache de Gemini; cada solicitud envía solo la pregunta). En modo completo,
+# CITAR_FUENTES='1' mantiene la búsqueda solo para devolver los documentos fuente.
+MODO_RESPUESTA = os.environ.get('MODO_RESPUESTA', 'rag')
+MODO_COMPLETO = MODO_RESPUESTA == 'completo'
+CITAR_FUENTES = os.environ.get('CITAR_FUENTES', '0') == '1'
+CONTEXTO_CACHE_TTL_SEGUNDOS = float(os.environ.get('CONTEXTO_CACHE_TTL_SEGUNDOS', '3600'))
 
 db_client = None 
 gemini_client = None
+cache_respuestas = CacheSemantico(
+    similitud_min=CACHE_SIMILITUD_MIN,
+    ttl_segundos=CACHE_TTL_SEGUNDOS,
+    max_entradas=CACHE_MAX_ENTRADAS,
+    max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+)
 
 def model_fn(model_dir):
     """
-    Inicializa el sistema RAG (ChromaDB y Cliente Gemini).
+    Inicializa el sistema RAG (motor de búsqueda y Cliente Gemini).
     Esta función se ejecuta solo UNA VEZ al iniciar el Endpoint.
+    La descarga del artefacto se solapa con la carga del modelo de embeddings, y una
+    consulta de calentamiento se ejecuta antes de reportar el contenedor como listo.
     """
-    global db_client, gemini_client
+    global gemini_client
     print("Iniciando Proxy Gemini en SageMaker...")
+    tiempos = {}
+    inicio_total = time.perf_counter()
     
     if not GEMINI_API_KEY:
         raise EnvironmentError("ERROR: GEMINI_API_KEY no configurada. Verifique las variables de entorno.")
 
-    # 1. Descargar y Cargar DB Chroma
-    s3_client = boto3.client('s3')
-    local_zip_path = '/tmp/chroma_db.zip'
+    # 1. En paralelo: artefacto RAG (S3), modelo de embeddings (empaquetado) y cliente Gemini
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futuro_artefacto = pool.submit(_medido, "artefacto", tiempos, _preparar_artefacto)
+        futuro_embeddings = pool.submit(_medido, "embeddings", tiempos, _cargar_embeddings, model_dir)
+        futuro_gemini = pool.submit(_medido, "gemini", tiempos, genai.Client, api_key=GEMINI_API_KEY)
 
-    if os.path.exists(EXTRACT_PATH):
-        shutil.rmtree(EXTRACT_PATH)
-    os.makedirs(EXTRACT_PATH, exist_ok=True)
-    
-    s3_client.download_file(BUCKET_NAME, DB_ZIP_KEY, local_zip_path)
-    
-    # Descomprimir la DB
-    with zipfile.ZipFile(local_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(EXTRACT_PATH)
-    
-    # Cargar Embeddings (el modelo HuggingFace corre localmente)
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-    db_client = Chroma(persist_directory=EXTRACT_PATH, embedding_function=embeddings)
-    
-    # 2. Inicializar Cliente Gemini
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+        version_artefacto = futuro_artefacto.result()
+        embeddings = futuro_embeddings.result()
+        gemini_client = futuro_gemini.result()
+
+    # La versión del artefacto invalida el cache si la DB cargada cambió
+    cache_respuestas.asignar_version(version_artefacto)
+
+    # Multi-worker: pesos del modelo en memoria compartida y hilos de torch repartidos
+    if MULTI_WORKER:
+        import torch
+        torch.set_num_threads(hilos_por_worker(WORKERS))
+        _medido("pesos_compartidos", tiempos, compartir_pesos, _modulo_embeddings(embeddings))
+
+    # 2. Abrir el motor de búsqueda (el modo completo sin citas no busca)
+    if MODO_COMPLETO and not CITAR_FUENTES:
+        motor = None
+        buscar = lambda preguntas, vectores, k: [[] for _ in preguntas]
+    else:
+        motor, buscar = _abrir_motor(embeddings, tiempos)
+
+    # 3. Calentamiento: primera inferencia del modelo y primera búsqueda fuera del camino del usuario
+    _medido("calentamiento", tiempos, lambda: buscar([WARMUP_PREGUNTA], [embeddings.embed_query(WARMUP_PREGUNTA)], TOP_K))
+
+    # 4. Modo completo: corpus en un contexto en cache de Gemini (uno por versión del corpus;
+    #    con varios workers, el primero lo crea y los demás lo reutilizan)
+    completo = None
+    if MODO_COMPLETO:
+        corpus = cargar_corpus(os.path.join(EXTRACT_PATH, CORPUS_FILE))
+        completo = ContextoCompleto(gemini_client, MODEL_NAME, corpus,
+                                    ttl_segundos=CONTEXTO_CACHE_TTL_SEGUNDOS, usar_cache=False)
+        if MULTI_WORKER:
+            with candado(os.path.join(CARPETA_COMPARTIDA, 'contexto_completo.lock')):
+                _medido("contexto_completo", tiempos, completo.preparar)
+        else:
+            _medido("contexto_completo", tiempos, completo.preparar)
+
+    # 5. Cliente con plazo, reintentos y hedging sobre generate_content (y plazo y reintentos
+    #    sobre generate_content_stream)
+    generar = completo.generar if completo else lambda prompt, timeout_s: _llamar_gemini(gemini_client, prompt, timeout_s)
+    generar_stream = completo.generar_stream if completo else (
+        lambda prompt, timeout_s: _llamar_gemini_stream(gemini_client, prompt, timeout_s))
+    cliente_llm = ClienteGeminiConPlazo(
+        generar,
+        generar_stream=generar_stream,
+        max_reintentos=GEMINI_MAX_REINTENTOS,
+        hedge_habilitado=GEMINI_HEDGE,
+        hedge_percentil=GEMINI_HEDGE_PERCENTIL,
+        # Principal y hedge por cada pregunta de un lote
+        max_hilos=2 * LOTE_MAX_CONCURRENCIA,
+    )
+
+    # 6. Agrupador de consultas concurrentes (embedding + búsqueda por lotes)
+    agrupador = None
+    if BATCH_MAX_TAMANO > 1:
+        agrupador = AgrupadorConsultas(
+            embeddings,
+            buscar,
+            k=K_CANDIDATOS,
+            max_lote=BATCH_MAX_TAMANO,
+            max_espera_ms=BATCH_MAX_ESPERA_MS,
+            resolver_previo=cache_respuestas.buscar if CACHE_HABILITADO else None,
+        )
     
-    print("Sistema RAG con Proxy Gemini listo.")
-    return {"db": db_client, "gemini_client": gemini_client}
+    tiempos["total"] = time.perf_counter() - inicio_total
+    print(f"Modo de respuesta: {MODO_RESPUESTA}")
+    print(f"Sistema RAG con Proxy Gemini listo en {tiempos['total']:.2f}s. Fases: {json.dumps(tiempos)}")
+    print(json.dumps({"evento": "memoria_worker", "workers": WORKERS, **memoria_worker()}))
+    return {"db": db_client, "motor": motor, "buscar": buscar, "gemini_client": gemini_client,
+            "llm": cliente_llm, "embeddings": embeddings, "completo": completo,
+            "cache": cache_respuestas, "agrupador": agrupador, "tiempos_inicio": tiempos}
+
+
+def _abrir_motor(embeddings, tiempos: dict):
+    """Abre el motor configurado (y BM25 si aplica). Devuelve (motor, buscar)."""
+    global db_client
+    if MOTOR_BUSQUEDA == 'plano':
+        db_client = _medido("motor", tiempos, IndicePlano, os.path.join(EXTRACT_PATH, FLAT_INDEX_DIR),
+                            reescore=REESCORE_CANDIDATOS)
+        motor = db_client
+    else:
+        db_client = _medido("motor", tiempos, _cargar_chroma, EXTRACT_PATH, embeddings)
+        motor = MotorChroma(db_client)
+
+    ruta_bm25 = os.path.join(EXTRACT_PATH, BM25_FILE)
+    if BUSQUEDA_HIBRIDA and os.path.exists(ruta_bm25):
+        tabla = motor if isinstance(motor, IndicePlano) else IndicePlano(os.path.join(EXTRACT_PATH, FLAT_INDEX_DIR),
+                                                                         reescore=REESCORE_CANDIDATOS)
+        motor = MotorHibrido(motor, _medido("bm25", tiempos, IndiceBM25.cargar, ruta_bm25), tabla)
+        buscar = motor.buscar
+    else:
+        buscar = lambda preguntas, vectores, k: motor.buscar_por_vectores(vectores, k)
+    print(f"Motor de búsqueda: {MOTOR_BUSQUEDA} (híbrido BM25: {isinstance(motor, MotorHibrido)})")
+    return motor, buscar
+
+
+def _medido(fase: str, tiempos: dict, funcion, *args, **kwargs):
+    """Ejecuta una fase de inicialización y registra su duración."""
+    inicio = time.perf_counter()
+    resultado = funcion(*args, **kwargs)
+    tiempos[fase] = round(time.perf_counter() - inicio, 3)
+    print(f"[init] {fase}: {tiempos[fase]:.2f}s")
+    return resultado
+
+
+def _preparar_artefacto() -> str | None:
+    """
+    En modo multi-worker solo el primer worker descarga; los demás reutilizan la extracción
+    (en memoria compartida o, si no cupo, en disco: EXTRACT_PATH es la que eligió el primero).
+    """
+    global EXTRACT_PATH
+    if ARTEFACTO_LOCAL:
+        return f"local:{os.path.getmtime(os.path.join(ARTEFACTO_LOCAL, FLAT_INDEX_DIR))}"
+    if MULTI_WORKER:
+        version, EXTRACT_PATH = ejecutar_una_vez('artefacto', _descargar_artefacto_compartido)
+        return version
+    return _descargar_artefacto(EXTRACT_PATH)
+
+
+def _descargar_artefacto_compartido() -> list:
+    """[versión, carpeta]: extrae en memoria compartida y, si se llena, en la carpeta en disco."""
+    try:
+        return [_descargar_artefacto(EXTRACT_PATH), EXTRACT_PATH]
+    except OSError as e:
+        if not sin_espacio(e):
+            raise
+        destino = os.path.join(CARPETA_COMPARTIDA_DISCO, 'chroma_db')
+        print(f"Memoria compartida llena al extraer el artefacto ({e}): se extrae en {destino}")
+        return [_descargar_artefacto(destino), destino]
+
+
+def _modulo_embeddings(embeddings):
+    """SentenceTransformer subyacente (CodificadorST.modelo o HuggingFaceEmbeddings.client)."""
+    return getattr(embeddings, 'modelo', None) or embeddings.client
+
+
+def _descargar_artefacto(destino: str) -> str | None:
+    """
+    Descarga el ZIP del artefacto RAG con GETs por rangos en paralelo y lo descomprime al vuelo;
+    si `destino` ya tiene la misma versión de S3, no descarga nada. Devuelve su ETag en S3.
+    """
+    return descargar_artefacto(boto3.client('s3'), BUCKET_NAME, DB_ZIP_KEY, destino)
+
+
+def _cargar_embeddings(model_dir: str | None):
+    """
+    Carga el modelo de embeddings (corre localmente). Usa la copia empaquetada en el
+    model.tar.gz si existe, para no descargar nada del Hub al arrancar. Si la copia es el
+    codificador ONNX cuantizado (paquete de la Lambda en modo directo), no se importa torch.
+    """
+    ruta_local = os.path.join(model_dir, EMBEDDING_MODEL_DIR) if model_dir else None
+    origen = ruta_local if ruta_local and os.path.isdir(ruta_local) else EMBEDDING_MODEL
+    print(f"Modelo de embeddings: {origen}")
+
+    if MOTOR_BUSQUEDA == 'plano' and os.path.exists(os.path.join(origen, ONNX_FILE)):
+        return CodificadorONNX(origen)
+    if MOTOR_BUSQUEDA == 'plano':
+        return CodificadorST(origen)
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=origen)
+
+
+def _cargar_chroma(persist_directory: str, embeddings):
+    """Importa Chroma bajo demanda y abre la DB persistida."""
+    # Necesario para que ChromaDB funcione en el entorno de Linux de SageMaker.
+    __import__('pysqlite3')
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+
+class MotorChroma:
+    """Adaptador de la DB Chroma a la interfaz buscar_por_vectores de los motores."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def buscar_por_vectores(self, vectores: list, k: int) -> list[list[Fragmento]]:
+        """Ejecuta varias búsquedas de similitud en una sola consulta a la colección Chroma."""
+        resultado = self.db._collection.query(query_embeddings=vectores, n_results=k,
+                                              include=["documents", "metadatas", "embeddings"])
+        return [
+            [Fragmento(texto, meta or {}, vector) for texto, meta, vector in zip(textos, metas, vecs)]
+            for textos, metas, vecs in zip(resultado["documents"], resultado["metadatas"], resultado["embeddings"])
+        ]
+
+
+class MotorHibrido:
+    """
+    Fusiona el ranking vectorial del motor base con el ranking BM25 mediante Reciprocal Rank
+    Fusion. Si BM25 es confiable para una pregunta, se omite la búsqueda vectorial.
+    La tabla (índice plano) resuelve los ids de BM25 a fragmentos con su vector.
+    """
+
+    def __init__(self, motor, bm25: IndiceBM25, tabla: IndicePlano):
+        self.motor = motor
+        self.bm25 = bm25
+        self.tabla = tabla
+        self.atajos_lexicos = 0
+
+    def _fragmento(self, id_frag: int) -> Fragmento:
+        base = self.tabla.fragmentos[id_frag]
+        return Fragmento(base.page_content, base.metadata, self.tabla.vector(id_frag))
+
+    def buscar_por_vectores(self, vectores: list, k: int) -> list[list[Fragmento]]:
+        return self.motor.buscar_por_vectores(vectores, k)
+
+    def buscar(self, preguntas: list[str], vectores: list, k: int) -> list[list[Fragmento]]:
+        lexicos = [self.bm25.buscar(p, k) for p in preguntas]
+        resultados = [None] * len(preguntas)
+
+        pendientes = []
+        for i, (pregunta, lexico) in enumerate(zip(preguntas, lexicos)):
+            if BM25_ATAJO and self.bm25.es_confiable(pregunta, lexico):
+                resultados[i] = [self._fragmento(id_frag) for id_frag, _ in lexico]
+                self.atajos_lexicos += 1
+            else:
+                pendientes.append(i)
+
+        if pendientes:
+            vectoriales = self.motor.buscar_por_vectores([vectores[i] for i in pendientes], k)
+            for i, docs in zip(pendientes, vectoriales):
+                por_texto = {d.page_content: d for d in docs}
+                ranking_lexico = []
+                for id_frag, _ in lexicos[i]:
+                    frag = self._fragmento(id_frag)
+                    por_texto.setdefault(frag.page_content, frag)
+                    ranking_lexico.append(frag.page_content)
+                claves = fusion_rrf([[d.page_content for d in docs], ranking_lexico], k)
+                resultados[i] = [por_texto[c] for c in claves]
+
+        return resultados
+
+
+def recuperar(context, pregunta: str) -> ResultadoConsulta:
+    """
+    Embebe la pregunta, consulta el cache semántico y, si no hay acierto, busca el contexto.
+    Con agrupador activo, estos pasos se hacen por lotes junto con otras solicitudes.
+    """
+    if context.get("agrupador") is not None:
+        return context["agrupador"].consultar(pregunta)
+    return recuperar_lote(context, [pregunta])[0]
+
+
+def recuperar_lote(context, preguntas: list[str]) -> list[ResultadoConsulta]:
+    """Versión por lotes de recuperar: un solo embedding y una sola búsqueda para todas."""
+    cache = context.get("cache") if CACHE_HABILITADO else None
+    inicio = time.perf_counter()
+    resultados = [ResultadoConsulta(vector=v) for v in context["embeddings"].embed_documents(preguntas)]
+    ms_embedding = (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    if cache is not None:
+        for r in resultados:
+            r.previo = cache.buscar(r.vector)
+    pendientes = [i for i, r in enumerate(resultados) if r.previo is None]
+    if pendientes:
+        docs_por_pregunta = context["buscar"]([preguntas[i] for i in pendientes],
+                                              [resultados[i].vector for i in pendientes], K_CANDIDATOS)
+        for i, docs in zip(pendientes, docs_por_pregunta):
+            resultados[i].docs = docs
+    ms_busqueda = (time.perf_counter() - inicio) * 1000
+
+    for r in resultados:
+        r.tiempos = {"embedding": ms_embedding, "busqueda": ms_busqueda, "lote": len(preguntas)}
+    return resultados
+
+
+def _opciones_http(timeout_s: float | None):
+    """Timeout HTTP de un intento (el SDK lo recibe en milisegundos)."""
+    return types.HttpOptions(timeout=max(1, int(timeout_s * 1000))) if timeout_s is not None else None
+
+
+def _llamar_gemini(gemini, prompt_final: str, timeout_s: float | None = None):
+    return gemini.models.generate_content(
+        model=MODEL_NAME,
+        contents=[prompt_final],
+        config=types.GenerateContentConfig(temperature=0.01, http_options=_opciones_http(timeout_s))
+    )
+
+
+def _llamar_gemini_stream(gemini, prompt_final: str, timeout_s: float | None = None):
+    return gemini.models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=[prompt_final],
+        config=types.GenerateContentConfig(temperature=0.01, http_options=_opciones_http(timeout_s))
+    )
+
+
+def _tokens_de_uso(response) -> dict:
+    """Conteo de tokens de prompt y respuesta reportado por Gemini (usage_metadata)."""
+    uso = getattr(response, 'usage_metadata', None)
+    if uso is None:
+        return {}
+    return {"tokens_prompt": getattr(uso, 'prompt_token_count', None),
+            "tokens_respuesta": getattr(uso, 'candidates_token_count', None),
+            "tokens_cacheados": getattr(uso, 'cached_content_token_count', None)}
+
+
+def construir_prompt(contexto_acumulado: str, pregunta: str) -> str:
+    """Arma el prompt en formato chat con el contexto recuperado."""
+    return f"""<|im_start|>system
+Eres un asistente administrativo útil. Responde de forma muy concisa usando SOLO el siguiente contexto.
+Reglas:
+1. Responde usando SOLO el contexto.
+2. Si la respuesta no está, di "No tengo información."
+<|im_end|>
+<|im_start|>user
+Contexto:\n{contexto_acumulado}\n\nPregunta: {pregunta}
+<|im_end|>
+"""
 
 
 def predict_fn(data, context):
     """
     Ejecuta el ciclo RAG: Búsqueda de Contexto y Llamada al LLM.
     Esta función se ejecuta en CADA solicitud de la Lambda.
+    Cada solicitud deja una línea de log con sus tramos de tiempo; si el payload trae
+    "timings": true, el resumen también se devuelve en la respuesta.
+    Un lote de preguntas (lista de payloads o "inputs" como lista) devuelve una lista alineada.
     """
-    # 1. Recuperar artefactos inicializados
-    db = context["db"]
-    gemini = context["gemini_client"]
+    # 1. Leer la(s) pregunta(s) del payload 
+    lote = _extraer_lote(data)
+    if lote is not None:
+        return _responder_lote(*lote, context)
 
-    # 2. Leer la pregunta del payload 
     if isinstance(data, list):
         input_data = data[0]
     else:
         input_data = data
-        
+
+    traza = Trazador(input_data.get('correlation_id'))
+    agrupador = context.get("agrupador")
+    with perfilar(traza, PERFIL_FRACCION), (agrupador.solicitud() if agrupador else nullcontext()):
+        resultado = _responder(input_data, context, traza)
+
+    # Las respuestas en streaming emiten su traza al terminar el generador
+    if isinstance(resultado, list):
+        resumen = traza.emitir("proxy")
+        if input_data.get('timings'):
+            resultado[0]["timings"] = resumen
+    return resultado
+
+
+def _responder(input_data: dict, context, traza: Trazador):
+    # 2. Leer la pregunta y el plazo (Gemini se llama a través de context["llm"])
     pregunta = input_data.get('inputs', input_data.get('question', '')) 
+    stream = bool(input_data.get('stream', False))
+    plazo_ms = input_data.get('deadline_ms')
+    plazo = time.monotonic() + float(PLAZO_DEFECTO_MS if plazo_ms is None else plazo_ms) / 1000
     
     if not pregunta:
         raise ValueError("Pregunta vacía recibida.")
         
-    # 3. RAG: Búsqueda de contexto
-    docs_encontrados = db.similarity_search(pregunta, k=7)
-    contexto_acumulado = "\n".join([doc.page_content.replace('\n', ' ').strip() for doc in docs_encontrados])
-    
-    # 4. Prompt para Gemini (Formato Chat)
-    prompt_final = f"""<|im_start|>system
-Eres un asistente administrativo útil. Responde de forma muy concisa usando SOLO el siguiente contexto.
-Reglas:
-1. Responde usando SOLO el contexto.
-2. Si la respuesta no está, di "No tengo información."
-<|im_end|>
-<|im_start|>user
-Contexto:\n{contexto_acumulado}\n\nPregunta: {pregunta}
-<|im_end|>
-"""
-    
-    # 5. Llamar a la API de Gemini
-    response = gemini.models.generate_content(
-        model=MODEL_NAME,
-        contents=[prompt_final],
-        config=types.GenerateContentConfig(temperature=0.01)
-    )
+    # 3. Embedding, cache semántico y búsqueda de contexto (una pregunta equivalente
+    #    ya respondida omite RAG y LLM)
+    cache = context.get("cache") if CACHE_HABILITADO else None
+    recuperado = recuperar(context, pregunta)
+    vector_pregunta = recuperado.vector
+    for nombre in ("embedding", "busqueda"):
+        traza.agregar_tramo(nombre, recuperado.tiempos.get(nombre, 0.0))
+    if "lote" in recuperado.tiempos:
+        traza.registrar(tamano_lote=recuperado.tiempos["lote"])
+
+    if recuperado.previo is not None:
+        respuesta_cache = recuperado.previo
+        traza.registrar(cache="acierto")
+        if stream:
+            return _con_traza(iter([{"token": respuesta_cache}, {"generated_text": respuesta_cache, "done": True}]), traza)
+        return [{"generated_text": respuesta_cache}]
+
+    # 4. RAG: Contexto sin solapamientos, diversificado (MMR) y dentro del presupuesto de tokens
+    # 5. Prompt para Gemini (Formato Chat)
+    prompt_final = _preparar_prompt(recuperado, pregunta, traza)
     
-    texto_respuesta = response.text.strip()
+    # 6. Llamar a la API de Gemini dentro del plazo de la solicitud
+    if stream:
+        if time.monotonic() >= plazo:
+            error = _error_plazo(context, PlazoAgotado("Plazo agotado antes de llamar a Gemini."))
+            return _con_traza(iter([{**error, "done": True}]), traza)
+        fragmentos = _generar_en_stream(context, prompt_final, plazo, cache, vector_pregunta, traza)
+        return _con_traza((_agregar_fuentes(f, recuperado) for f in fragmentos), traza)
+
+    # 7. Devolver en el formato esperado por SageMaker/Lambda
+    resultado = _completar(context, prompt_final, plazo, vector_pregunta, traza)
+    return [_agregar_fuentes(resultado, recuperado)]
+
+
+def _preparar_prompt(recuperado: ResultadoConsulta, pregunta: str, traza: Trazador) -> str:
+    """Prompt con el contexto armado; en modo completo el contexto ya está en cache y basta la pregunta."""
+    if MODO_COMPLETO:
+        return pregunta
+    with traza.tramo("prompt"):
+        contexto = armar_contexto(recuperado.docs, recuperado.vector, k=TOP_K,
+                                  max_tokens=CONTEXTO_MAX_TOKENS, lambda_mult=MMR_LAMBDA)
+        prompt_final = construir_prompt(contexto.texto, pregunta)
+    traza.registrar(contexto=contexto.resumen())
+    return prompt_final
+
+
+def _completar(context, prompt_final: str, plazo: float, vector_pregunta, traza: Trazador) -> dict:
+    """Llama a Gemini dentro del plazo, guarda la respuesta en el cache y arma el resultado."""
+    if time.monotonic() >= plazo:
+        return _error_plazo(context, PlazoAgotado("Plazo agotado antes de llamar a Gemini."))
+    try:
+        with traza.tramo("gemini"):
+            response, detalle = context["llm"].generar(prompt_final, plazo)
+    except PlazoAgotado as e:
+        return _error_plazo(context, e)
+    traza.registrar(gemini=detalle, **_tokens_de_uso(response))
     
-    # 6. Devolver en el formato esperado por SageMaker/Lambda
-    return [{"generated_text": texto_respuesta}]
\ No newline at end of file
+    # Sin texto (bloqueo de seguridad o respuesta vacía) response.text es None
+    texto_respuesta = (response.text or "").strip()
+
+    cache = context.get("cache") if CACHE_HABILITADO else None
+    if cache is not None and texto_respuesta:
+        cache.guardar(vector_pregunta, texto_respuesta)
+    return {"generated_text": texto_respuesta}
+
+
+# --- LOTES DE PREGUNTAS ---
+
+def _extraer_lote(data) -> tuple[list[dict], dict] | None:
+    """
+    Detecta un payload por lotes y devuelve (items, opciones comunes), o None si es una sola
+    pregunta. Acepta una lista de payloads o {"inputs": [...]} / {"questions": [...]}.
+    """
+    if isinstance(data, list) and len(data) > 1:
+        items = [d if isinstance(d, dict) else {"inputs": d} for d in data]
+        return items, {}
+    if isinstance(data, dict):
+        preguntas = data.get('inputs', data.get('questions'))
+        if isinstance(preguntas, list):
+            opciones = {k: v for k, v in data.items() if k not in ('inputs', 'questions')}
+            return [{"inputs": p} for p in preguntas], opciones
+    return None
+
+
+def _responder_lote(items: list[dict], opciones: dict, context) -> list[dict]:
+    """
+    Responde un lote: embedding y búsqueda en una sola pasada, y llamadas a Gemini en
+    paralelo con un pool acotado. Un error en una pregunta no invalida las demás.
+    """
+    traza = Trazador(opciones.get('correlation_id'))
+    preguntas = [str(it.get('inputs', it.get('question', '')) or '') for it in items]
+    resultados = [{"error": "EMPTY_QUESTION", "message": "Pregunta vacía recibida."} for _ in items]
+    validas = [i for i, p in enumerate(preguntas) if p.strip()]
+    # deadline_ms=0 (presupuesto de la Lambda agotado) falla rápido, no usa el plazo por defecto
+    plazo_ms = opciones.get('deadline_ms')
+    plazo_lote = time.monotonic() + float(PLAZO_DEFECTO_MS if plazo_ms is None else plazo_ms) / 1000
+
+    recuperados = recuperar_lote(context, [preguntas[i] for i in validas]) if validas else []
+    if recuperados:
+        traza.agregar_tramo("embedding", recuperados[0].tiempos["embedding"])
+        traza.agregar_tramo("busqueda", recuperados[0].tiempos["busqueda"])
+
+    def responder_item(i: int, recuperado: ResultadoConsulta) -> dict:
+        try:
+            if recuperado.previo is not None:
+                return {"generated_text": recuperado.previo}
+            traza_item = Trazador(traza.id_correlacion)
+            prompt_final = _preparar_prompt(recuperado, preguntas[i], traza_item)
+            resultado = _completar(context, prompt_final, plazo_lote, recuperado.vector, traza_item)
+            return _agregar_fuentes(resultado, recuperado)
+        except Exception as e:
+            return {"error": type(e).__name__, "message": str(e)}
+
+    with traza.tramo("generacion"):
+        with ThreadPoolExecutor(max_workers=LOTE_MAX_CONCURRENCIA) as pool:
+            for i, resultado in zip(validas, pool.map(responder_item, validas, recuperados)):
+                resultados[i] = resultado
+
+    traza.registrar(tamano_lote=len(items), errores=sum(1 for r in resultados if "error" in r))
+    traza.emitir("proxy")
+    return resultados
+
+
+def _con_traza(fragmentos, traza: Trazador):
+    """Reemite los fragmentos de streaming y registra la traza cuando terminan."""
+    yield from fragmentos
+    traza.emitir("proxy")
+
+
+def _error_plazo(context, error: PlazoAgotado) -> dict:
+    """Respuesta de error explícita para que la Lambda devuelva 504 en lugar de un 500 genérico."""
+    print(json.dumps({"evento": "gemini", "error": error.codigo, **context["llm"].metricas()}))
+    return {"error": error.codigo, "message": str(error)}
+
+
+def _agregar_fuentes(resultado: dict, recuperado: ResultadoConsulta) -> dict:
+    """En modo completo con CITAR_FUENTES, agrega los documentos fuente recuperados a la respuesta final."""
+    if MODO_COMPLETO and CITAR_FUENTES and "generated_text" in resultado:
+        fuentes = [os.path.basename(d.metadata.get('source', '')) for d in (recuperado.docs or [])[:TOP_K]]
+        resultado["sources"] = list(dict.fromkeys(f for f in fuentes if f))
+    return resultado
+
+
+def _generar_en_stream(context, prompt_final: str, plazo: float, cache, vector_pregunta, traza: Trazador):
+    """
+    Emite los fragmentos de Gemini conforme llegan; el último incluye el texto completo. El
+    stream corre dentro del plazo de la solicitud (ClienteGeminiConPlazo.generar_en_stream):
+    si se agota, la última línea es el error DEADLINE_EXCEEDED en lugar del texto.
+    """
+    partes = []
+    inicio = time.perf_counter()
+    try:
+        for chunk in context["llm"].generar_en_stream(prompt_final, plazo):
+            if chunk.text:
+                if not partes:
+                    traza.agregar_tramo("primer_token", (time.perf_counter() - inicio) * 1000)
+                partes.append(chunk.text)
+                yield {"token": chunk.text}
+            traza.registrar(**_tokens_de_uso(chunk))
+    except PlazoAgotado as e:
+        traza.agregar_tramo("gemini", (time.perf_counter() - inicio) * 1000)
+        yield {**_error_plazo(context, e), "done": True}
+        return
+    traza.agregar_tramo("gemini", (time.perf_counter() - inicio) * 1000)
+
+    texto_respuesta = "".join(partes).strip()
+    # Un stream vacío no se cachea: las preguntas similares recibirían la respuesta vacía
+    if cache is not None and texto_respuesta:
+        cache.guardar(vector_pregunta, texto_respuesta)
+
+    yield {"generated_text": texto_respuesta, "done": True}
+
+
+def output_fn(prediction, accept):
+    """
+    Serializa la predicción. Las respuestas normales siguen siendo JSON; las de
+    streaming se emiten como JSON Lines (un fragmento por línea).
+    """
+    if isinstance(prediction, (list, dict)):
+        inicio = time.perf_counter()
+        cuerpo = json.dumps(prediction)
+        print(json.dumps({"evento": "serializacion", "ms": round((time.perf_counter() - inicio) * 1000, 3)}))
+        return cuerpo
+
+    lineas = (json.dumps(fragmento, ensure_ascii=False) + "\n" for fragmento in prediction)
+    if STREAM_NATIVO:
+        return (linea.encode('utf-8') for linea in lineas)
+    return "".join(lineas)
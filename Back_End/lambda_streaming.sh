@@ -0,0 +1,5 @@
+#!/bin/sh
+# Back_End/lambda_streaming.sh
+# Exec wrapper (AWS_LAMBDA_EXEC_WRAPPER) para servir la Lambda con response streaming: en lugar
+# del runtime administrado de Python, que no lo admite, arranca el bucle de Lambda_Handler.py.
+exec /var/lang/bin/python3 "${LAMBDA_TASK_ROOT:-/var/task}/Lambda_Handler.py"
@@ -0,0 +1,127 @@
+# Back_End/micro_batching.py
+# Agrupa las preguntas concurrentes del Proxy en micro-lotes para embeberlas y buscarlas juntas.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+@dataclass
+class ResultadoConsulta:
+    """Resultado de recuperación para una pregunta del lote."""
+    vector: list[float]
+    docs: list | None = None
+    previo: Any = None  # p. ej. respuesta del cache semántico; si existe, no se buscó
+    tiempos: dict = field(default_factory=dict)  # ms de embedding/búsqueda y tamaño del lote
+
+
+class AgrupadorConsultas:
+    """
+    Junta las preguntas que llegan dentro de una ventana corta (max_espera_ms) o hasta
+    max_lote, las embebe en una sola pasada del modelo y ejecuta las búsquedas de
+    similitud en una sola consulta. Cada solicitud espera únicamente su propio resultado.
+    La ventana solo se espera si hay otras solicitudes en curso (anunciadas con `solicitud()`)
+    que todavía no encolaron su pregunta: con un servidor que atiende una solicitud a la vez
+    por worker, cada pregunta se procesa sin demora.
+    """
+
+    def __init__(self, embeddings, buscar: Callable, k: int = 7,
+                 max_lote: int = 16, max_espera_ms: float = 10,
+                 resolver_previo: Callable | None = None):
+        self.embeddings = embeddings
+        self.buscar = buscar  # buscar(preguntas, vectores, k) -> docs por pregunta
+        self.k = k
+        self.max_lote = max_lote
+        self.max_espera = max_espera_ms / 1000
+        self.resolver_previo = resolver_previo
+        self.lotes_procesados = 0
+        self.preguntas_procesadas = 0
+        self.lote_maximo = 0
+        self._cola = queue.Queue()
+        # Solicitudes en curso que aún no encolaron su pregunta
+        self._por_llegar = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hilo = threading.Thread(target=self._bucle, name="agrupador-consultas", daemon=True)
+        self._hilo.start()
+
+    @contextmanager
+    def solicitud(self):
+        """Anuncia una solicitud en curso que probablemente consultará: el lote abierto la espera."""
+        with self._lock:
+            self._por_llegar += 1
+        self._local.anunciada = True
+        try:
+            yield
+        finally:
+            self._retirar_anuncio()
+
+    def _retirar_anuncio(self):
+        if getattr(self._local, 'anunciada', False):
+            self._local.anunciada = False
+            with self._lock:
+                self._por_llegar -= 1
+
+    def consultar(self, pregunta: str, timeout: float | None = None) -> ResultadoConsulta:
+        """Encola una pregunta y bloquea hasta que su lote se procese."""
+        futuro = Future()
+        self._cola.put((pregunta, futuro))
+        self._retirar_anuncio()
+        return futuro.result(timeout=timeout)
+
+    def _recolectar_lote(self) -> list:
+        lote = [self._cola.get()]
+        limite = time.monotonic() + self.max_espera
+        while len(lote) < self.max_lote:
+            if self._cola.empty() and self._por_llegar == 0:
+                break
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._recolectar_lote()
+            try:
+                self._procesar(lote)
+            except Exception as e:
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+    def _procesar(self, lote: list):
+        preguntas = [pregunta for pregunta, _ in lote]
+        inicio = time.perf_counter()
+        vectores = self.embeddings.embed_documents(preguntas)
+        ms_embedding = (time.perf_counter() - inicio) * 1000
+        resultados = [ResultadoConsulta(vector=v) for v in vectores]
+
+        if self.resolver_previo is not None:
+            for r in resultados:
+                r.previo = self.resolver_previo(r.vector)
+
+        pendientes = [i for i, r in enumerate(resultados) if r.previo is None]
+        inicio = time.perf_counter()
+        if pendientes:
+            docs_por_pregunta = self.buscar([preguntas[i] for i in pendientes],
+                                            [resultados[i].vector for i in pendientes], self.k)
+            for i, docs in zip(pendientes, docs_por_pregunta):
+                resultados[i].docs = docs
+        ms_busqueda = (time.perf_counter() - inicio) * 1000
+
+        for r in resultados:
+            r.tiempos = {"embedding": ms_embedding, "busqueda": ms_busqueda, "lote": len(lote)}
+        self.lotes_procesados += 1
+        self.preguntas_procesadas += len(lote)
+        self.lote_maximo = max(self.lote_maximo, len(lote))
+        for (_, futuro), r in zip(lote, resultados):
+            futuro.set_result(r)
@@ -2,27 +2,85 @@
 import os
 import sys
 import zipfile
-import shutil
 import glob
+import tempfile
 
 # --- PARCHE CRÍTICO PARA SQLITE ---
 __import__('pysqlite3')
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 # --- IMPORTS DE RAG ---
+import numpy as np
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 
+from flat_index import (FLAT_INDEX_DIR, VECTORES_COMPLETOS_FILE, VECTORES_FILE, IndicePlano, exportar_indice_plano,
+                        paridad_por_consulta, recall_cuantizado)
+from bm25_index import BM25_FILE, IndiceBM25
+from full_context import CORPUS_FILE, exportar_corpus
+from dedup import InformeDedup, deduplicar_documentos, deduplicar_fragmentos
+from chunker import FRAGMENTO_MAX_TOKENS, FragmentadorEstructural, informe_longitudes
+from embedding_cache import (EMBEDDING_HILOS, EMBEDDING_LOTE, CacheEmbeddings, EmbeddingsCacheados,
+                             cambios_indice, id_fragmento)
+
 # --- CONFIGURACIÓN ---
 CLEAN_FOLDER = os.path.join('Back_End', 'Data', 'Clean_Text')
 DB_PERSIST_PATH = 'chroma_db_local'
 ARTIFACT_NAME = 'chroma_db.zip'
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Quitar plantilla del sitio y documentos/fragmentos casi duplicados antes de generar embeddings
+DEDUPLICAR = os.environ.get('DEDUPLICAR', '1') == '1'
+# 'estructural': fragmentos por encabezados/listas/filas medidos en tokens del modelo (ver chunker);
+# 'caracteres': el RecursiveCharacterTextSplitter anterior (3000/300 caracteres)
+FRAGMENTADOR = os.environ.get('FRAGMENTADOR', 'estructural')
+# Máximo de fragmentos por llamada a Chroma (su límite interno de lote ronda los 5000)
+LOTE_CHROMA = 1000
+# Precisión de los vectores del índice plano: 'float32', 'float16' o 'int8' (escala por vector).
+# Con VECTORES_REESCORE=1 el artefacto incluye también la copia float32 para reordenar candidatos.
+PRECISION_VECTORES = os.environ.get('PRECISION_VECTORES', 'float32')
+VECTORES_REESCORE = os.environ.get('VECTORES_REESCORE', '1') == '1'
+# Recall@k del índice cuantizado: consultas de control más una muestra de fragmentos como consultas
+K_RECALL = 7
+MUESTRA_RECALL = 200
+
+# Consultas de control para verificar que el índice plano devuelve lo mismo que Chroma. Se compara
+# el top-7 como conjunto (HNSW puede intercambiar casi-empates) y la construcción falla solo si la
+# coincidencia promedio queda por debajo de PARIDAD_MINIMA
+PARIDAD_MINIMA = float(os.environ.get('PARIDAD_MINIMA', '0.9'))
+CONSULTAS_PARIDAD = [
+    "¿Cuáles son los requisitos de admisión?",
+    "¿Cómo me titulo?",
+    "¿Cuántas horas de servicio social debo cumplir?",
+    "¿Qué nivel de inglés se requiere?",
+    "¿Qué materias tiene el plan de estudios?",
+    "¿Quiénes son los docentes del programa?",
+    "¿Cuál es la misión de la licenciatura?",
+    "¿Cómo funcionan las tutorías?",
+]
+
+def reportar_cuantizacion(referencia: IndicePlano, carpeta_plano: str, vectores_consultas: list):
+    """Tamaño de los vectores y recall@k del índice cuantizado (con y sin reescore) frente a float32."""
+    muestra = np.linspace(0, len(referencia) - 1, min(MUESTRA_RECALL, len(referencia)), dtype=int)
+    consultas = np.vstack([np.asarray(vectores_consultas, dtype=np.float32), referencia.vectores[muestra]])
+
+    tamano = lambda nombre: os.path.getsize(os.path.join(carpeta_plano, nombre)) / 1e6
+    print(f"Vectores {PRECISION_VECTORES}: {tamano(VECTORES_FILE):.2f} MB "
+          f"(float32: {referencia.vectores.nbytes / 1e6:.2f} MB)")
+    recall = recall_cuantizado(referencia, IndicePlano(carpeta_plano), consultas, K_RECALL)
+    print(f"Recall@{K_RECALL} {PRECISION_VECTORES} vs float32 ({len(consultas)} consultas): {recall:.1%}")
+    if VECTORES_REESCORE:
+        for candidatos in (2 * K_RECALL, 4 * K_RECALL):
+            recall = recall_cuantizado(referencia, IndicePlano(carpeta_plano, reescore=candidatos), consultas, K_RECALL)
+            print(f"Recall@{K_RECALL} con reescore de {candidatos} candidatos: {recall:.1%} "
+                  f"(copia float32: {tamano(VECTORES_COMPLETOS_FILE):.2f} MB)")
+
 
 def create_chroma_db_artifact(clean_folder: str = CLEAN_FOLDER, output_artifact_name: str = ARTIFACT_NAME):
     """
-    Carga los documentos limpios, crea la DB ChromaDB y la comprime en un archivo ZIP.
+    Carga los documentos limpios, actualiza la DB ChromaDB local (solo fragmentos nuevos o
+    modificados; los embeddings salen de la cache en disco si ya se calcularon) y la comprime en un ZIP.
     Retorna el nombre del archivo ZIP creado.
     """
     try:
@@ -35,21 +93,97 @@ def create_chroma_db_artifact(clean_folder: str = CLEAN_FOLDER, output_artifact_
             print(f"Error: No se encontraron archivos en '{clean_folder}'. Saliendo.")
             return None
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=300)
-        docs = text_splitter.split_documents(docs_raw)
-        
-        # --- 2. CREAR EMBEDDINGS ---
-        print("Generando Embeddings y creando ChromaDB...")
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        
-        if os.path.exists(DB_PERSIST_PATH):
-            shutil.rmtree(DB_PERSIST_PATH)
-        
-        Chroma.from_documents(
-            documents=docs, 
-            embedding_function=embeddings,
-            persist_directory=DB_PERSIST_PATH
-        )
+        if DEDUPLICAR:
+            informe = InformeDedup()
+            docs_raw = deduplicar_documentos(docs_raw, informe)
+
+        import torch
+        torch.set_num_threads(EMBEDDING_HILOS)
+        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, encode_kwargs={"batch_size": EMBEDDING_LOTE})
+        # Ventana del modelo sin los tokens especiales ([CLS]/[SEP] o <s>/</s>)
+        tokenizer = embeddings.client.tokenizer
+        ventana = embeddings.client.max_seq_length - 2
+        contar_tokens = lambda texto: len(tokenizer(texto, add_special_tokens=False)["input_ids"])
+
+        if FRAGMENTADOR == 'caracteres':
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=300)
+            docs = text_splitter.split_documents(docs_raw)
+        else:
+            fragmentador = FragmentadorEstructural(contar_tokens, min(FRAGMENTO_MAX_TOKENS or ventana, ventana))
+            docs = fragmentador.fragmentar_documentos(docs_raw)
+
+        if DEDUPLICAR:
+            docs = deduplicar_fragmentos(docs, informe)
+            print(informe.texto())
+        print(informe_longitudes([contar_tokens(d.page_content) for d in docs], ventana))
+
+        # --- 2. ACTUALIZAR EMBEDDINGS (upsert incremental por id de contenido) ---
+        print("Actualizando embeddings en ChromaDB...")
+        cache = CacheEmbeddings()
+        embeddings_cacheados = EmbeddingsCacheados(embeddings, EMBEDDING_MODEL, cache)
+
+        fragmentos = {}
+        for doc in docs:
+            fragmentos.setdefault(id_fragmento(doc.metadata.get('source', ''), doc.page_content), doc)
+
+        # Distancia coseno: el mismo orden que el producto punto del índice plano
+        metadatos_coleccion = {"hnsw:space": "cosine", "modelo": EMBEDDING_MODEL}
+        db = Chroma(persist_directory=DB_PERSIST_PATH, embedding_function=embeddings_cacheados,
+                    collection_metadata=metadatos_coleccion)
+        if (db._collection.metadata or {}).get("modelo") != EMBEDDING_MODEL:
+            # DB de otro modelo (o anterior a los ids de contenido): se recrea la colección
+            db.delete_collection()
+            db = Chroma(persist_directory=DB_PERSIST_PATH, embedding_function=embeddings_cacheados,
+                        collection_metadata=metadatos_coleccion)
+
+        guardados = db.get(include=["metadatas"])
+        nuevos, obsoletos, actualizar = cambios_indice({i: doc.metadata for i, doc in fragmentos.items()},
+                                                       dict(zip(guardados["ids"], guardados["metadatas"])))
+        for inicio in range(0, len(obsoletos), LOTE_CHROMA):
+            db.delete(ids=obsoletos[inicio:inicio + LOTE_CHROMA])
+        for inicio in range(0, len(nuevos), LOTE_CHROMA):
+            lote = nuevos[inicio:inicio + LOTE_CHROMA]
+            db.add_texts([fragmentos[i].page_content for i in lote], [fragmentos[i].metadata for i in lote], ids=lote)
+        # Mismo texto (mismo id y embedding) con metadatos distintos: solo se reescriben los metadatos
+        for inicio in range(0, len(actualizar), LOTE_CHROMA):
+            lote = actualizar[inicio:inicio + LOTE_CHROMA]
+            db._collection.update(ids=lote, metadatas=[fragmentos[i].metadata for i in lote])
+        cache.cerrar()
+
+        print(f"Índice: {len(nuevos)} fragmentos nuevos, {len(obsoletos)} eliminados, "
+              f"{len(actualizar)} con metadatos actualizados, "
+              f"{len(fragmentos) - len(nuevos) - len(actualizar)} sin cambios.")
+        print(embeddings_cacheados.resumen())
+
+        # --- 2b. EXPORTAR ÍNDICE PLANO (motor sin Chroma para el Proxy) ---
+        print("Exportando índice plano (mmap)...")
+        datos = db.get(include=["embeddings", "documents", "metadatas"])
+        carpeta_plano = os.path.join(DB_PERSIST_PATH, FLAT_INDEX_DIR)
+        exportar_indice_plano(datos["documents"], datos["metadatas"], datos["embeddings"], carpeta_plano, EMBEDDING_MODEL,
+                              precision=PRECISION_VECTORES, guardar_completos=VECTORES_REESCORE)
+
+        with tempfile.TemporaryDirectory() as carpeta_referencia:
+            # La paridad con Chroma se verifica sobre el índice float32; el cuantizado se mide contra él
+            referencia = IndicePlano(carpeta_plano) if PRECISION_VECTORES == 'float32' else IndicePlano(
+                exportar_indice_plano(datos["documents"], datos["metadatas"], datos["embeddings"], carpeta_referencia))
+            coincidencias = paridad_por_consulta(db, referencia, embeddings, CONSULTAS_PARIDAD)
+            for consulta, coincidencia in zip(CONSULTAS_PARIDAD, coincidencias):
+                if coincidencia < 1.0:
+                    print(f"Paridad parcial ({coincidencia:.0%} del top-7) para: {consulta}")
+            paridad = float(np.mean(coincidencias))
+            print(f"Paridad índice plano vs Chroma (top-7): {paridad:.0%}")
+            if paridad < PARIDAD_MINIMA:
+                raise RuntimeError(f"El índice plano no coincide con los resultados de Chroma "
+                                   f"({paridad:.0%} < {PARIDAD_MINIMA:.0%}).")
+            if PRECISION_VECTORES != 'float32':
+                reportar_cuantizacion(referencia, carpeta_plano, embeddings.embed_documents(CONSULTAS_PARIDAD))
+
+        # --- 2c. ÍNDICE INVERTIDO BM25 (mismos fragmentos y mismo orden que el índice plano) ---
+        print("Construyendo índice BM25...")
+        IndiceBM25.construir(datos["documents"]).guardar(os.path.join(DB_PERSIST_PATH, BM25_FILE))
+
+        # --- 2d. CORPUS COMPLETO (modo de contexto completo en cache de Gemini) ---
+        exportar_corpus(docs_raw, os.path.join(DB_PERSIST_PATH, CORPUS_FILE))
         
         # --- 3. COMPRIMIR LA DB ---
         print(f"Comprimiendo base de datos en {output_artifact_name}...")
@@ -59,9 +193,7 @@ def create_chroma_db_artifact(clean_folder: str = CLEAN_FOLDER, output_artifact_
                 for file in files:
                     file_path = os.path.join(root, file)
                     zipf.write(file_path, os.path.relpath(file_path, DB_PERSIST_PATH))
-        
-        # Limpiar la carpeta local
-        shutil.rmtree(DB_PERSIST_PATH)
+        # La carpeta local se conserva: la siguiente construcción solo aplica los cambios
         
         print(f"Artefacto RAG creado con éxito: {output_artifact_name}")
         return output_artifact_name
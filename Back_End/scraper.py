@@ -1,15 +1,22 @@
 
 import os
 import re
-import requests
+import json
 import time
-import sys
+import hashlib
+import asyncio
+import argparse
 import logging
+import multiprocessing
+import random
+import sqlite3
+from dataclasses import dataclass, field
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from multidict import CIMultiDict
 import tempfile
-import pymupdf4llm 
-import pymupdf4llm.layout
 
 # --- CONFIGURACIÓN Y LOGGING ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,90 +24,218 @@ logger = logging.getLogger(__name__)
 
 BASE_URL = "https://cc.unison.mx/"
 OUTPUT_FOLDER = os.path.join("Back_End", "Data", "texts")
+# Manifiesto del último rastreo: URL -> ETag/Last-Modified, hash del texto, archivo y enlaces
+MANIFEST_FILE = os.path.join("Back_End", "Data", "crawl_manifest.json")
+# Estado del rastreo en curso (frontera, visitadas, estado por URL) para retomarlo con --resume
+STATE_FILE = os.path.join("Back_End", "Data", "crawl_state.sqlite")
+CHECKPOINT_SEGUNDOS = float(os.environ.get('SCRAPER_CHECKPOINT_SEGUNDOS', '2'))
 MAX_PAGINAS = 500
 
+# Solicitudes simultáneas y pausa mínima entre solicitudes al mismo host (cortesía)
+CONCURRENCIA = int(os.environ.get('SCRAPER_CONCURRENCIA', '8'))
+PAUSA_POR_HOST = float(os.environ.get('SCRAPER_PAUSA_POR_HOST', '0.1'))
+TIMEOUT_SEGUNDOS = 10
+
+# Reintentos de URLs con errores transitorios (conexión, timeout, 429/5xx) con backoff exponencial
+MAX_REINTENTOS = int(os.environ.get('SCRAPER_MAX_REINTENTOS', '3'))
+REINTENTO_BASE_SEGUNDOS = float(os.environ.get('SCRAPER_REINTENTO_BASE', '2'))
+
+# PDFs: descarga por bloques a disco y extracción en procesos aparte con tiempo y páginas
+# acotados. El texto extraído se guarda en cache por hash del contenido del PDF.
+PDF_PROCESOS = int(os.environ.get('SCRAPER_PDF_PROCESOS', str(max(1, (os.cpu_count() or 2) // 2))))
+PDF_TIMEOUT_SEGUNDOS = float(os.environ.get('SCRAPER_PDF_TIMEOUT', '120'))
+PDF_TIMEOUT_DESCARGA = 60
+PDF_MAX_PAGINAS = int(os.environ.get('SCRAPER_PDF_MAX_PAGINAS', '200'))
+PDF_MAX_MB = float(os.environ.get('SCRAPER_PDF_MAX_MB', '50'))
+PDF_BLOQUE_BYTES = 1 << 16
+PDF_CACHE_FOLDER = os.path.join("Back_End", "Data", "pdf_cache")
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36"
 }
 
-# Conjunto para rastrear URLs visitadas y evitar bucles
-visitados = set()
-
 # --- FUNCIONES CORE ---
 
-def obtener_html(url: str) -> BeautifulSoup | None:
-    """Intenta obtener el HTML de la URL dada."""
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=10)
-        r.raise_for_status()  # Genera una excepción para códigos 4xx/5xx
-        return BeautifulSoup(r.text, "html.parser")
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"Error HTTP/Conexión al obtener {url}: {e}")
-        return None
-
-
-def formatear_nombre(url: str) -> str:
+def formatear_nombre(url: str, base_url: str = BASE_URL) -> str:
     """Convierte la URL a un nombre de archivo seguro y conciso."""
-    nombre = url.replace(BASE_URL, "")
+    nombre = url.replace(base_url, "")
     nombre = re.sub(r'[^a-zA-Z0-9_-]', "_", nombre)
     return nombre[:80] if nombre else "index"
 
 
-def guardar_texto(nombre: str, texto: str):
-    """Guarda el texto extraído en la carpeta de salida."""
-    if len(texto.strip()) < 20:
-        return
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
 
-    path = os.path.join(OUTPUT_FOLDER, f"{nombre}.txt")
 
-    if os.path.exists(path):
-        logger.debug(f"Archivo ya existe, ignorado: {nombre}")
-        return
+def guardar_texto(nombre: str, texto: str, carpeta: str = OUTPUT_FOLDER) -> str | None:
+    """
+    Guarda (o reemplaza) el texto extraído en la carpeta de salida. La escritura es atómica
+    para que un rastreo interrumpido no deje archivos a medias. Devuelve la ruta, o None si
+    el texto es demasiado corto.
+    """
+    if len(texto.strip()) < 20:
+        return None
+
+    path = os.path.join(carpeta, f"{nombre}.txt")
 
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
             f.write(texto)
+        os.replace(path + ".tmp", path)
         logger.info(f"Guardado: {path}")
+        return path
     except IOError as e:
         logger.error(f"Error al escribir el archivo {nombre}: {e}")
+        return None
 
 
-def procesar_pdf(url: str):
-    """Descarga y extrae texto de un PDF usando pymupdf4llm."""
-    logger.info(f"Procesando PDF: {url}")
+def cargar_manifiesto(ruta: str) -> dict:
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=20)
-        r.raise_for_status()
 
-        nombre = formatear_nombre(url)
+def guardar_manifiesto(manifiesto: dict, ruta: str):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(ruta + ".tmp", ruta)
 
-        # Usar un archivo temporal para el procesamiento
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(r.content)
-            tmp_path = tmp.name
 
-        # Extraer texto usando la librería optimizada
-        texto = pymupdf4llm.to_text(tmp_path)
-        
-        guardar_texto(nombre, texto)
+def _archivo_presente(entrada: dict) -> bool:
+    """True si la entrada no tiene archivo (texto muy corto) o si su archivo sigue en disco."""
+    return not entrada.get("archivo") or os.path.exists(entrada["archivo"])
 
-        os.remove(tmp_path) # Limpiar el archivo temporal
 
-    except requests.exceptions.RequestException:
-        logger.warning("No se pudo descargar el PDF (Error HTTP/Timeout).")
-    except Exception as e:
-        logger.error(f"Error procesando PDF {url}: {e}")
+def es_reintentable(error: Exception) -> bool:
+    """Errores transitorios: conexión, timeouts y respuestas 429/5xx."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
 
+def encabezados_condicionales(entrada: dict | None) -> dict:
+    """If-None-Match / If-Modified-Since a partir de la entrada del manifiesto."""
+    encabezados = {}
+    if entrada and entrada.get("etag"):
+        encabezados["If-None-Match"] = entrada["etag"]
+    if entrada and entrada.get("last_modified"):
+        encabezados["If-Modified-Since"] = entrada["last_modified"]
+    return encabezados
 
-def procesar_html(url: str, soup: BeautifulSoup):
-    """Extrae texto de la página HTML."""
-    texto = soup.get_text("\n", strip=True)
-    nombre = formatear_nombre(url)
-    guardar_texto(nombre, texto)
 
+# --- PDFs ---
 
-def obtener_links(soup: BeautifulSoup, url_actual: str) -> list[str]:
+def extraer_texto_pdf(ruta: str, max_paginas: int = PDF_MAX_PAGINAS) -> str:
+    """Extrae texto de un PDF usando pymupdf4llm, limitado a las primeras `max_paginas` páginas."""
+    # Solo se importa en los procesos de extracción de ExtractorPDF
+    import pymupdf
+    import pymupdf4llm
+    import pymupdf4llm.layout
+
+    with pymupdf.open(ruta) as doc:
+        total = doc.page_count
+    if total > max_paginas:
+        logger.warning(f"PDF de {total} páginas; se extraen solo las primeras {max_paginas}: {ruta}")
+    return pymupdf4llm.to_text(ruta, pages=list(range(min(total, max_paginas))))
+
+
+def _extraer_en_proceso(ruta: str, max_paginas: int, conexion):
+    """Punto de entrada del proceso de extracción: envía ("ok", texto) o ("error", mensaje)."""
+    try:
+        conexion.send(("ok", extraer_texto_pdf(ruta, max_paginas)))
+    except Exception as e:
+        conexion.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conexion.close()
+
+
+class ExtractorPDF:
+    """
+    Extrae PDFs en procesos aparte (como máximo `procesos` a la vez) para no bloquear el
+    rastreo de HTML. Cada documento tiene un tiempo máximo: si lo excede, su proceso se
+    termina. Los textos se guardan en cache por hash del PDF y límite de páginas.
+    """
+
+    def __init__(self, procesos: int = PDF_PROCESOS, timeout: float = PDF_TIMEOUT_SEGUNDOS,
+                 max_paginas: int = PDF_MAX_PAGINAS, carpeta_cache: str = PDF_CACHE_FOLDER):
+        self.timeout = timeout
+        self.max_paginas = max_paginas
+        self.carpeta_cache = carpeta_cache
+        self.aciertos_cache = 0
+        self._semaforo = asyncio.Semaphore(procesos)
+        self._contexto = multiprocessing.get_context('spawn')
+
+    def _ruta_cache(self, huella: str) -> str:
+        return os.path.join(self.carpeta_cache, f"{huella}-{self.max_paginas}.txt")
+
+    async def extraer(self, ruta: str, huella: str) -> str:
+        """Texto del PDF en `ruta` cuyo contenido tiene hash `huella` (cache o extracción)."""
+        ruta_cache = self._ruta_cache(huella)
+        if os.path.exists(ruta_cache):
+            self.aciertos_cache += 1
+            with open(ruta_cache, "r", encoding="utf-8") as f:
+                return f.read()
+
+        async with self._semaforo:
+            texto = await asyncio.to_thread(self._extraer_en_subproceso, ruta)
+
+        os.makedirs(self.carpeta_cache, exist_ok=True)
+        with open(ruta_cache + ".tmp", "w", encoding="utf-8") as f:
+            f.write(texto)
+        os.replace(ruta_cache + ".tmp", ruta_cache)
+        return texto
+
+    def _extraer_en_subproceso(self, ruta: str) -> str:
+        receptor, emisor = self._contexto.Pipe(duplex=False)
+        proceso = self._contexto.Process(target=_extraer_en_proceso, args=(ruta, self.max_paginas, emisor), daemon=True)
+        proceso.start()
+        emisor.close()
+        try:
+            if not receptor.poll(self.timeout):
+                raise TimeoutError(f"La extracción superó {self.timeout:.0f}s")
+            estado, valor = receptor.recv()
+        finally:
+            if proceso.is_alive():
+                proceso.kill()
+            proceso.join()
+            receptor.close()
+        if estado == "error":
+            raise RuntimeError(valor)
+        return valor
+
+
+async def descargar_pdf(sesion: aiohttp.ClientSession, url: str, encabezados: dict) -> tuple[int, CIMultiDict, str | None, str | None]:
+    """
+    Descarga el PDF por bloques a un archivo temporal, calculando su hash sobre la marcha.
+    Devuelve (status, encabezados de respuesta, ruta temporal, hash); sin ruta si es 304.
+    El archivo temporal se borra si la descarga falla; si no, lo borra quien lo procesa.
+    """
+    timeout = aiohttp.ClientTimeout(total=PDF_TIMEOUT_DESCARGA)
+    async with sesion.get(url, headers=encabezados, timeout=timeout) as r:
+        if r.status == 304 or r.status in (404, 410):
+            return r.status, CIMultiDict(r.headers), None, None
+        r.raise_for_status()
+
+        huella = hashlib.sha256()
+        tamano = 0
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            try:
+                async for bloque in r.content.iter_chunked(PDF_BLOQUE_BYTES):
+                    tamano += len(bloque)
+                    if tamano > PDF_MAX_MB * 1024 * 1024:
+                        raise ValueError(f"PDF mayor a {PDF_MAX_MB:.0f} MB")
+                    huella.update(bloque)
+                    tmp.write(bloque)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        return r.status, CIMultiDict(r.headers), tmp.name, huella.hexdigest()
+
+
+def obtener_links(soup: BeautifulSoup, url_actual: str, base_url: str = BASE_URL) -> list[str]:
     """Extrae todos los enlaces válidos para rastrear."""
     links = []
     for a in soup.find_all("a", href=True):
@@ -113,57 +248,429 @@ def obtener_links(soup: BeautifulSoup, url_actual: str) -> list[str]:
         link = urljoin(url_actual, href)
 
         # Solo rastrear enlaces dentro del dominio base y que no sean anclas internas
-        if link.startswith(BASE_URL) and "#" not in link[len(BASE_URL):]:
+        if link.startswith(base_url) and "#" not in link[len(base_url):]:
             links.append(link)
 
     return links
 
 
-def crawl(url: str):
-    """Lógica recursiva del rastreador."""
-    if url in visitados:
-        return
+def analizar_pagina(url: str, html: str, base_url: str = BASE_URL) -> tuple[str, list[str]]:
+    """Parsea el HTML y devuelve (texto, enlaces). Se ejecuta fuera del event loop."""
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.get_text("\n", strip=True), obtener_links(soup, url, base_url)
+
+
+# --- RASTREADOR ASÍNCRONO ---
+
+class LimitadorPorHost:
+    """Garantiza una pausa mínima entre solicitudes consecutivas a un mismo host."""
+
+    def __init__(self, pausa: float):
+        self.pausa = pausa
+        self._candados = {}
+        self._ultima = {}
+
+    async def esperar(self, url: str):
+        host = urlparse(url).netloc
+        candado = self._candados.setdefault(host, asyncio.Lock())
+        async with candado:
+            espera = self._ultima.get(host, 0.0) + self.pausa - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._ultima[host] = time.monotonic()
+
+
+@dataclass
+class ResumenRastreo:
+    paginas: int = 0
+    pdfs: int = 0
+    pdfs_cache: int = 0
+    errores: int = 0
+    reintentos: int = 0
+    duracion_s: float = 0.0
+    nuevas: list = field(default_factory=list)
+    modificadas: list = field(default_factory=list)
+    sin_cambios: int = 0
+    eliminadas: list = field(default_factory=list)
+    fallidas: list = field(default_factory=list)
+
+    @property
+    def paginas_por_segundo(self) -> float:
+        return (self.paginas + self.pdfs) / self.duracion_s if self.duracion_s else 0.0
+
+    def __str__(self):
+        return (f"{self.paginas} páginas HTML, {self.pdfs} PDFs ({self.pdfs_cache} desde cache), {self.errores} errores "
+                f"({self.reintentos} reintentos, {len(self.fallidas)} URLs fallidas) en "
+                f"{self.duracion_s:.1f}s ({self.paginas_por_segundo:.2f} páginas/s). "
+                f"Nuevas: {len(self.nuevas)}, modificadas: {len(self.modificadas)}, "
+                f"sin cambios: {self.sin_cambios}, eliminadas: {len(self.eliminadas)}")
+
+
+class EstadoRastreo:
+    """
+    Estado del rastreo en SQLite: por URL, su estado (pendiente, hecha, fallida, descartada), intentos,
+    último error, tipo de cambio y entrada del manifiesto. Los cambios se confirman en disco
+    cada `intervalo` segundos (y al cerrar), de modo que un rastreo interrumpido puede
+    retomarse sin volver a descargar las páginas ya completadas.
+    """
+
+    def __init__(self, ruta: str, intervalo: float = 2.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self.conexion = sqlite3.connect(ruta)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY, estado TEXT NOT NULL, intentos INTEGER DEFAULT 0,
+            error TEXT, cambio TEXT, entrada TEXT)""")
+        self.conexion.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        self.conexion.commit()
+        self._ultimo = time.monotonic()
+
+    def _quizas_confirmar(self):
+        if time.monotonic() - self._ultimo >= self.intervalo:
+            self.confirmar()
+
+    def confirmar(self):
+        self.conexion.commit()
+        self._ultimo = time.monotonic()
+
+    def cerrar(self):
+        self.confirmar()
+        self.conexion.close()
+
+    def base_url(self) -> str | None:
+        fila = self.conexion.execute("SELECT valor FROM meta WHERE clave = 'base_url'").fetchone()
+        return fila[0] if fila else None
+
+    def iniciar(self, base_url: str):
+        """Descarta cualquier estado previo y registra la URL base del rastreo."""
+        self.conexion.execute("DELETE FROM urls")
+        self.conexion.execute("INSERT OR REPLACE INTO meta VALUES ('base_url', ?)", (base_url,))
+        self.confirmar()
+
+    def agregar(self, url: str):
+        self.conexion.execute("INSERT OR IGNORE INTO urls (url, estado) VALUES (?, 'pendiente')", (url,))
+        self._quizas_confirmar()
+
+    def completar(self, url: str, entrada: dict | None = None, cambio: str | None = None):
+        self.conexion.execute("UPDATE urls SET estado = 'hecha', error = NULL, cambio = ?, entrada = ? WHERE url = ?",
+                              (cambio, json.dumps(entrada, ensure_ascii=False) if entrada is not None else None, url))
+        self._quizas_confirmar()
+
+    def fallar(self, url: str, error: str, definitiva: bool = False) -> int:
+        """
+        Registra un fallo y devuelve los intentos acumulados. Las fallas definitivas quedan
+        como 'descartada' y no se reintentan al retomar el rastreo.
+        """
+        self.conexion.execute("UPDATE urls SET estado = ?, intentos = intentos + 1, error = ? WHERE url = ?",
+                              ('descartada' if definitiva else 'fallida', error, url))
+        self._quizas_confirmar()
+        return self.conexion.execute("SELECT intentos FROM urls WHERE url = ?", (url,)).fetchone()[0]
+
+    def reintentar(self, url: str):
+        self.conexion.execute("UPDATE urls SET estado = 'pendiente' WHERE url = ?", (url,))
+        self._quizas_confirmar()
+
+    def urls(self) -> list[str]:
+        return [fila[0] for fila in self.conexion.execute("SELECT url FROM urls ORDER BY rowid")]
+
+    def por_estado(self, estado: str) -> list[tuple]:
+        return self.conexion.execute("SELECT url, intentos, error FROM urls WHERE estado = ? ORDER BY rowid",
+                                     (estado,)).fetchall()
+
+    def completadas(self) -> list[tuple[str, str | None, dict | None]]:
+        filas = self.conexion.execute("SELECT url, cambio, entrada FROM urls WHERE estado = 'hecha' ORDER BY rowid")
+        return [(url, cambio, json.loads(entrada) if entrada else None) for url, cambio, entrada in filas]
+
+
+class Rastreador:
+    """
+    Rastreo iterativo con una frontera (cola) sin duplicados y un número fijo de trabajadores
+    que comparten una sesión HTTP (conexiones reutilizadas). Cada URL se encola una sola vez
+    y nunca se encolan más de `max_paginas`. El parseo de HTML corre en hilos, fuera del
+    event loop.
+
+    Es incremental: con el manifiesto del rastreo anterior envía GETs condicionales, solo
+    reescribe los archivos cuyo texto cambió (hash) y, en una respuesta 304, sigue los
+    enlaces guardados de la página. Las URLs del manifiesto que ya no se alcanzan se eliminan.
+
+    El estado (frontera, visitadas, resultado por URL) se guarda en un EstadoRastreo; con
+    `reanudar` se continúa el rastreo interrumpido. Los errores transitorios se reintentan
+    con backoff exponencial hasta `max_reintentos` veces.
+    """
+
+    def __init__(self, base_url: str = BASE_URL, carpeta: str = OUTPUT_FOLDER, max_paginas: int = MAX_PAGINAS,
+                 concurrencia: int = CONCURRENCIA, pausa_por_host: float = PAUSA_POR_HOST,
+                 manifiesto: str = MANIFEST_FILE, extractor: ExtractorPDF | None = None,
+                 estado: str = STATE_FILE, reanudar: bool = False, max_reintentos: int = MAX_REINTENTOS,
+                 reintento_base: float = REINTENTO_BASE_SEGUNDOS):
+        self.base_url = base_url
+        self.carpeta = carpeta
+        self.max_paginas = max_paginas
+        self.concurrencia = concurrencia
+        self.limitador = LimitadorPorHost(pausa_por_host)
+        self.ruta_manifiesto = manifiesto
+        self.anterior = cargar_manifiesto(manifiesto)
+        self.manifiesto = {}
+        self.visitados = set()
+        self.frontera = asyncio.Queue()
+        self.resumen = ResumenRastreo()
+        self.extractor = extractor or ExtractorPDF()
+        self.estado = EstadoRastreo(estado, CHECKPOINT_SEGUNDOS)
+        self.reanudar = reanudar
+        self.max_reintentos = max_reintentos
+        self.reintento_base = reintento_base
+        self._pdfs_pendientes = set()
+        self._reintentos_pendientes = set()
+
+    def encolar(self, url: str):
+        """Agrega la URL a la frontera si es nueva y no se alcanzó el límite de páginas."""
+        url = url.split('#')[0]
+        if url in self.visitados or len(self.visitados) >= self.max_paginas:
+            return
+        self.visitados.add(url)
+        self.estado.agregar(url)
+        self.frontera.put_nowait(url)
+
+    def _restaurar(self):
+        """Reconstruye visitadas, manifiesto parcial, resumen y frontera desde el estado guardado."""
+        self.visitados = set(self.estado.urls())
+        for url, cambio, entrada in self.estado.completadas():
+            if entrada is not None:
+                self.manifiesto[url] = entrada
+            if cambio == "nueva":
+                self.resumen.nuevas.append(url)
+            elif cambio == "modificada":
+                self.resumen.modificadas.append(url)
+            elif cambio == "eliminada":
+                self.resumen.eliminadas.append(url)
+            elif cambio == "sin_cambios":
+                self.resumen.sin_cambios += 1
+        pendientes = [url for url, _, _ in self.estado.por_estado('pendiente')]
+        fallidas = [url for url, intentos, _ in self.estado.por_estado('fallida') if intentos <= self.max_reintentos]
+        for url in pendientes + fallidas:
+            self.frontera.put_nowait(url)
+        logger.info(f"Retomando rastreo: {len(self.visitados)} URLs conocidas, {len(self.manifiesto)} completadas, "
+                    f"{len(pendientes)} pendientes y {len(fallidas)} fallidas por reintentar.")
+
+    def _registrar(self, url: str, encabezados: dict, texto: str | None, links: list[str]):
+        """
+        Actualiza el manifiesto para `url` y reescribe su archivo solo si el texto cambió.
+        texto=None indica una respuesta 304 (sin cambios).
+        """
+        previa = self.anterior.get(url)
+        entrada = dict(previa or {}, links=links)
+        entrada["etag"] = encabezados.get("ETag") or entrada.get("etag")
+        entrada["last_modified"] = encabezados.get("Last-Modified") or entrada.get("last_modified")
+
+        if texto is not None:
+            huella = hash_texto(texto)
+            if previa is None or previa.get("hash") != huella or not _archivo_presente(previa):
+                archivo = guardar_texto(formatear_nombre(url, self.base_url), texto, self.carpeta)
+                if archivo is None and entrada.get("archivo") and os.path.exists(entrada["archivo"]):
+                    os.remove(entrada["archivo"])
+                entrada.update(hash=huella, archivo=archivo)
+                (self.resumen.nuevas if previa is None else self.resumen.modificadas).append(url)
+                self.manifiesto[url] = entrada
+                self.estado.completar(url, entrada, "nueva" if previa is None else "modificada")
+                return
+
+        self.resumen.sin_cambios += 1
+        self.manifiesto[url] = entrada
+        self.estado.completar(url, entrada, "sin_cambios")
+
+    async def _visitar(self, sesion: aiohttp.ClientSession, url: str):
+        logger.info(f"Visitando: {url} (Páginas encoladas: {len(self.visitados)})")
+        previa = self.anterior.get(url)
+        # Sin el archivo local no sirve un 304: se pide el contenido completo
+        condicionales = encabezados_condicionales(previa) if previa and _archivo_presente(previa) else {}
+
+        await self.limitador.esperar(url)
+
+        if url.lower().endswith(".pdf"):
+            logger.info(f"Procesando PDF: {url}")
+            status, encabezados, ruta, huella = await descargar_pdf(sesion, url, condicionales)
+            if status in (404, 410):
+                if previa is not None:
+                    self._eliminar(url, previa)
+                else:
+                    self.estado.completar(url)
+                return
+            if ruta is None:
+                self._registrar(url, encabezados, None, [])
+                self.resumen.pdfs += 1
+                return
+            # La extracción sigue en segundo plano; el trabajador vuelve a la frontera
+            tarea = asyncio.create_task(self._procesar_pdf(url, encabezados, ruta, huella))
+            self._pdfs_pendientes.add(tarea)
+            tarea.add_done_callback(self._pdfs_pendientes.discard)
+            return
+
+        async with sesion.get(url, headers=condicionales) as r:
+            if r.status == 304:
+                # Los enlaces se guardan en el estado antes de marcar la página como hecha: un
+                # corte entre ambos pasos la deja pendiente, nunca hecha sin sus enlaces
+                links = self.anterior[url].get("links", [])
+                for link in links:
+                    self.encolar(link)
+                self._registrar(url, CIMultiDict(r.headers), None, links)
+                self.resumen.paginas += 1
+                return
+            if r.status in (404, 410) and previa is not None:
+                self._eliminar(url, previa)
+                return
+            r.raise_for_status()
+            if 'html' not in (r.content_type or 'html'):
+                self.estado.completar(url)
+                return
+            encabezados = CIMultiDict(r.headers)
+            html = await r.text(errors='replace')
+
+        texto, links = await asyncio.to_thread(analizar_pagina, url, html, self.base_url)
+        for link in links:
+            self.encolar(link)
+        self._registrar(url, encabezados, texto, links)
+        self.resumen.paginas += 1
+
+    async def _procesar_pdf(self, url: str, encabezados: dict, ruta: str, huella: str):
+        try:
+            texto = await self.extractor.extraer(ruta, huella)
+            self._registrar(url, encabezados, texto, [])
+            self.resumen.pdfs += 1
+        except Exception as e:
+            # Errores de extracción (PDF dañado, tiempo excedido): reintentar no ayuda
+            self._fallo(url, e, reintentable=False)
+        finally:
+            os.remove(ruta)
+
+    async def _trabajador(self, sesion: aiohttp.ClientSession):
+        while True:
+            url = await self.frontera.get()
+            try:
+                await self._visitar(sesion, url)
+            except Exception as e:
+                self._fallo(url, e, es_reintentable(e))
+            finally:
+                self.frontera.task_done()
+
+    def _fallo(self, url: str, error: Exception, reintentable: bool):
+        """Registra el error y, si es transitorio y quedan intentos, agenda un reintento con backoff."""
+        self.resumen.errores += 1
+        mensaje = f"{type(error).__name__}: {error}"
+        intentos = self.estado.fallar(url, mensaje, definitiva=not reintentable)
+        if not reintentable or intentos > self.max_reintentos:
+            logger.warning(f"Error definitivo en {url} tras {intentos} intento(s): {mensaje}")
+            return
+        espera = self.reintento_base * 2 ** (intentos - 1) * random.uniform(0.5, 1.5)
+        logger.warning(f"Error en {url} ({mensaje}); reintento {intentos}/{self.max_reintentos} en {espera:.1f}s")
+        tarea = asyncio.create_task(self._reintentar(url, espera))
+        self._reintentos_pendientes.add(tarea)
+        tarea.add_done_callback(self._reintentos_pendientes.discard)
+
+    async def _reintentar(self, url: str, espera: float):
+        await asyncio.sleep(espera)
+        self.resumen.reintentos += 1
+        self.estado.reintentar(url)
+        self.frontera.put_nowait(url)
+
+    def _eliminar(self, url: str, entrada: dict):
+        """Borra el archivo de una página que ya no existe (no queda en el manifiesto)."""
+        archivo = entrada.get("archivo")
+        if archivo and os.path.exists(archivo):
+            os.remove(archivo)
+        self.resumen.eliminadas.append(url)
+        self.estado.completar(url, None, "eliminada")
+
+    def _eliminar_ausentes(self):
+        """
+        Borra los archivos de las URLs del manifiesto anterior que ya no se alcanzaron. Las que
+        se visitaron con error se conservan; si el rastreo se truncó por MAX_PAGINAS, no se borra nada.
+        """
+        ausentes = [url for url in self.anterior if url not in self.visitados]
+        if ausentes and len(self.visitados) >= self.max_paginas:
+            logger.warning(f"Rastreo truncado en {self.max_paginas} páginas: no se eliminan {len(ausentes)} URLs no alcanzadas.")
+            self.manifiesto.update({url: self.anterior[url] for url in ausentes})
+            return
+        for url in ausentes:
+            self._eliminar(url, self.anterior[url])
+        # Visitadas con error: se conserva la entrada anterior
+        for url in self.visitados:
+            if url not in self.manifiesto and url in self.anterior and url not in self.resumen.eliminadas:
+                self.manifiesto[url] = self.anterior[url]
+
+    async def rastrear(self) -> ResumenRastreo:
+        os.makedirs(self.carpeta, exist_ok=True)
+        inicio = time.perf_counter()
+        if self.reanudar and self.estado.base_url() == self.base_url and self.estado.urls():
+            self._restaurar()
+        else:
+            if self.reanudar:
+                logger.warning("No hay un rastreo interrumpido que retomar; se inicia uno nuevo.")
+            self.estado.iniciar(self.base_url)
+            self.encolar(self.base_url)
+
+        conector = aiohttp.TCPConnector(limit=self.concurrencia)
+        timeout = aiohttp.ClientTimeout(total=TIMEOUT_SEGUNDOS)
+        try:
+            async with aiohttp.ClientSession(headers=HEADERS, connector=conector, timeout=timeout) as sesion:
+                trabajadores = [asyncio.create_task(self._trabajador(sesion)) for _ in range(self.concurrencia)]
+                # Las extracciones de PDF y los reintentos agendados pueden encolar más trabajo
+                while True:
+                    await self.frontera.join()
+                    pendientes = self._pdfs_pendientes | self._reintentos_pendientes
+                    if not pendientes:
+                        break
+                    await asyncio.gather(*pendientes)
+                for t in trabajadores:
+                    t.cancel()
+                await asyncio.gather(*trabajadores, return_exceptions=True)
+        finally:
+            self.estado.confirmar()
+
+        self.resumen.fallidas = [url for url, _, _ in
+                                 self.estado.por_estado('fallida') + self.estado.por_estado('descartada')]
+        self.resumen.pdfs_cache = self.extractor.aciertos_cache
+        self._eliminar_ausentes()
+        guardar_manifiesto(self.manifiesto, self.ruta_manifiesto)
+        # Rastreo terminado: el manifiesto ya refleja el estado, no queda nada que retomar
+        self.estado.cerrar()
+        for sufijo in ("", "-wal", "-shm"):
+            if os.path.exists(self.estado.ruta + sufijo):
+                os.remove(self.estado.ruta + sufijo)
+        self.resumen.duracion_s = time.perf_counter() - inicio
+        for etiqueta, urls in (("Nueva", self.resumen.nuevas), ("Modificada", self.resumen.modificadas),
+                               ("Eliminada", self.resumen.eliminadas), ("Fallida", self.resumen.fallidas)):
+            for url in urls:
+                logger.info(f"{etiqueta}: {url}")
+        return self.resumen
+
+
+def crawl(url: str = BASE_URL, carpeta: str = OUTPUT_FOLDER, max_paginas: int = MAX_PAGINAS,
+          concurrencia: int = CONCURRENCIA, manifiesto: str = MANIFEST_FILE, estado: str = STATE_FILE,
+          reanudar: bool = False) -> ResumenRastreo:
+    """Rastrea el sitio a partir de `url` (o retoma el rastreo interrumpido) y devuelve el resumen."""
+    rastreador = Rastreador(url, carpeta, max_paginas, concurrencia, manifiesto=manifiesto,
+                            estado=estado, reanudar=reanudar)
+    return asyncio.run(rastreador.rastrear())
 
-    if len(visitados) >= MAX_PAGINAS:
-        return
-
-    # Limpieza de URL para evitar repeticiones por anclas
-    clean_url = url.split('#')[0]
-
-    if clean_url in visitados:
-        return
-        
-    logger.info(f"Visitando: {clean_url} (Páginas visitadas: {len(visitados)})")
-    visitados.add(clean_url)
-
-    if clean_url.lower().endswith(".pdf"):
-        procesar_pdf(clean_url)
-        return
-
-    soup = obtener_html(clean_url)
-    if not soup:
-        return
-
-    procesar_html(clean_url, soup)
-
-    nuevos_links = obtener_links(soup, clean_url)
-
-    for link in nuevos_links:
-        crawl(link)
-        time.sleep(0.1) # Pausa breve para evitar bloqueo
 
 def main():
     """Punto de entrada principal para el rastreo de datos."""
-    if not os.path.exists(OUTPUT_FOLDER):
-        os.makedirs(OUTPUT_FOLDER)
+    parser = argparse.ArgumentParser(description="Rastreo del sitio web de la licenciatura.")
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--salida', default=OUTPUT_FOLDER)
+    parser.add_argument('--manifiesto', default=MANIFEST_FILE)
+    parser.add_argument('--max-paginas', type=int, default=MAX_PAGINAS)
+    parser.add_argument('--concurrencia', type=int, default=CONCURRENCIA)
+    parser.add_argument('--estado', default=STATE_FILE, help="Base SQLite con el estado del rastreo en curso")
+    parser.add_argument('--resume', action='store_true', help="Retoma el último rastreo interrumpido")
+    args = parser.parse_args()
 
     logger.info("Iniciando rastreo del sitio web de la UNISON...")
-    try:
-        crawl(BASE_URL)
-    except RecursionError:
-        logger.error("Rastreo detenido: Se alcanzó el límite de recursión de Python. Use un proceso asíncrono o aumente el límite de recursión (sys.setrecursionlimit).")
-        
-    logger.info(f"Rastreo completado. Total de páginas únicas procesadas: {len(visitados)}")
+    resumen = crawl(args.base_url, args.salida, args.max_paginas, args.concurrencia, args.manifiesto,
+                    args.estado, args.resume)
+    logger.info(f"Rastreo completado: {resumen}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
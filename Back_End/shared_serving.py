@@ -0,0 +1,106 @@
+# Back_End/shared_serving.py
+# Modo multi-worker del Proxy: el artefacto RAG y los pesos del modelo de embeddings se
+# preparan una sola vez en memoria compartida (tmpfs) y cada worker los mapea en solo lectura.
+
+import os
+import json
+import fcntl
+import errno
+from contextlib import contextmanager
+
+CARPETA_COMPARTIDA = os.environ.get('CARPETA_COMPARTIDA', '/dev/shm/rag_proxy')
+# /dev/shm de un contenedor suele tener 64 MB: lo que no cabe se escribe en disco. Un archivo
+# en disco mapeado con mmap también comparte sus páginas (page cache) entre los workers.
+CARPETA_COMPARTIDA_DISCO = os.environ.get('CARPETA_COMPARTIDA_DISCO', '/tmp/rag_proxy')
+# Espacio que se deja libre en la carpeta compartida además de lo que se escribe
+MARGEN_LIBRE = 0.1
+PESOS_FILE = 'embedding_pesos.pt'
+
+
+@contextmanager
+def candado(ruta: str):
+    """Candado exclusivo entre procesos (flock) sobre el archivo `ruta`."""
+    with open(ruta, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def ejecutar_una_vez(nombre: str, funcion, carpeta: str = CARPETA_COMPARTIDA):
+    """
+    Ejecuta funcion() una sola vez entre todos los workers. El primero en tomar el candado
+    la ejecuta y guarda su resultado (JSON); los demás esperan y reutilizan ese resultado.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    marcador = os.path.join(carpeta, f'{nombre}.listo')
+    with candado(os.path.join(carpeta, f'{nombre}.lock')):
+        if os.path.exists(marcador):
+            with open(marcador, 'r') as f:
+                return json.load(f)
+        resultado = funcion()
+        with open(marcador, 'w') as f:
+            json.dump(resultado, f)
+        return resultado
+
+
+def espacio_libre(carpeta: str) -> int:
+    """Bytes disponibles en el sistema de archivos de `carpeta` (os.statvfs)."""
+    estado = os.statvfs(carpeta)
+    return estado.f_bavail * estado.f_frsize
+
+
+def carpeta_con_espacio(bytes_necesarios: int, carpeta: str = CARPETA_COMPARTIDA,
+                        alternativa: str = CARPETA_COMPARTIDA_DISCO) -> str:
+    """`carpeta` si le caben `bytes_necesarios` (más el margen); si no, la carpeta en disco."""
+    os.makedirs(carpeta, exist_ok=True)
+    libre = espacio_libre(carpeta)
+    if libre >= bytes_necesarios * (1 + MARGEN_LIBRE):
+        return carpeta
+    print(f"Memoria compartida insuficiente en {carpeta} ({libre / 1e6:.0f} MB libres, "
+          f"{bytes_necesarios / 1e6:.0f} MB necesarios): se usa {alternativa}")
+    os.makedirs(alternativa, exist_ok=True)
+    return alternativa
+
+
+def sin_espacio(error: OSError) -> bool:
+    return error.errno in (errno.ENOSPC, errno.EDQUOT)
+
+
+def compartir_pesos(modulo, carpeta: str = CARPETA_COMPARTIDA, alternativa: str = CARPETA_COMPARTIDA_DISCO) -> str | None:
+    """
+    Sustituye los parámetros de `modulo` (torch.nn.Module) por tensores respaldados por un
+    archivo compartido, mapeado con mmap. Todos los workers apuntan a las mismas páginas
+    físicas, así que los pesos ocupan memoria una sola vez. El archivo va en memoria
+    compartida si cabe (os.statvfs) y si no, en disco. Si tampoco se puede escribir ahí,
+    devuelve None y cada worker conserva su propia copia de los pesos.
+    """
+    import torch
+
+    def guardar():
+        estado = modulo.state_dict()
+        tamano = sum(t.numel() * t.element_size() for t in estado.values())
+        ruta = os.path.join(carpeta_con_espacio(tamano, carpeta, alternativa), PESOS_FILE)
+        try:
+            torch.save(estado, ruta)
+        except OSError as e:
+            if not sin_espacio(e):
+                raise
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            print(f"No hay espacio para compartir los pesos ({e}): cada worker usa su propia copia.")
+            return None
+        return ruta
+
+    ruta = ejecutar_una_vez('pesos', guardar, carpeta)
+    if ruta is None:
+        return None
+    estado = torch.load(ruta, map_location='cpu', mmap=True)
+    modulo.load_state_dict(estado, assign=True)
+    return ruta
+
+
+def hilos_por_worker(workers: int) -> int:
+    """Reparte los vCPUs entre los workers para evitar sobre-suscripción de hilos de torch."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
@@ -0,0 +1,113 @@
+# Back_End/telemetry.py
+# Tramos de tiempo por solicitud, memoria del proceso y perfilado muestreado para el Proxy.
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import resource
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+
+def rss_mb() -> float:
+    """RSS actual del proceso en MB (pico de getrusage si /proc no está disponible)."""
+    try:
+        with open('/proc/self/statm') as f:
+            paginas = int(f.read().split()[1])
+        return round(paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def memoria_worker() -> dict:
+    """
+    Desglose de memoria del proceso en MB (smaps_rollup): RSS, PSS (proporcional, reparte las
+    páginas compartidas entre los procesos que las usan), compartida y privada.
+    """
+    campos = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "compartida", "Shared_Dirty": "compartida",
+              "Private_Clean": "privada", "Private_Dirty": "privada"}
+    memoria = {"pid": os.getpid(), "rss": 0.0, "pss": 0.0, "compartida": 0.0, "privada": 0.0}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for linea in f:
+                partes = linea.split()
+                if partes and partes[0].rstrip(':') in campos:
+                    memoria[campos[partes[0].rstrip(':')]] += int(partes[1]) / 1024
+    except OSError:
+        memoria["rss"] = rss_mb()
+    return {k: round(v, 1) if isinstance(v, float) else v for k, v in memoria.items()}
+
+
+class Trazador:
+    """Acumula los tramos (ms) y datos de una solicitud identificada por su id de correlación."""
+
+    def __init__(self, id_correlacion: str | None = None):
+        self.id_correlacion = id_correlacion or uuid.uuid4().hex
+        self.tramos = {}
+        self.datos = {}
+        self._inicio = time.perf_counter()
+
+    @contextmanager
+    def tramo(self, nombre: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.agregar_tramo(nombre, (time.perf_counter() - inicio) * 1000)
+
+    def agregar_tramo(self, nombre: str, ms: float):
+        self.tramos[nombre] = round(self.tramos.get(nombre, 0.0) + ms, 2)
+
+    def registrar(self, **datos):
+        self.datos.update(datos)
+
+    def resumen(self) -> dict:
+        return {
+            "correlation_id": self.id_correlacion,
+            "total_ms": round((time.perf_counter() - self._inicio) * 1000, 2),
+            "tramos_ms": dict(self.tramos),
+            "rss_mb": rss_mb(),
+            **self.datos,
+        }
+
+    def emitir(self, origen: str) -> dict:
+        """Escribe una línea de log estructurada (JSON) con el resumen de la solicitud."""
+        resumen = self.resumen()
+        print(json.dumps({"evento": "solicitud", "origen": origen, **resumen}, ensure_ascii=False))
+        return resumen
+
+
+# --- PERFILADO MUESTREADO ---
+
+@contextmanager
+def perfil_cprofile(trazador: Trazador, top: int = 25):
+    """Perfila la solicitud con cProfile y escribe las funciones más costosas en el log."""
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats('cumulative').print_stats(top)
+        print(json.dumps({"evento": "perfil", "correlation_id": trazador.id_correlacion, "stats": salida.getvalue()}))
+
+
+_perfilador = perfil_cprofile
+
+
+def establecer_perfilador(fabrica):
+    """Reemplaza el perfilador: fabrica(trazador) debe devolver un context manager."""
+    global _perfilador
+    _perfilador = fabrica
+
+
+def perfilar(trazador: Trazador, fraccion: float):
+    """Devuelve el perfilador para una fracción `fraccion` de las solicitudes; si no, un no-op."""
+    if fraccion > 0 and random.random() < fraccion:
+        return _perfilador(trazador)
+    return nullcontext()
@@ -0,0 +1,9 @@
+# Los módulos del backend se importan por nombre (como en el Endpoint y la Lambda)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Back_End'))
+
+# Entorno de una Lambda ya configurada con su Endpoint (las pruebas inyectan el runtime)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('ENDPOINT_NAME', 'rag-proxy-pruebas')
@@ -0,0 +1,130 @@
+import os
+import random
+import zipfile
+
+import pytest
+
+from artifact_fetch import MARCADOR_FILE, descargar_artefacto, leer_marcador
+from benchmark import S3Local
+
+ARCHIVOS = {
+    "flat_index/vectores.npy": random.Random(0).randbytes(300_000),
+    "flat_index/meta.json": b'{"dimension": 384}',
+    "bm25.json": b'{"terminos": {"servicio": [1, 2, 3]}}' * 2000,
+    "corpus.json": "[{\"fuente\": \"titulación\"}]".encode('utf-8'),
+}
+
+
+def crear_zip(ruta, archivos=ARCHIVOS):
+    with zipfile.ZipFile(ruta, 'w') as zip_ref:
+        for nombre, datos in archivos.items():
+            compresion = zipfile.ZIP_STORED if nombre.endswith('.npy') else zipfile.ZIP_DEFLATED
+            zip_ref.writestr(nombre, datos, compress_type=compresion)
+
+
+def contenido(carpeta):
+    archivos = {}
+    for raiz, _, nombres in os.walk(carpeta):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            with open(ruta, 'rb') as f:
+                archivos[os.path.relpath(ruta, carpeta).replace(os.sep, '/')] = f.read()
+    return archivos
+
+
+@pytest.fixture
+def s3(tmp_path):
+    carpeta = tmp_path / "s3"
+    carpeta.mkdir()
+    crear_zip(carpeta / "chroma_db.zip")
+    return S3Local(str(carpeta))
+
+
+def test_descarga_por_partes_reproduce_el_zip(s3, tmp_path):
+    destino = str(tmp_path / "db")
+    etag = descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024, paralelas=3)
+
+    assert etag == s3.head_object("bucket", "chroma_db.zip")["ETag"]
+    archivos = contenido(destino)
+    assert archivos.pop(MARCADOR_FILE)
+    assert archivos == ARCHIVOS
+    assert s3.gets > 3
+
+
+def test_misma_version_no_vuelve_a_descargar(s3, tmp_path):
+    destino = str(tmp_path / "db")
+    descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024)
+    gets = s3.gets
+
+    etag = descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024)
+
+    assert s3.gets == gets
+    assert leer_marcador(destino)["etag"] == etag
+
+
+def test_nueva_version_reemplaza_la_extraida(s3, tmp_path):
+    destino = str(tmp_path / "db")
+    descargar_artefacto(s3, "bucket", "chroma_db.zip", destino)
+    nuevos = {"bm25.json": b'{"terminos": {}}'}
+    crear_zip(os.path.join(s3.carpeta, "chroma_db.zip"), nuevos)
+    gets = s3.gets
+
+    descargar_artefacto(s3, "bucket", "chroma_db.zip", destino)
+
+    assert s3.gets > gets
+    archivos = contenido(destino)
+    archivos.pop(MARCADOR_FILE)
+    assert archivos == nuevos
+
+
+def test_etag_distinto_durante_la_descarga_falla_sin_reintentar(s3, tmp_path):
+    destino = str(tmp_path / "db")
+    cabecera = s3.head_object
+    s3.head_object = lambda Bucket, Key: dict(cabecera(Bucket, Key), ETag='"version-anterior"')
+
+    with pytest.raises(RuntimeError, match="PreconditionFailed"):
+        descargar_artefacto(s3, "bucket", "chroma_db.zip", destino)
+
+    assert s3.gets == 1
+    assert leer_marcador(destino) is None
+
+
+def test_miembro_corrupto_falla_por_crc(s3, tmp_path):
+    ruta_zip = os.path.join(s3.carpeta, "chroma_db.zip")
+    with zipfile.ZipFile(ruta_zip) as zip_ref:
+        info = zip_ref.getinfo("flat_index/vectores.npy")
+    datos = bytearray(open(ruta_zip, 'rb').read())
+    inicio = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+    datos[inicio + 1000] ^= 0xFF
+    with open(ruta_zip, 'wb') as f:
+        f.write(datos)
+    destino = str(tmp_path / "db")
+
+    with pytest.raises(zipfile.BadZipFile, match="CRC"):
+        descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024)
+
+    assert leer_marcador(destino) is None
+    assert not os.path.exists(destino + ".parcial")
+
+
+def test_descarga_fallida_conserva_la_version_anterior(s3, tmp_path):
+    destino = str(tmp_path / "db")
+    etag = descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024)
+    crear_zip(os.path.join(s3.carpeta, "chroma_db.zip"), {"bm25.json": b'{"terminos": {}}'})
+    get_object = s3.get_object
+
+    def get_object_cortado(**kwargs):
+        if s3.gets >= 1:
+            raise ConnectionError("conexión reiniciada")
+        return get_object(**kwargs)
+
+    s3.gets = 0
+    s3.get_object = get_object_cortado
+    with pytest.raises(ConnectionError):
+        descargar_artefacto(s3, "bucket", "chroma_db.zip", destino, parte=64 * 1024)
+
+    assert leer_marcador(destino)["etag"] == etag
+    archivos = contenido(destino)
+    archivos.pop(MARCADOR_FILE)
+    assert archivos == ARCHIVOS
+    assert not os.path.exists(destino + ".parcial")
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import cleaner
+
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden', 'cleaner')
+ENTRADAS = sorted(os.listdir(os.path.join(GOLDEN, 'entrada')))
+
+
+def esperado(nombre: str) -> bytes | None:
+    """Salida dorada (de la limpieza original), o None si el archivo no producía salida."""
+    ruta = os.path.join(GOLDEN, 'salida', nombre)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('nombre', ENTRADAS)
+def test_limpiar_archivo_coincide_con_la_salida_dorada(nombre, tmp_path):
+    destino = tmp_path / nombre
+    escrito = cleaner.limpiar_archivo(os.path.join(GOLDEN, 'entrada', nombre), str(destino))
+    assert (destino.read_bytes() if escrito else None) == esperado(nombre)
+
+
+@pytest.mark.parametrize('nombre', ENTRADAS)
+def test_limpieza_en_memoria_coincide_con_la_salida_dorada(nombre):
+    with open(os.path.join(GOLDEN, 'entrada', nombre), 'r', encoding='utf-8', errors='ignore') as f:
+        limpio = cleaner.limpieza(f.read())
+    assert (limpio.encode('utf-8') if len(limpio.strip()) > 30 else None) == esperado(nombre)
@@ -0,0 +1,27 @@
+from embedding_cache import cambios_indice, id_fragmento
+
+
+def test_metadatos_cambiados_se_actualizan_sin_reinsertar():
+    texto = "Requisitos de titulación"
+    mismo = id_fragmento("plan.txt", texto)
+    fragmentos = {
+        mismo: {"source": "plan.txt", "seccion": "Titulación", "tokens": 4},
+        "nuevo": {"source": "plan.txt", "seccion": "Servicio social", "tokens": 6},
+        "igual": {"source": "plan.txt", "seccion": "Inglés", "tokens": 3},
+    }
+    existentes = {
+        mismo: {"source": "plan.txt", "seccion": "Egreso", "tokens": 5},
+        "igual": {"source": "plan.txt", "seccion": "Inglés", "tokens": 3},
+        "viejo": {"source": "plan.txt"},
+    }
+
+    nuevos, obsoletos, actualizar = cambios_indice(fragmentos, existentes)
+
+    assert nuevos == ["nuevo"]
+    assert obsoletos == ["viejo"]
+    assert actualizar == [mismo]
+
+
+def test_metadatos_nulos_en_el_indice_cuentan_como_cambio():
+    nuevos, obsoletos, actualizar = cambios_indice({"a": {"seccion": "X"}}, {"a": None})
+    assert (nuevos, obsoletos, actualizar) == ([], [], ["a"])
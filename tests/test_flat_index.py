@@ -0,0 +1,112 @@
+import hashlib
+import random
+
+import numpy as np
+import pytest
+
+from flat_index import Fragmento, IndicePlano, exportar_indice_plano, paridad_por_consulta, verificar_paridad
+
+DIMENSION = 64
+PALABRAS = ("servicio social titulación inglés admisión semestre créditos tutorías plan estudios "
+            "requisitos egreso prácticas profesionales ceneval tesis horas alumnos docentes programa").split()
+
+
+def _aleatorio(clave: str) -> np.ndarray:
+    semilla = int.from_bytes(hashlib.sha256(clave.encode()).digest()[:4], 'little')
+    return np.random.default_rng(semilla).standard_normal(DIMENSION).astype(np.float32)
+
+
+class EmbeddingsFalsos:
+    """Embeddings deterministas sin modelo: bolsa de palabras proyectada con hashes, más un
+    componente propio de cada texto para que no haya empates."""
+
+    def embed_documents(self, textos):
+        vectores = []
+        for texto in textos:
+            vector = 0.5 * _aleatorio(texto)
+            for palabra in texto.lower().split():
+                vector += _aleatorio(palabra)
+            vectores.append(vector.tolist())
+        return vectores
+
+    def embed_query(self, texto):
+        return self.embed_documents([texto])[0]
+
+
+class ChromaExacto:
+    """Referencia con la interfaz de langchain Chroma: coseno exacto sobre los vectores sin normalizar."""
+
+    def __init__(self, textos, vectores):
+        self.textos = textos
+        self.vectores = np.asarray(vectores, dtype=np.float64)
+
+    def similarity_search_by_vector(self, vector, k):
+        vector = np.asarray(vector, dtype=np.float64)
+        cosenos = self.vectores @ vector / (np.linalg.norm(self.vectores, axis=1) * np.linalg.norm(vector))
+        return [Fragmento(self.textos[i]) for i in np.argsort(-cosenos, kind='stable')[:k]]
+
+
+def fixture_corpus():
+    rng = random.Random(7)
+    textos = sorted({" ".join(rng.choice(PALABRAS) for _ in range(rng.randint(4, 14))) for _ in range(80)})
+    consultas = [" ".join(rng.choice(PALABRAS) for _ in range(3)) for _ in range(12)]
+    return textos, consultas
+
+
+@pytest.fixture
+def indice(tmp_path):
+    textos, _ = fixture_corpus()
+    vectores = EmbeddingsFalsos().embed_documents(textos)
+    exportar_indice_plano(textos, [{"source": f"doc{i}.txt"} for i in range(len(textos))], vectores, str(tmp_path))
+    return IndicePlano(str(tmp_path)), textos, vectores
+
+
+def test_top_k_igual_a_la_busqueda_exacta(indice):
+    plano, textos, vectores = indice
+    _, consultas = fixture_corpus()
+    # Sin casi-empates en el top-k, el orden no depende de la aritmética de cada motor
+    puntajes = -np.sort(-plano.puntuar(EmbeddingsFalsos().embed_documents(consultas)), axis=1)[:, :8]
+    assert np.diff(puntajes, axis=1).max() < -1e-4
+    referencia = ChromaExacto(textos, vectores)
+    assert verificar_paridad(referencia, plano, EmbeddingsFalsos(), consultas, k=7) == 1.0
+    vectores_consultas = EmbeddingsFalsos().embed_documents(consultas)
+    for vector, docs in zip(vectores_consultas, plano.buscar_por_vectores(vectores_consultas, 7)):
+        # Con el coseno exacto coincide también el orden
+        assert [d.page_content for d in docs] == [d.page_content for d in referencia.similarity_search_by_vector(vector, 7)]
+
+
+class ChromaAproximado(ChromaExacto):
+    """Como HNSW: intercambia los dos últimos del top-k y, si `perder`, cambia el último por otro fragmento."""
+
+    def __init__(self, textos, vectores, perder=False):
+        super().__init__(textos, vectores)
+        self.perder = perder
+
+    def similarity_search_by_vector(self, vector, k):
+        docs = super().similarity_search_by_vector(vector, k + 1)
+        docs[k - 2], docs[k - 1] = docs[k - 1], docs[k - 2]
+        if self.perder:
+            docs[k - 2] = docs[k]
+        return docs[:k]
+
+
+def test_paridad_compara_el_top_k_como_conjunto(indice):
+    plano, textos, vectores = indice
+    _, consultas = fixture_corpus()
+    assert verificar_paridad(ChromaAproximado(textos, vectores), plano, EmbeddingsFalsos(), consultas, k=7) == 1.0
+    coincidencias = paridad_por_consulta(ChromaAproximado(textos, vectores, perder=True), plano,
+                                         EmbeddingsFalsos(), consultas, k=7)
+    assert coincidencias == [6 / 7] * len(consultas)
+
+
+def test_top_k_igual_a_chroma(indice):
+    pytest.importorskip("chromadb")
+    Chroma = pytest.importorskip("langchain_community.vectorstores").Chroma
+    plano, textos, _ = indice
+    _, consultas = fixture_corpus()
+    db = Chroma.from_texts(textos, EmbeddingsFalsos(), ids=[str(i) for i in range(len(textos))],
+                           collection_metadata={"hnsw:space": "cosine", "hnsw:search_ef": 200})
+    try:
+        assert verificar_paridad(db, plano, EmbeddingsFalsos(), consultas, k=7) == 1.0
+    finally:
+        db.delete_collection()
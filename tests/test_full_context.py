@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from benchmark import CachesStub
+from full_context import ContextoCompleto
+
+
+def version(gemini, texto):
+    return ContextoCompleto(gemini, "gemini-2.5-flash", [{"fuente": "titulacion_.txt", "texto": texto}])
+
+
+def etiquetas(gemini):
+    return sorted(c.display_name for c in gemini.caches.list())
+
+
+def test_blue_green_no_borra_el_cache_de_la_otra_version():
+    gemini = SimpleNamespace(caches=CachesStub())
+    azul = version(gemini, "corpus v1")
+    verde = version(gemini, "corpus v2")
+    assert etiquetas(gemini) == sorted([azul.etiqueta, verde.etiqueta])
+
+    # Un worker azul que reinicia reutiliza su cache y tampoco borra el verde
+    azul_reiniciado = version(gemini, "corpus v1")
+    assert azul_reiniciado.nombre == azul.nombre
+    assert etiquetas(gemini) == sorted([azul.etiqueta, verde.etiqueta])
+
+
+def test_tercera_version_borra_solo_las_anteriores_a_la_previa():
+    gemini = SimpleNamespace(caches=CachesStub())
+    v1 = version(gemini, "corpus v1")
+    v2 = version(gemini, "corpus v2")
+    v3 = version(gemini, "corpus v3")
+    assert v1.etiqueta not in etiquetas(gemini)
+    assert etiquetas(gemini) == sorted([v2.etiqueta, v3.etiqueta])
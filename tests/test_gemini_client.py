@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from gemini_client import ClienteGeminiConPlazo, PlazoAgotado
+
+
+class GeminiLento:
+    """Generación de prueba que respeta el timeout HTTP recibido, como el SDK."""
+
+    def __init__(self, segundos: float):
+        self.segundos = segundos
+        self.timeouts = []
+        self.llamadas = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, timeout_s):
+        with self._lock:
+            self.llamadas += 1
+            self.timeouts.append(timeout_s)
+        if timeout_s < self.segundos:
+            time.sleep(timeout_s)
+            raise TimeoutError("timeout HTTP")
+        time.sleep(self.segundos)
+        return f"respuesta a {prompt}"
+
+
+def test_cada_intento_recibe_el_tiempo_restante_como_timeout():
+    gemini = GeminiLento(0.01)
+    cliente = ClienteGeminiConPlazo(gemini, max_hilos=2)
+    respuesta, _ = cliente.generar("p", time.monotonic() + 5)
+    assert respuesta == "respuesta a p"
+    assert 4 < gemini.timeouts[0] <= 5
+
+
+def test_intentos_abandonados_liberan_el_pool_al_vencer_el_plazo():
+    gemini = GeminiLento(10)
+    cliente = ClienteGeminiConPlazo(gemini, max_reintentos=0, max_hilos=2)
+    for _ in range(2):
+        with pytest.raises(PlazoAgotado):
+            cliente.generar("lenta", time.monotonic() + 0.2)
+
+    gemini.segundos = 0.01
+    inicio = time.monotonic()
+    respuesta, _ = cliente.generar("nueva", time.monotonic() + 2)
+    assert respuesta == "respuesta a nueva"
+    assert time.monotonic() - inicio < 0.5
+    assert cliente.metricas()["intentos_en_curso"] == 0
+
+
+def test_intento_en_cola_con_plazo_vencido_no_llama_a_gemini():
+    gemini = GeminiLento(0.3)
+    cliente = ClienteGeminiConPlazo(gemini, max_reintentos=0, max_hilos=1)
+    ocupado = threading.Thread(target=cliente.generar, args=("primera", time.monotonic() + 5))
+    ocupado.start()
+    time.sleep(0.05)
+    with pytest.raises(PlazoAgotado):
+        cliente.generar("en cola", time.monotonic() + 0.1)
+    ocupado.join()
+    time.sleep(0.05)
+    assert gemini.llamadas == 1
+
+
+def test_sin_hilos_libres_no_lanza_hedge():
+    gemini = GeminiLento(0.2)
+    cliente = ClienteGeminiConPlazo(gemini, hedge_habilitado=True, hedge_min_muestras=1, max_hilos=1)
+    cliente._latencias.append(0.01)
+    _, detalle = cliente.generar("p", time.monotonic() + 5)
+    assert not detalle["hedge"]
+    assert cliente.metricas()["hedges"] == 0
+
+
+class StreamFalso:
+    """Stream de prueba: falla con `errores` transitorios antes del primer fragmento y se detiene tras `pausa_en`."""
+
+    def __init__(self, fragmentos, errores=0, pausa_en=None, pausa=0.0):
+        self.fragmentos = fragmentos
+        self.errores = errores
+        self.pausa_en = pausa_en
+        self.pausa = pausa
+        self.timeouts = []
+
+    def __call__(self, prompt, timeout_s):
+        self.timeouts.append(timeout_s)
+        if self.errores:
+            self.errores -= 1
+            raise ConnectionError("conexión reiniciada")
+        for i, fragmento in enumerate(self.fragmentos):
+            if i == self.pausa_en:
+                time.sleep(self.pausa)
+            yield fragmento
+
+
+def test_stream_reintenta_antes_del_primer_fragmento():
+    stream = StreamFalso(["a", "b"], errores=1)
+    cliente = ClienteGeminiConPlazo(None, backoff_base=0.01, generar_stream=stream)
+    assert list(cliente.generar_en_stream("p", time.monotonic() + 5)) == ["a", "b"]
+    assert len(stream.timeouts) == 2 and 4 < stream.timeouts[0] <= 5
+    assert cliente.metricas()["reintentos"] == 1
+
+
+def test_stream_detenido_agota_el_plazo_sin_reintentar():
+    stream = StreamFalso(["a", "b"], pausa_en=1, pausa=0.3)
+    cliente = ClienteGeminiConPlazo(None, generar_stream=stream)
+    recibidos = []
+    with pytest.raises(PlazoAgotado):
+        for fragmento in cliente.generar_en_stream("p", time.monotonic() + 0.1):
+            recibidos.append(fragmento)
+    assert recibidos == ["a"]
+    assert len(stream.timeouts) == 1
+    assert cliente.metricas()["plazos_agotados"] == 1
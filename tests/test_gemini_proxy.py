@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('google.genai')
+import gemini_proxy
+from gemini_client import ClienteGeminiConPlazo
+
+
+class CacheFalso:
+    def __init__(self):
+        self.guardados = []
+
+    def buscar(self, vector):
+        return None
+
+    def guardar(self, vector, texto):
+        self.guardados.append(texto)
+
+
+def contexto(cache, generar=None, generar_stream=None):
+    return {
+        'embeddings': SimpleNamespace(embed_documents=lambda textos: [[1.0, 0.0] for _ in textos]),
+        'buscar': lambda preguntas, vectores, k: [[] for _ in preguntas],
+        'llm': ClienteGeminiConPlazo(generar, generar_stream=generar_stream),
+        'cache': cache,
+    }
+
+
+def test_respuesta_bloqueada_no_se_cachea():
+    cache = CacheFalso()
+    bloqueada = lambda prompt, timeout_s: SimpleNamespace(text=None, usage_metadata=None)
+    resultado = gemini_proxy.predict_fn({'inputs': 'x'}, contexto(cache, generar=bloqueada))
+    assert resultado[0]['generated_text'] == ''
+    assert cache.guardados == []
+
+
+def test_stream_vacio_no_se_cachea():
+    cache = CacheFalso()
+    vacio = lambda prompt, timeout_s: iter([SimpleNamespace(text=None, usage_metadata=None)])
+    fragmentos = list(gemini_proxy.predict_fn({'inputs': 'x', 'stream': True}, contexto(cache, generar_stream=vacio)))
+    assert fragmentos == [{'generated_text': '', 'done': True}]
+    assert cache.guardados == []
+
+
+def test_respuesta_con_texto_se_cachea():
+    cache = CacheFalso()
+    normal = lambda prompt, timeout_s: SimpleNamespace(text=' Hola ', usage_metadata=None)
+    gemini_proxy.predict_fn({'inputs': 'x'}, contexto(cache, generar=normal))
+    assert cache.guardados == ['Hola']
+
+
+def test_lote_con_plazo_cero_falla_rapido():
+    llamadas = []
+    generar = lambda prompt, timeout_s: llamadas.append(prompt) or SimpleNamespace(text='Hola', usage_metadata=None)
+    resultados = gemini_proxy.predict_fn({'inputs': ['a', 'b'], 'deadline_ms': 0}, contexto(None, generar=generar))
+    assert [r['error'] for r in resultados] == ['DEADLINE_EXCEEDED'] * 2
+    assert llamadas == []
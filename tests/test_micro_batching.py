@@ -0,0 +1,62 @@
+import threading
+import time
+
+from micro_batching import AgrupadorConsultas
+
+
+class EmbeddingsLentos:
+    def __init__(self, ms: float = 0.0):
+        self.ms = ms
+        self.lotes = []
+
+    def embed_documents(self, textos):
+        self.lotes.append(len(textos))
+        time.sleep(self.ms / 1000)
+        return [[float(len(t))] for t in textos]
+
+
+def buscar(preguntas, vectores, k):
+    return [[p] for p in preguntas]
+
+
+def test_sin_otras_solicitudes_no_espera_la_ventana():
+    agrupador = AgrupadorConsultas(EmbeddingsLentos(), buscar, max_lote=16, max_espera_ms=500)
+    inicio = time.monotonic()
+    for pregunta in ("a", "bb", "ccc"):
+        with agrupador.solicitud():
+            assert agrupador.consultar(pregunta, timeout=5).docs == [pregunta]
+    assert time.monotonic() - inicio < 0.5
+    assert agrupador.lote_maximo == 1
+
+
+def test_solicitudes_concurrentes_se_agrupan():
+    embeddings = EmbeddingsLentos(ms=20)
+    agrupador = AgrupadorConsultas(embeddings, buscar, max_lote=16, max_espera_ms=50)
+    barrera = threading.Barrier(8)
+    resultados = {}
+
+    def solicitud(i):
+        with agrupador.solicitud():
+            barrera.wait()
+            resultados[i] = agrupador.consultar(f"pregunta {i}", timeout=5)
+
+    hilos = [threading.Thread(target=solicitud, args=(i,)) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(5)
+
+    assert sorted(resultados) == list(range(8))
+    assert all(r.docs == [f"pregunta {i}"] for i, r in resultados.items())
+    assert agrupador.lote_maximo > 1
+    assert sum(embeddings.lotes) == 8
+
+
+def test_solicitud_que_no_consulta_no_retiene_el_lote():
+    agrupador = AgrupadorConsultas(EmbeddingsLentos(), buscar, max_lote=16, max_espera_ms=10_000)
+    with agrupador.solicitud():
+        pass
+    inicio = time.monotonic()
+    with agrupador.solicitud():
+        agrupador.consultar("a", timeout=5)
+    assert time.monotonic() - inicio < 1
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import scraper
+
+PAGINAS = {
+    "/": ['/a', '/b', '/a', '/#inicio'],
+    "/a": ['/b', '/'],
+    "/b": ['/c'],
+    "/c": [],
+}
+
+
+class Sitio(BaseHTTPRequestHandler):
+    """Sitio de prueba: cada página enlaza a otras y responde 304 si el ETag coincide."""
+    solicitudes = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        etag = f'"v1{self.path.replace("/", "-")}"'
+        Sitio.solicitudes.append((time.monotonic(), self.path, self.headers.get('If-None-Match')))
+        if self.path not in PAGINAS:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        enlaces = "".join(f'<a href="{link}">enlace</a>' for link in PAGINAS[self.path])
+        cuerpo = f"<html><body><p>Contenido de la página {self.path} del sitio de prueba.</p>{enlaces}</body></html>"
+        datos = cuerpo.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+@pytest.fixture
+def sitio():
+    Sitio.solicitudes = []
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Sitio)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    yield f"http://127.0.0.1:{servidor.server_port}/"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def rastrear(base_url, tmp_path, **kwargs):
+    rastreador = scraper.Rastreador(base_url, str(tmp_path / "texts"), concurrencia=4,
+                                    manifiesto=str(tmp_path / "manifest.json"),
+                                    estado=str(tmp_path / "state.sqlite"), **kwargs)
+    return asyncio.run(rastreador.rastrear())
+
+
+def test_rastreo_sin_duplicados_y_con_pausa_por_host(sitio, tmp_path):
+    resumen = rastrear(sitio, tmp_path, pausa_por_host=0.05)
+
+    rutas = [ruta for _, ruta, _ in Sitio.solicitudes]
+    assert sorted(rutas) == sorted(PAGINAS)
+    assert resumen.paginas == 4 and len(resumen.nuevas) == 4
+    tiempos = sorted(t for t, _, _ in Sitio.solicitudes)
+    assert min(b - a for a, b in zip(tiempos, tiempos[1:])) >= 0.04
+
+
+def test_segundo_rastreo_usa_304_y_sigue_los_enlaces_guardados(sitio, tmp_path):
+    rastrear(sitio, tmp_path, pausa_por_host=0)
+    archivos = {p.name: p.stat().st_mtime_ns for p in (tmp_path / "texts").iterdir()}
+    Sitio.solicitudes = []
+
+    resumen = rastrear(sitio, tmp_path, pausa_por_host=0)
+
+    assert sorted(ruta for _, ruta, _ in Sitio.solicitudes) == sorted(PAGINAS)
+    assert all(etag for _, _, etag in Sitio.solicitudes)
+    assert resumen.sin_cambios == 4 and not resumen.nuevas and not resumen.modificadas
+    assert {p.name: p.stat().st_mtime_ns for p in (tmp_path / "texts").iterdir()} == archivos
+    manifiesto = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))
+    assert manifiesto[sitio + "b"]["links"] == [sitio + "c"]
+
+
+# Rastreo que muere (os._exit) justo después de que la página inicial queda hecha y confirmada
+RASTREO_CORTADO = """
+import asyncio, os, sys
+sys.path.insert(0, sys.argv[1])
+import scraper
+
+completar = scraper.EstadoRastreo.completar
+
+def completar_y_cortar(self, url, entrada=None, cambio=None):
+    completar(self, url, entrada, cambio)
+    self.confirmar()
+    if url == sys.argv[2]:
+        os._exit(1)
+
+scraper.EstadoRastreo.completar = completar_y_cortar
+asyncio.run(scraper.Rastreador(sys.argv[2], sys.argv[3] + "/texts", concurrencia=1, pausa_por_host=0,
+                               manifiesto=sys.argv[3] + "/manifest.json",
+                               estado=sys.argv[3] + "/state.sqlite").rastrear())
+"""
+
+
+def test_corte_tras_completar_una_pagina_no_pierde_sus_enlaces(sitio, tmp_path):
+    proceso = subprocess.run([sys.executable, "-c", RASTREO_CORTADO, os.path.dirname(scraper.__file__),
+                              sitio, str(tmp_path)], capture_output=True)
+    assert proceso.returncode == 1
+    Sitio.solicitudes = []
+
+    resumen = rastrear(sitio, tmp_path, pausa_por_host=0, reanudar=True)
+
+    assert sorted(ruta for _, ruta, _ in Sitio.solicitudes) == ["/a", "/b", "/c"]
+    manifiesto = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))
+    assert sorted(manifiesto) == sorted(sitio + ruta.lstrip("/") for ruta in PAGINAS)
+    assert len(resumen.nuevas) == 4
@@ -0,0 +1,36 @@
+import errno
+
+import pytest
+
+import shared_serving
+
+
+def test_usa_memoria_compartida_si_cabe(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_serving, "espacio_libre", lambda carpeta: 64 * 1024 * 1024)
+    carpeta = shared_serving.carpeta_con_espacio(10 * 1024 * 1024, str(tmp_path / "shm"), str(tmp_path / "disco"))
+    assert carpeta == str(tmp_path / "shm")
+
+
+def test_sin_espacio_en_memoria_compartida_usa_disco(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_serving, "espacio_libre", lambda carpeta: 64 * 1024 * 1024)
+    carpeta = shared_serving.carpeta_con_espacio(470 * 1024 * 1024, str(tmp_path / "shm"), str(tmp_path / "disco"))
+    assert carpeta == str(tmp_path / "disco")
+    assert (tmp_path / "disco").is_dir()
+
+
+def test_espacio_libre_lee_statvfs(tmp_path):
+    assert shared_serving.espacio_libre(str(tmp_path)) > 0
+    assert shared_serving.sin_espacio(OSError(errno.ENOSPC, "No space left on device"))
+
+
+def test_pesos_que_no_caben_en_shm_se_comparten_desde_disco(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    modulo = torch.nn.Linear(256, 256)
+    esperado = {k: v.clone() for k, v in modulo.state_dict().items()}
+    monkeypatch.setattr(shared_serving, "espacio_libre",
+                        lambda carpeta: 1024 if carpeta == str(tmp_path / "shm") else 1 << 40)
+
+    ruta = shared_serving.compartir_pesos(modulo, str(tmp_path / "shm"), str(tmp_path / "disco"))
+
+    assert ruta == str(tmp_path / "disco" / shared_serving.PESOS_FILE)
+    assert all(torch.equal(modulo.state_dict()[k], v) for k, v in esperado.items())
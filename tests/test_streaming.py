@@ -0,0 +1,204 @@
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import Lambda_Handler
+
+
+class RuntimeStream:
+    """Runtime de SageMaker de prueba: devuelve los fragmentos dados, con una pausa entre ellos."""
+
+    def __init__(self, fragmentos, pausa=0.0):
+        self.fragmentos = fragmentos
+        self.pausa = pausa
+
+    def invoke_endpoint_with_response_stream(self, **_):
+        def partes():
+            for fragmento in self.fragmentos:
+                time.sleep(self.pausa)
+                yield {'PayloadPart': {'Bytes': (json.dumps(fragmento) + '\n').encode()}}
+        return {'Body': partes()}
+
+
+def evento_stream(pregunta='¿Cómo me titulo?'):
+    return {'httpMethod': 'POST', 'body': json.dumps({'question': pregunta, 'stream': True})}
+
+
+def test_stream_con_plazo_agotado_devuelve_504(monkeypatch):
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeStream(
+        [{'error': 'DEADLINE_EXCEEDED', 'message': 'Plazo agotado', 'done': True}]))
+    respuesta = Lambda_Handler.lambda_handler(evento_stream(), None)
+    assert respuesta['statusCode'] == 504
+    assert json.loads(respuesta['body'])['code'] == 'DEADLINE_EXCEEDED'
+
+
+def test_stream_normal_devuelve_ndjson(monkeypatch):
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeStream(
+        [{'token': 'Hola'}, {'token': ' mundo'}, {'generated_text': 'Hola mundo', 'done': True}]))
+    respuesta = Lambda_Handler.lambda_handler(evento_stream(), None)
+    lineas = [json.loads(l) for l in respuesta['body'].splitlines()]
+    assert respuesta['statusCode'] == 200
+    assert lineas == [{'token': 'Hola'}, {'token': ' mundo'}, {'answer': 'Hola mundo', 'done': True}]
+
+
+def test_proxy_stream_con_plazo_agotado_emite_un_fragmento():
+    pytest.importorskip('google.genai')
+    import gemini_proxy
+
+    contexto = {
+        'gemini_client': None,
+        'embeddings': SimpleNamespace(embed_documents=lambda textos: [[1.0, 0.0] for _ in textos]),
+        'buscar': lambda preguntas, vectores, k: [[] for _ in preguntas],
+        'llm': SimpleNamespace(metricas=lambda: {}),
+        'cache': None,
+    }
+    prediccion = gemini_proxy.predict_fn({'inputs': 'x', 'stream': True, 'deadline_ms': 0}, contexto)
+    fragmentos = list(prediccion)
+    assert fragmentos == [{'error': 'DEADLINE_EXCEEDED', 'message': 'Plazo agotado antes de llamar a Gemini.', 'done': True}]
+
+    # En modo directo la Lambda recibe ese único fragmento final (el que convierte en 504)
+    runtime = Lambda_Handler.RuntimeDirecto(gemini_proxy, contexto)
+    partes = runtime.invoke_endpoint_with_response_stream(None, None, None, json.dumps({'inputs': 'x', 'stream': True, 'deadline_ms': 0}))
+    assert [json.loads(p['PayloadPart']['Bytes']) for p in partes['Body']][0]['done'] is True
+
+
+def test_proxy_stream_con_plazo_agotado_a_mitad_termina_con_error():
+    pytest.importorskip('google.genai')
+    import gemini_proxy
+    from gemini_client import ClienteGeminiConPlazo
+
+    def stream_detenido(prompt, timeout_s):
+        yield SimpleNamespace(text='Hola', usage_metadata=None)
+        time.sleep(0.3)
+        yield SimpleNamespace(text=' mundo', usage_metadata=None)
+
+    contexto = {
+        'embeddings': SimpleNamespace(embed_documents=lambda textos: [[1.0, 0.0] for _ in textos]),
+        'buscar': lambda preguntas, vectores, k: [[] for _ in preguntas],
+        'llm': ClienteGeminiConPlazo(None, generar_stream=stream_detenido),
+        'cache': None,
+    }
+    fragmentos = list(gemini_proxy.predict_fn({'inputs': 'x', 'stream': True, 'deadline_ms': 100}, contexto))
+    assert fragmentos[0] == {'token': 'Hola'}
+    assert fragmentos[-1]['error'] == 'DEADLINE_EXCEEDED' and fragmentos[-1]['done'] is True
+    assert len(fragmentos) == 2
+
+
+def test_proxy_stream_se_concatena_por_defecto_para_mms():
+    pytest.importorskip('google.genai')
+    import gemini_proxy
+
+    cuerpo = gemini_proxy.output_fn(iter([{'token': 'Hola'}, {'generated_text': 'Hola', 'done': True}]), 'application/jsonlines')
+    assert isinstance(cuerpo, str)
+    assert [json.loads(l) for l in cuerpo.splitlines()][-1]['done'] is True
+
+
+class RuntimeAPI(BaseHTTPRequestHandler):
+    """Runtime API de Lambda mínima: registra cuándo llega cada trozo de la respuesta."""
+    trozos = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        while True:
+            largo = int(self.rfile.readline().strip(), 16)
+            if largo == 0:
+                self.rfile.readline()
+                break
+            RuntimeAPI.trozos.append((time.monotonic(), self.rfile.read(largo)))
+            self.rfile.readline()
+        self.send_response(202)
+        self.end_headers()
+
+
+def test_runtime_streaming_envia_cada_linea_al_generarse(monkeypatch):
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeStream(
+        [{'token': 'a'}, {'token': 'b'}, {'generated_text': 'ab', 'done': True}], pausa=0.2))
+    servidor = HTTPServer(('127.0.0.1', 0), RuntimeAPI)
+    hilo = threading.Thread(target=servidor.handle_request, daemon=True)
+    hilo.start()
+
+    import http.client
+    conexion = http.client.HTTPConnection('127.0.0.1', servidor.server_port)
+    contexto = SimpleNamespace(aws_request_id='r1', get_remaining_time_in_millis=lambda: 30000)
+    Lambda_Handler.atender_invocacion_streaming(conexion, 'r1', evento_stream(), contexto)
+    hilo.join(5)
+    servidor.server_close()
+
+    preludio, *lineas = [datos for _, datos in RuntimeAPI.trozos]
+    assert preludio.endswith(Lambda_Handler.SEPARADOR_STREAMING)
+    assert json.loads(preludio[:-8])['statusCode'] == 200
+    assert [json.loads(l) for l in lineas] == [{'token': 'a'}, {'token': 'b'}, {'answer': 'ab', 'done': True}]
+    # Las líneas llegan separadas en el tiempo, no todas juntas al final
+    tiempos = [t for t, _ in RuntimeAPI.trozos[1:]]
+    assert tiempos[-1] - tiempos[0] >= 0.3
+
+
+class ProxyFalso:
+    """Módulo de Proxy mínimo para RuntimeDirecto."""
+
+    @staticmethod
+    def predict_fn(data, contexto):
+        return [{'generated_text': 'respuesta'}]
+
+    @staticmethod
+    def output_fn(prediccion, accept):
+        return json.dumps(prediccion)
+
+
+class RuntimeEndpoint:
+    def invoke_endpoint(self, **_):
+        return {'Body': io.BytesIO(json.dumps([{'generated_text': 'respuesta'}]).encode())}
+
+
+@pytest.mark.parametrize('runtime, tramo', [
+    (Lambda_Handler.RuntimeDirecto(ProxyFalso, {}), 'invoke_directo'),
+    (RuntimeEndpoint(), 'invoke_sagemaker'),
+])
+def test_tramo_de_invocacion_segun_el_runtime_inyectado(monkeypatch, runtime, tramo):
+    monkeypatch.setattr(Lambda_Handler, 'runtime', runtime)
+    evento = {'httpMethod': 'POST', 'body': json.dumps({'question': '¿Cómo me titulo?', 'timings': True})}
+    cuerpo = json.loads(Lambda_Handler.lambda_handler(evento, None)['body'])
+    assert cuerpo['answer'] == 'respuesta'
+    otro = ({'invoke_directo', 'invoke_sagemaker'} - {tramo}).pop()
+    assert tramo in cuerpo['timings']['lambda_ms'] and otro not in cuerpo['timings']['lambda_ms']
+
+
+def lineas_de_log(caplog):
+    return [json.loads(r.getMessage()) for r in caplog.records if r.getMessage().startswith('{"evento": "solicitud"')]
+
+
+def test_stream_registra_la_solicitud_al_terminar(monkeypatch, caplog):
+    caplog.set_level('INFO')
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeStream(
+        [{'token': 'Hola'}, {'generated_text': 'Hola', 'done': True}]))
+    respuesta = Lambda_Handler.lambda_handler(evento_stream(), None, streaming=True)
+    assert lineas_de_log(caplog) == []
+
+    list(respuesta['body'])
+    [registro] = lineas_de_log(caplog)
+    assert registro['stream'] is True and registro['codigo'] == 200
+    assert {'parse_json', 'primer_fragmento'} <= set(registro['tramos_ms'])
+
+
+def test_lote_registra_la_solicitud(monkeypatch, caplog):
+    caplog.set_level('INFO')
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeEndpoint())
+    evento = {'httpMethod': 'POST', 'body': json.dumps({'questions': ['¿Cómo me titulo?']})}
+    assert Lambda_Handler.lambda_handler(evento, None)['statusCode'] == 200
+    [registro] = lineas_de_log(caplog)
+    assert registro['lote'] == 1 and 'invoke_sagemaker' in registro['tramos_ms']
+
+
+def test_sin_endpoint_en_modo_sagemaker_responde_error_claro(monkeypatch, caplog):
+    monkeypatch.setattr(Lambda_Handler, 'ENDPOINT_NAME', None)
+    monkeypatch.setattr(Lambda_Handler, 'runtime', RuntimeEndpoint())
+    evento = {'httpMethod': 'POST', 'body': json.dumps({'question': '¿Cómo me titulo?'})}
+    assert Lambda_Handler.lambda_handler(evento, None)['statusCode'] == 500
+    assert any('ENDPOINT_NAME' in r.getMessage() for r in caplog.records)